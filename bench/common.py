@@ -0,0 +1,23 @@
+# coding: utf-8
+"""what the node benchmarks share (they put the top of the tree on sys.path
+to import it as bench.common)"""
+
+from contextlib import contextmanager
+
+from jzmq.runtime import Runtime
+
+
+@contextmanager
+def bench_nodes(make, shared=False, **runtime_kw):
+    """make(runtime=...) some nodes, giving them one Runtime(**runtime_kw)
+    if shared (None otherwise), and yield (nodes, runtime); the nodes, and
+    then the Runtime, are closed on the way out"""
+    runtime = Runtime(**runtime_kw) if shared else None
+    nodes = make(runtime=runtime)
+    try:
+        yield nodes, runtime
+    finally:
+        for node in nodes:
+            node.closekill()
+        if runtime is not None:
+            runtime.close()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""end-to-end throughput and latency over the t/arch test topologies
+
+    python bench/e2e.py                           # NOTES.txt, A publishing
+    python bench/e2e.py -a t/resource/tarch/ring.txt -s A -s C -r 2000 -S 1024
+    python bench/e2e.py -t inproc                 # no TCP, no CURVE
+
+Builds the nodes with t.arch.generate_nodes(), has each --source publish
+--messages messages of --size bytes at --rate messages/s (0: as fast as
+it can), and polls every node in one loop until everything arrived or
+nothing has for --drain seconds. Every node but the source should get
+each message once. For every receiver we report how many messages
+arrived, how many never did, how many came out of poll() more than once
+and the p50/p99/p999 latency from publish_message() to poll() returning.
+
+With --transport ipc or inproc the nodes skip TCP and CURVE; inproc ones
+share a Runtime (they can only reach sockets in the same context), as do
+the others with --shared.
+
+Everything runs in this process and thread, so the latency includes
+waiting for the loop to get around to a node; compare runs with each
+other rather than with a real deployment.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import tempfile
+from functools import partial
+from collections import Counter, defaultdict
+
+import click
+
+# t.arch lives in the tests and bench.common next to us, not in the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+import t.arch
+from bench.common import bench_nodes
+from jzmq.dedup import DEDUP_BACKENDS, DEFAULT_DEDUP
+from jzmq.sockopts import SOCKOPT_PROFILES, DEFAULT_SOCKOPTS
+
+SETTLE = 0.5  # seconds of polling before we start, so subscriptions propagate
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Load:
+    def __init__(self, nodes, names, sources, messages, size, rate):
+        self.nodes = dict(zip(names, nodes))
+        self.sources = sources
+        self.messages = messages
+        self.padding = "x" * size
+        self.rate = rate
+        self.sent = Counter()  # source -> messages published
+        self.first = dict()  # (source, i) -> publish time
+        self.latency = defaultdict(list)  # receiver -> seconds
+        self.seen = defaultdict(Counter)  # receiver -> (source, i) -> deliveries
+        self.start = None  # when run() started
+        self.elapsed = None  # from then to the last delivery
+
+    def publish_due(self, now):
+        for src in self.sources:
+            due = self.messages
+            if self.rate:
+                due = min(due, int((now - self.start) * self.rate) + 1)
+            node = self.nodes[src]
+            while self.sent[src] < due:
+                i = self.sent[src]
+                self.first[src, i] = time.perf_counter()
+                node.publish_message((f"{src}:{i}", self.padding))
+                self.sent[src] += 1
+
+    def poll(self):
+        got = 0
+        for name, node in self.nodes.items():
+            for msg in node.poll(0):
+                now = time.perf_counter()
+                src, i = msg[0].rsplit(":", 1)
+                key = src, int(i)
+                if key not in self.first:
+                    continue
+                self.seen[name][key] += 1
+                if self.seen[name][key] == 1:
+                    self.latency[name].append(now - self.first[key])
+                got += 1
+        return got
+
+    def expected(self, name):
+        return sum(self.messages for src in self.sources if src != name)
+
+    def done(self):
+        return all(len(self.seen[name]) >= self.expected(name) for name in self.nodes)
+
+    def run(self, drain):
+        self.start = last = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            self.publish_due(now)
+            if self.poll():
+                last = time.perf_counter()
+            sending = any(self.sent[src] < self.messages for src in self.sources)
+            if not sending and (self.done() or now - last > drain):
+                break
+        self.elapsed = last - self.start
+
+    def report(self):
+        nodes = dict()
+        for name in self.nodes:
+            lat = sorted(self.latency[name])
+            received = len(self.seen[name])
+            nodes[name] = dict(
+                received=received,
+                lost=self.expected(name) - received,
+                duplicates=sum(n - 1 for n in self.seen[name].values()),
+                p50=percentile(lat, 0.5),
+                p99=percentile(lat, 0.99),
+                p999=percentile(lat, 0.999),
+            )
+        delivered = sum(n["received"] for n in nodes.values())
+        return dict(
+            elapsed=self.elapsed,
+            published=sum(self.sent.values()),
+            delivered=delivered,
+            msgs_per_sec=delivered / self.elapsed if self.elapsed else None,
+            nodes=nodes,
+        )
+
+
+def ms(secs):
+    return "-" if secs is None else f"{secs * 1000:.3f}"
+
+
+@click.command()
+@click.option("-a", "--arch", "arch_file", default="NOTES.txt", show_default=True)
+@click.option("-s", "--source", "sources", multiple=True, help="[default: A]")
+@click.option("-n", "--messages", default=1000, show_default=True)
+@click.option("-S", "--size", default=64, show_default=True, help="payload bytes")
+@click.option("-r", "--rate", default=0, show_default=True, help="msgs/s per source")
+@click.option("--drain", default=2.0, show_default=True)
+@click.option(
+    "--dedup", type=click.Choice(tuple(DEDUP_BACKENDS)), default=DEFAULT_DEDUP
+)
+@click.option("--zero-copy", is_flag=True)
+@click.option(
+    "--sockopts", type=click.Choice(tuple(SOCKOPT_PROFILES)), default=DEFAULT_SOCKOPTS
+)
+@click.option(
+    "-t",
+    "--transport",
+    type=click.Choice(("tcp", "ipc", "inproc")),
+    default="tcp",
+    show_default=True,
+)
+@click.option("--shared", is_flag=True, help="one Runtime for every node")
+@click.option("--json", "as_json", is_flag=True, help="print the results as json")
+def main(
+    arch_file,
+    sources,
+    messages,
+    size,
+    rate,
+    drain,
+    dedup,
+    zero_copy,
+    sockopts,
+    transport,
+    shared,
+    as_json,
+):  # pylint: disable=too-many-arguments
+    logging.basicConfig(level=logging.ERROR)
+    # the keyring and, on ipc, the socket files
+    with tempfile.TemporaryDirectory() as tmp:
+        desc = t.arch.read_tarch_description(
+            file=arch_file, transport=transport, ipc_dir=tmp
+        )
+        names = sorted(desc.arch)
+        sources = sources or names[:1]
+        for src in sources:
+            if src not in desc.arch:
+                raise click.BadParameter(
+                    f"no node {src} in {arch_file}", param_hint="-s"
+                )
+
+        shared = shared or transport == "inproc"
+        make = partial(
+            t.arch.generate_nodes,
+            desc.arch,
+            os.path.join(tmp, "keyring"),
+            dedup=dedup,
+            zero_copy=zero_copy,
+            sockopts=sockopts,
+        )
+        with bench_nodes(make, shared) as (nodes, _):
+            load = Load(nodes, names, sources, messages, size, rate)
+            settle = time.monotonic() + SETTLE
+            while time.monotonic() < settle:
+                load.poll()
+            load.run(drain)
+
+    res = load.report()
+    res.update(
+        arch=arch_file,
+        sources=list(sources),
+        messages=messages,
+        size=size,
+        rate=rate,
+        dedup=dedup,
+        zero_copy=zero_copy,
+        sockopts=sockopts,
+        transport=transport,
+        shared=shared,
+    )
+    if as_json:
+        click.echo(json.dumps(res, indent=2))
+        return
+
+    click.echo(
+        f"{arch_file} over {transport}: {res['published']} published by {','.join(sources)}, "
+        f"{res['delivered']} delivered in {res['elapsed']:.3f}s "
+        f"({res['msgs_per_sec'] or 0:,.0f} msgs/s)"
+    )
+    click.echo(
+        f"{'node':>4} {'received':>8} {'lost':>6} {'dups':>6} "
+        f"{'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9}"
+    )
+    for name, n in res["nodes"].items():
+        click.echo(
+            f"{name:>4} {n['received']:>8} {n['lost']:>6} {n['duplicates']:>6} "
+            f"{ms(n['p50']):>9} {ms(n['p99']):>9} {ms(n['p999']):>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
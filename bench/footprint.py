@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""threads and file descriptors per node, with and without a shared Runtime
+
+    python bench/footprint.py                 # 50 nodes in a ring, both ways
+    python bench/footprint.py -n 200 --shared # only the Runtime
+    python bench/footprint.py -n 200 --shared --io-threads 4
+
+Builds --nodes nodes in one process, each connected to the next, and
+reports how many OS threads and fds the process gained per node. Counts
+come from /proc, so this only says something on Linux.
+"""
+
+import os
+import sys
+import logging
+import tempfile
+from functools import partial
+
+import click
+
+# bench.common is next to us rather than in the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from bench.common import bench_nodes
+from jzmq.relay import RelayNode
+from jzmq.runtime import process_footprint
+from jzmq.util import get_ports, increment_ports
+
+
+def ring(n, keyring, **node_kw):
+    nodes = list()
+    pstrings = list()
+    ports = None
+    for i in range(n):
+        ports = get_ports() if ports is None else get_ports(increment_ports(ports))
+        pstrings.append(",".join(str(x) for x in ports))
+        nodes.append(
+            RelayNode(
+                f"*:{pstrings[-1]}", identity=f"fp{i}", keyring=keyring, **node_kw
+            )
+        )
+    for i, node in enumerate(nodes):
+        node.connect_to_endpoints(f"localhost:{pstrings[(i + 1) % n]}")
+    return nodes
+
+
+def measure(n, shared, io_threads):
+    before = process_footprint()
+    with tempfile.TemporaryDirectory() as keyring:
+        make = partial(ring, n, keyring)
+        with bench_nodes(make, shared, io_threads=io_threads):
+            after = process_footprint()
+    return {
+        what: None if count is None else (count - before[what]) / n
+        for what, count in after.items()
+    }
+
+
+@click.command()
+@click.option("-n", "--nodes", default=50, show_default=True)
+@click.option("--shared/--separate", default=None, help="[default: both]")
+@click.option("--io-threads", default=1, show_default=True, help="with --shared")
+def main(nodes, shared, io_threads):
+    logging.basicConfig(level=logging.ERROR)
+    for how in (False, True) if shared is None else (shared,):
+        res = measure(nodes, how, io_threads)
+        label = "shared Runtime" if how else "one context each"
+        click.echo(
+            f"{label:>16}: {nodes} nodes, "
+            f"{res['threads'] or 0:.2f} threads/node, {res['fds'] or 0:.2f} fds/node"
+        )
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
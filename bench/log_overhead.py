@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""per-message cost of relaying with logging at ERROR versus DEBUG
+
+    python bench/log_overhead.py [-n 20000] [-r 3]
+
+Two RelayNodes (A → B) in this process: B publishes, A receives and runs
+the message through its relay workflow. We time from B's first publish to
+A's last poll(). At DEBUG every record is formatted and thrown away, so
+the difference is the cost of building log messages, not of writing them.
+"""
+
+import time
+import logging
+import tempfile
+
+import click
+
+from jzmq.relay import RelayNode
+from jzmq.util import get_ports, increment_ports
+
+BATCH = 100  # messages published per round; stays well under the PUB HWM
+TIMEOUT = 10  # seconds to wait for a round to arrive
+
+
+class Discard(logging.Handler):
+    def emit(self, record):
+        self.format(record)
+
+
+def make_nodes(keyring):
+    pa = get_ports()
+    pb = get_ports(increment_ports(pa))
+    pa, pb = (",".join(str(x) for x in p) for p in (pa, pb))
+    A = RelayNode(f"*:{pa}", identity="bench_A", keyring=keyring)
+    B = RelayNode(f"*:{pb}", identity="bench_B", keyring=keyring)
+    A.connect_to_endpoints(f"localhost:{pb}")
+    deadline = time.monotonic() + TIMEOUT
+    while not B.has_subscribers():
+        if time.monotonic() > deadline:
+            raise TimeoutError("A never subscribed to B")
+        time.sleep(0.01)
+    return A, B
+
+
+def run(A, B, n):
+    """seconds to get n messages from B to A"""
+    start = time.perf_counter()
+    for base in range(0, n, BATCH):
+        count = min(BATCH, n - base)
+        for i in range(count):
+            B.publish_message(f"bench({base + i})")
+        got = 0
+        deadline = time.monotonic() + TIMEOUT
+        while got < count:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"lost {count - got} of {count} messages")
+            got += len(A.poll(10))
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("-n", "--messages", default=20000, show_default=True)
+@click.option("-r", "--repeat", default=3, show_default=True, help="keep the best")
+def main(messages, repeat):
+    root = logging.getLogger()
+    root.addHandler(Discard())
+    with tempfile.TemporaryDirectory() as keyring:
+        A, B = make_nodes(keyring)
+        try:
+            run(A, B, BATCH)  # warm up
+            results = dict()
+            for level in (logging.ERROR, logging.DEBUG):
+                root.setLevel(level)
+                best = min(run(A, B, messages) for _ in range(repeat))
+                root.setLevel(logging.ERROR)
+                results[logging.getLevelName(level)] = best
+        finally:
+            A.closekill()
+            B.closekill()
+
+    for name, secs in results.items():
+        usec = secs / messages * 1e6
+        click.echo(f"{name:>5}: {usec:8.2f} µs/msg ({messages / secs:,.0f} msg/s)")
+    click.echo(f"DEBUG costs {results['DEBUG'] / results['ERROR']:.2f}x ERROR")
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
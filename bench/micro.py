@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""microbenchmarks for the message codec, dedup and route lookups
+
+    python bench/micro.py                # compare against bench/baseline.json
+    python bench/micro.py --save         # record a new baseline
+    python bench/micro.py -k decode      # only the cases matching "decode"
+
+Each case reports the best of --repeat runs in ns/op. A case more than
+--threshold slower than its baseline is a regression, and we exit 1 if
+there are any. We also exit 1 if relaying a 1MB message costs more than
+RELAY_SPREAD times relaying a 16 byte one: a relay should never touch the
+payload. Baselines are only comparable on the machine (and python)
+that recorded them, so re-record after moving. Busy or shared machines
+easily swing 30% from run to run; check a regression again before
+believing it.
+"""
+
+import os
+import sys
+import json
+import timeit
+import logging
+import platform
+import tempfile
+from functools import partial
+from itertools import count, cycle, product
+
+import click
+import zmq
+
+from jzmq.msg import Tag, TaggedMessage, RoutedMessage, WIRE_BINARY, WIRE_TEXT
+from jzmq.node import BROADCAST_PREFIX
+from jzmq.relay import RelayNode
+from jzmq.dedup import make_dedup
+from jzmq.route import RouteTable
+from jzmq.util import get_ports
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.5  # fraction slower than baseline that counts as a regression
+DEFAULT_REPEAT = 5
+
+SIZES = (16, 1024, 65536)  # payload bytes for the fixed-size cases
+RELAY_SIZES = (16, 65536, 1 << 20)
+RELAY_SPREAD = 2.0  # most relay[1MB] may cost, as a multiple of relay[16]
+RECENT_SIZES = (100, 10000, 100000)
+TABLE_SIZES = (10, 1000, 10000)
+
+CASES = dict()  # name -> setup(); setup() returns the callable to time
+
+
+def case(name, *params):
+    """register setup as case name or, given params, as one case per param
+    (a tuple for more than one argument): name.format(*param) calling
+    setup(*param)"""
+
+    def deco(setup):
+        if not params:
+            CASES[name] = setup
+        for param in params:
+            args = param if isinstance(param, tuple) else (param,)
+            CASES[name.format(*args)] = partial(setup, *args)
+        return setup
+
+    return deco
+
+
+def payload(size):
+    return "x" * size
+
+
+def variable_parts():
+    # a mix of frame counts and sizes, like a relay actually sees
+    return [payload(s) for s in (8, 200, 3000, 40, 12000)]
+
+
+@case("tag_encode[{}]", WIRE_BINARY, WIRE_TEXT)
+def _(wire):
+    tag = Tag("some-node-5555", seq=1234)
+    return lambda: tag.encode(wire=wire)
+
+
+@case("tag_decode[{}]", WIRE_BINARY, WIRE_TEXT)
+def _(wire):
+    part = Tag("some-node-5555", seq=1234).encode(wire=wire)
+    return lambda: Tag.decode(part)
+
+
+@case("tagged_encode[{}]", *SIZES)
+def _(size):
+    msg = TaggedMessage(payload(size), name="some-node-5555", seq=1)
+    return lambda: msg.encode(wire=WIRE_BINARY)
+
+
+@case("tagged_decode[{}]", *SIZES)
+def _(size):
+    parts = TaggedMessage(payload(size), name="some-node-5555", seq=1).encode()
+    return lambda: TaggedMessage(*parts)
+
+
+@case("tagged_from_frames[{}]", *SIZES)
+def _(size):
+    frames = [
+        zmq.Frame(x)
+        for x in TaggedMessage(payload(size), name="some-node-5555").encode()
+    ]
+    return lambda: TaggedMessage.from_frames(frames)
+
+
+@case("relay[{}]", *RELAY_SIZES)
+def _(size):
+    # what a zero_copy relay does with each message it passes on
+    frames = [
+        zmq.Frame(x)
+        for x in TaggedMessage(payload(size), name="some-node-5555").encode()
+    ]
+
+    def relay():
+        msg = TaggedMessage.from_frames(frames)
+        msg.part_is(0, BROADCAST_PREFIX)
+        return msg.encode()
+
+    return relay
+
+
+def relay_spread(results):
+    """relay[largest] / relay[smallest], if we ran both"""
+    small, large = (f"relay[{x}]" for x in (RELAY_SIZES[0], RELAY_SIZES[-1]))
+    if small in results and large in results:
+        return results[large] / results[small]
+    return None
+
+
+@case("tagged_encode[variable]")
+def _():
+    msg = TaggedMessage(*variable_parts(), name="some-node-5555", seq=1)
+    return lambda: msg.encode(wire=WIRE_BINARY)
+
+
+@case("tagged_decode[variable]")
+def _():
+    parts = TaggedMessage(*variable_parts(), name="some-node-5555").encode()
+    return lambda: TaggedMessage(*parts)
+
+
+@case("routed_decode[{} hops]", 1, 4)
+def _(hops):
+    to = tuple(f"hop{i}" for i in range(hops))
+    parts = RoutedMessage(to, payload(64), name="some-node-5555").encode()
+    return lambda: RoutedMessage.decode(parts)
+
+
+class Recent:
+    """one RelayNode for all the is_repeat() cases (it needs a keyring and
+    ports, but never connects to anything)"""
+
+    node = None
+
+    @classmethod
+    def get(cls):
+        if cls.node is None:
+            # cleaned up in close()
+            # pylint: disable-next=consider-using-with
+            cls.keyring = tempfile.TemporaryDirectory()
+            ports = ",".join(str(x) for x in get_ports())
+            cls.node = RelayNode(
+                f"*:{ports}", identity="bench-micro", keyring=cls.keyring.name
+            )
+        return cls.node
+
+    @classmethod
+    def close(cls):
+        if cls.node is not None:
+            cls.node.closekill()
+            cls.keyring.cleanup()
+            cls.node = None
+
+
+@case("is_repeat[{},{}]", *product(("sequence", "ordered", "bloom"), RECENT_SIZES))
+def _(backend, size):
+    # size senders for sequence (it keeps one entry per sender),
+    # size messages from one sender for the others
+    node = Recent.get()
+    node.recent = make_dedup(backend, window=3600)
+    if backend == "sequence":
+        tags = [Tag(f"peer{i}", seq=1) for i in range(size)]
+    else:
+        tags = [Tag("peer", seq=i + 1) for i in range(size)]
+    for tag in tags:
+        node.recent.add(tag)
+    seq = count(size + 1)
+    name = "peer0" if backend == "sequence" else "peer"
+
+    def check():
+        node.is_repeat(tags[-1])  # a repeat
+        node.is_repeat(Tag(name, seq=next(seq)), update_recent=True)
+
+    return check
+
+
+@case("route_lookup[{}]", *TABLE_SIZES)
+def _(size):
+    routes = RouteTable()
+    for i in range(size):
+        routes.learn(f"node{i}", (f"hop{i % 7}",))
+        routes.learn(f"node{i}", (f"hop{i % 5}", f"hop{i % 3}"))
+    dests = cycle([f"node{i}" for i in range(size)])
+    return lambda: routes.candidates(next(dests))
+
+
+def measure(setup, repeat):
+    timer = timeit.Timer(setup())
+    number, _ = timer.autorange()  # enough calls to take at least 0.2s
+    return min(timer.repeat(number=number, repeat=repeat)) / number * 1e9
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return dict(results=dict())
+
+
+@click.command()
+@click.option("-k", "keyword", help="only run cases with this in their name")
+@click.option("-b", "--baseline", default=BASELINE, show_default=True)
+@click.option("--save", is_flag=True, help="record the results as the baseline")
+@click.option("-t", "--threshold", default=DEFAULT_THRESHOLD, show_default=True)
+@click.option("-r", "--repeat", default=DEFAULT_REPEAT, show_default=True)
+def main(keyword, baseline, save, threshold, repeat):
+    logging.basicConfig(level=logging.ERROR)
+    base = load_baseline(baseline)
+    results = dict()
+    regressions = list()
+    try:
+        for name, setup in CASES.items():
+            if keyword and keyword not in name:
+                continue
+            results[name] = ns = measure(setup, repeat)
+            was = base["results"].get(name)
+            if was is None:
+                click.echo(f"{name:<32} {ns:12.1f} ns/op")
+                continue
+            change = ns / was - 1
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions.append(name)
+            click.echo(f"{name:<32} {ns:12.1f} ns/op {change:+8.1%}{flag}")
+    finally:
+        Recent.close()
+
+    spread = relay_spread(results)
+    if spread is not None and spread > RELAY_SPREAD:
+        click.echo(f"relay cost grows with payload size ({spread:.1f}x)")
+        regressions.append("relay")
+
+    if save:
+        base["results"].update(results)
+        base["python"] = platform.python_version()
+        base["machine"] = platform.machine()
+        base["zmq"] = zmq.zmq_version()
+        with open(baseline, "w", encoding="utf-8") as fh:
+            json.dump(base, fh, indent=2, sort_keys=True)
+            fh.write("\n")
+        click.echo(f"saved {len(results)} result(s) to {baseline}")
+    elif regressions:
+        click.echo(f"{len(regressions)} regression(s) over {threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
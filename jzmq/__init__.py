@@ -1,8 +1,10 @@
 # coding: utf-8
 
 from .msg import TaggedMessage
-from .node import RelayNode
+from .relay import RelayNode
+from .aio import AsyncNode
 from .endpoint import Endpoint
+from .runtime import Runtime
 from .cmd import chat
 
 Message = TaggedMessage
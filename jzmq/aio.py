@@ -0,0 +1,280 @@
+# coding: utf-8
+
+import asyncio
+
+import zmq
+import zmq.asyncio
+from zmq.auth.asyncio import AsyncioAuthenticator
+
+from .relay import RelayNode
+from .outbound import block
+from .wai import WHO_ARE_YOU
+
+
+class AsyncNode(RelayNode):
+    """RelayNode driven by the running asyncio event loop
+
+    Every socket poll() would normally watch gets its own receive task that
+    wakes as soon as the socket is readable, drains up to max_batch messages
+    through the usual dispatch handlers (so the *_react hooks behave exactly
+    as they do for the threaded nodes) and queues anything that comes out the
+    other end for ``async for msg in node``. ZAP auth and the who-are-you
+    reply run on the loop too, so there are no helper threads.
+
+    It has to be constructed inside a running loop. publish_message(),
+    deal_message() and route_message() still do their work right away, but
+    return an awaitable that completes once the dealer sends have been
+    handed to zmq. Dealer sends go through the same Outbound queues as the
+    other nodes' (see jzmq.outbound), and a task flushes each queue once
+    its socket is writable again, so outbound_opts work the same; all but
+    the "block" policy, which would stall the loop. Use
+    aconnect_to_endpoints() instead of connect_to_endpoints(): learning a
+    peer's key over the blocking REQ socket would stall the loop, and with
+    it that peer if it lives there too.
+    """
+
+    authenticator = AsyncioAuthenticator
+
+    def __init__(self, *a, **kw):
+        opts = kw.get("outbound_opts")
+        if opts is not None and opts.policy in ("block", block):
+            raise ValueError("the block overflow policy would stall the event loop")
+        self.loop = asyncio.get_running_loop()
+        self.incoming = asyncio.Queue()
+        self._tasks = dict()
+        self._shadows = dict()
+        self._flushing = dict()  # DEALER -> task flushing its Outbound queue
+        self._sends = None
+        self._wai_tasks = set()
+        self._timer_task = None
+        self._timers_changed = asyncio.Event()
+        super().__init__(*a, **kw)
+        self._sync_tasks()
+        self._timer_task = self.loop.create_task(self._timers())
+
+    def start_who_are_you(self):
+        # the rep socket gets a receive task in _sync_tasks() like the others
+        pass
+
+    def _shadow(self, sock):
+        try:
+            return self._shadows[sock]
+        except KeyError:
+            ret = self._shadows[sock] = zmq.asyncio.Socket.from_socket(sock)
+            return ret
+
+    def _forget(self, sock):
+        for task in (self._tasks.pop(sock, None), self._flushing.pop(sock, None)):
+            if task is not None:
+                task.cancel()
+        shadow = self._shadows.pop(sock, None)
+        if shadow is not None:
+            # closing through the shadow takes the fd out of the event loop
+            # first; a stale reader on a recycled fd never fires again
+            shadow.close()
+
+    def _sync_tasks(self):
+        """start receive tasks for new sockets, cancel the ones for sockets we
+        no longer watch"""
+        watched = set(self.dispatch)
+        watched.add(self.rep)
+        for sock in [s for s in self._tasks if s not in watched]:
+            self._forget(sock)
+        for sock in watched:
+            if sock not in self._tasks:
+                self._tasks[sock] = self.loop.create_task(self._receive(sock))
+
+    async def _receive(self, sock):
+        asock = self._shadow(sock)
+        while True:
+            await asock.poll(flags=zmq.POLLIN)
+            try:
+                if sock is self.rep:
+                    self.who_are_you_reply()
+                    continue
+                # look the handler up each time, the dispatch indexes move
+                # when we disconnect from things
+                for msg in self._drain(sock, self.dispatch[sock].handler):
+                    self.incoming.put_nowait(msg)
+            except Exception:  # pylint: disable=broad-except
+                self.log.exception("error handling %s", self.dispatch.get(sock))
+
+    async def _timers(self):
+        # poll() runs the timers for the other nodes; here we sleep until the
+        # next one is due or wake_timers() says there may be an earlier one.
+        # wait_for() can swallow a cancel that lands just as the event is set
+        # (before 3.12), so _cancel_tasks() clearing _timer_task stops us too
+        while self._timer_task is not None:
+            try:
+                await asyncio.wait_for(
+                    self._timers_changed.wait(), self.timer_timeout()
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._timers_changed.clear()
+            try:
+                self.run_timers()
+            except Exception:  # pylint: disable=broad-except
+                self.log.exception("error running timers")
+
+    def wake_timers(self):
+        self._timers_changed.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.incoming.get()
+
+    async def recv(self):
+        """wait for the next message that made it through local_react()"""
+        return await self.incoming.get()
+
+    def _send(self, sock, parts):
+        ret = super()._send(sock, parts)
+        out = self.outbound.get(sock)
+        if out is not None and out.queue:
+            # poll() would flush it on POLLOUT; we have a task wait for that
+            task = self._flushing.get(sock)
+            if task is None or task.done():
+                task = self._flushing[sock] = self.loop.create_task(self._flush(sock))
+            if self._sends is not None:
+                self._sends.append(task)
+        return ret
+
+    async def _flush(self, sock):
+        asock = self._shadow(sock)
+        while sock in self.outbound and self.outbound[sock].queue:
+            await asock.poll(flags=zmq.POLLOUT)
+            self.flush_outbound(sock)
+
+    def _sent(self, fut):
+        # a gather (or a flush) cancelled along with its caller or by a
+        # disconnect isn't an error
+        if fut.cancelled() or isinstance(fut.exception(), asyncio.CancelledError):
+            return
+        for res in fut.result():
+            if isinstance(res, Exception):
+                self.log.error("async send failed: %s", res)
+
+    def _collect_sends(self, method, *a, **kw):
+        outer, self._sends = self._sends, list()
+        try:
+            method(*a, **kw)
+            sends = self._sends
+        finally:
+            self._sends = outer
+        if outer is not None:
+            outer.extend(sends)  # deal_message() goes through publish_message()
+        ret = asyncio.gather(*sends, return_exceptions=True)
+        ret.add_done_callback(self._sent)
+        return ret
+
+    def publish_message(self, *a, **kw):
+        return self._collect_sends(super().publish_message, *a, **kw)
+
+    def deal_message(self, msg):
+        return self._collect_sends(super().deal_message, msg)
+
+    def route_message(self, to, msg):
+        return self._collect_sends(super().route_message, to, msg)
+
+    def connect_to_endpoint(self, endpoint):
+        super().connect_to_endpoint(endpoint)
+        self._sync_tasks()
+        return self
+
+    def disconnect_from_endpoint(self, endpoint):
+        idx = self._endpoint_index(endpoint)
+        for sock in (self.sub[idx], self.dealer[idx]):
+            self._forget(sock)
+        return super().disconnect_from_endpoint(idx)
+
+    async def who_are_you_arequest(self, endpoint, timeout=None):
+        areq = zmq.asyncio.Socket.from_socket(
+            self.mk_socket(zmq.REQ, enable_curve=False)
+        )
+        timeout = self.wai_timeout if timeout is None else timeout
+        try:
+            areq.connect(endpoint.format(zmq.REQ))
+            self.log.debug("sending cleartext request: %s", WHO_ARE_YOU)
+            await areq.send(WHO_ARE_YOU)
+            self.log.debug("waiting for reply")
+            res = await asyncio.wait_for(areq.recv_multipart(), timeout)
+            self.log.debug("received reply: %s", res)
+        except asyncio.TimeoutError:
+            self.log.error("no who-are-you reply from %s", endpoint)
+            res = None
+        finally:
+            areq.close(linger=0)
+        if res and len(res) == 2:
+            return res
+        return None, None
+
+    async def aconnect_to_endpoint(self, endpoint, timeout=None):
+        endpoint = self._as_endpoint(endpoint)
+        if self.known_pubkey(endpoint) is None:
+            node_id, public_key = await self.who_are_you_arequest(endpoint, timeout)
+            if not node_id:
+                # connect_to_endpoint() would just try again, blocking this time
+                raise ConnectionError(f"unable to learn the pubkey for {endpoint}")
+            self.save_endpoint_pubkey(endpoint, node_id, public_key)
+        return self.connect_to_endpoint(endpoint)
+
+    async def aconnect_to_endpoints(self, *endpoints, timeout=None):
+        """like connect_to_endpoints(): ask everybody at once, connect to
+        each peer as it answers and keep asking the silent ones in the
+        background"""
+        self.log.debug("connecting remote endpoints")
+        asking = list()
+        for item in endpoints:
+            endpoint = self._as_endpoint(item)
+            if self.known_pubkey(endpoint) is not None:
+                self.connect_to_endpoint(endpoint)
+                continue
+            task = self.bootstrap(endpoint, timeout=timeout)
+            if task is not None:
+                asking.append(task)
+        if asking:
+            # each task gives up after its timeout, leaving a retry behind
+            await asyncio.wait(asking)
+        self.log.debug("remote endpoints connected")
+        return self
+
+    def ask_who_are_you(self, endpoint, timeout=None):
+        # a task waits for the answer instead of poll()
+        task = self.loop.create_task(self._ask_who_are_you(endpoint, timeout))
+        self._wai_tasks.add(task)
+        task.add_done_callback(self._wai_tasks.discard)
+        return task
+
+    async def _ask_who_are_you(self, endpoint, timeout):
+        res = await self.who_are_you_arequest(endpoint, timeout)
+        try:
+            self.who_are_you_answered(endpoint, *res)
+        except Exception:  # pylint: disable=broad-except
+            self.log.exception("error connecting to %s", endpoint)
+
+    def _cancel_tasks(self):
+        tasks = list(self._tasks.values())
+        for task in self._wai_tasks:
+            task.cancel()
+            tasks.append(task)
+        if self._timer_task is not None:
+            self._timer_task.cancel()
+            tasks.append(self._timer_task)
+            self._timer_task = None
+        tasks.extend(self._flushing.values())
+        for sock in set(self._tasks) | set(self._shadows) | set(self._flushing):
+            self._forget(sock)
+        return tasks
+
+    def closekill(self):
+        if hasattr(self, "_tasks"):
+            self._cancel_tasks()
+        super().closekill()
+
+    async def aclose(self):
+        """cancel the receive tasks, let them unwind, then closekill()"""
+        await asyncio.gather(*self._cancel_tasks(), return_exceptions=True)
+        self.closekill()
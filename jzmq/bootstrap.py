@@ -0,0 +1,291 @@
+# coding: utf-8
+
+import os
+import time
+
+import zmq
+
+from .util import zmq_socket_type_name, scrub_identity_name_for_certfile
+from .endpoint import Endpoint
+from .keyring import Keyring
+from .route import RetryScheduler
+from .wai import WHO_ARE_YOU, WAI_SHARED, WAI_POLL
+
+DEFAULT_BOOTSTRAP_RETRY = 1  # seconds before we ask a silent peer again ...
+DEFAULT_BOOTSTRAP_RETRY_CAP = 60  # ... doubling up to this
+
+
+class BootstrapMixin:
+    """the key half of a StupidNode: our key-pair, the keyring of the keys we
+    trust and the "Who are you?" exchange that fills it
+
+    We answer on the REP socket (from poll() or a WhoAreYouService) and ask
+    on a REQ socket per peer, either waiting for the answer
+    (learn_or_load_endpoint_pubkey()) or letting poll() pick it up
+    (bootstrap()). Expects the node to have its runtime, identity and log,
+    and by the time start_who_are_you() runs, its poller and dispatch.
+    """
+
+    pubkey = privkey = zap_domain = None
+
+    def __init__(self, keyring, wai_opts):
+        """keyring is a directory or a jzmq.keyring.Keyring (make your own
+        for a different rescan interval); wai_opts a jzmq.wai.WhoAreYouOptions"""
+        self.certs = keyring if isinstance(keyring, Keyring) else Keyring(keyring)
+        self.wai_timeout = wai_opts.timeout
+        if wai_opts.service == WAI_SHARED:
+            self.wai_service = self.runtime.wai_service
+        elif wai_opts.service == WAI_POLL:
+            self.wai_service = None  # poll() answers
+        else:
+            self.wai_service = wai_opts.service
+        self._wai_registered = None
+        self.wai = dict()  # REQ -> (Endpoint, deadline) for unanswered requests
+        self.bootstrapping = dict()  # REP address -> Endpoint we're learning
+        self.bootstrap_retry = RetryScheduler(
+            base=DEFAULT_BOOTSTRAP_RETRY, cap=DEFAULT_BOOTSTRAP_RETRY_CAP
+        )
+        self.start_auth()
+        self.rep = self.mk_socket(zmq.REP, enable_curve=False)
+        self.bind(self.rep, enable_curve=False)
+
+    @property
+    def keyring(self):
+        return self.certs.path
+
+    def start_who_are_you(self):
+        if self.wai_service is None:
+            self.log.debug("answering who-are-you from poll()")
+            self.poller.register(self.rep, zmq.POLLIN)
+        else:
+            self.log.debug("answering who-are-you from %s", self.wai_service)
+            self.wai_service.register(self)
+            self._wai_registered = self.wai_service
+
+    def stop_who_are_you(self):
+        if self._wai_registered is not None:
+            self.log.debug("leaving %s", self._wai_registered)
+            self._wai_registered.unregister(self)
+            self._wai_registered = None
+
+    def who_are_you_reply(self):
+        """answer one pending "Who are you?" on the rep socket"""
+        msg = self.rep.recv()
+        ttype = zmq_socket_type_name(self.rep)
+        self.log.debug('received "%s" over %s socket', msg, ttype)
+        msg = [self.identity.encode(), self.pubkey]
+        self.log.debug('sending "%s" as reply over %s socket', msg, ttype)
+        self.rep.send_multipart(msg)
+
+    def start_auth(self):
+        self.log.debug("sharing the authenticator of %s", self.runtime)
+        self.zap_domain = self.runtime.attach(self)
+        self.load_or_create_key()
+        self.certs.rescan()
+
+    @property
+    def key_basename(self):
+        return scrub_identity_name_for_certfile(self.identity)
+
+    @property
+    def key_filename(self):
+        return os.path.join(self.keyring, self.key_basename + ".key")
+
+    @property
+    def secret_key_filename(self):
+        return self.key_filename + "_secret"
+
+    def load_key(self):
+        self.log.debug("loading node key-pair")
+        self.pubkey, self.privkey = zmq.auth.load_certificate(self.secret_key_filename)
+
+    def load_or_create_key(self):
+        try:
+            self.load_key()
+        except IOError as e:
+            self.log.debug("error loading key: %s", e)
+            self.log.debug("creating node key-pair")
+            os.makedirs(self.keyring, mode=0o0700, exist_ok=True)
+            zmq.auth.create_certificates(self.keyring, self.key_basename)
+            self.load_key()
+
+    def run_bootstrap_timers(self):
+        """pick up keyring changes, give up on the who-are-you requests that
+        timed out and ask the peers whose backoff has run out again"""
+        self.certs.maybe_rescan()
+        changed = self.certs.changes()
+        if changed:
+            self.keyring_changed(changed)
+        now = time.monotonic()
+        for req in [r for r, (_, deadline) in self.wai.items() if deadline <= now]:
+            endpoint = self._end_wai(req)
+            self.log.warning("no who-are-you reply from %s", endpoint)
+            self.who_are_you_answered(endpoint, None, None)
+        for key in self.bootstrap_retry.due():
+            if key in self.bootstrapping:
+                self.ask_who_are_you(self.bootstrapping[key])
+
+    def bootstrap_timeouts(self):
+        """seconds until run_bootstrap_timers() has something to do, for each
+        of the things it does (None for the ones with nothing pending)"""
+        ret = [self.certs.timeout(), self.bootstrap_retry.timeout()]
+        if self.wai:
+            deadline = min(deadline for _, deadline in self.wai.values())
+            ret.append(max(0, deadline - time.monotonic()))
+        return ret
+
+    def keyring_changed(self, changed):
+        """reconnect to the endpoints whose keys changed (the old sockets
+        still expect the old key) and drop the ones whose keys are gone.
+        changed is what jzmq.keyring.Keyring.changes() returns"""
+        for endpoint in list(self.endpoints):
+            name = endpoint.identity or endpoint.host
+            old, new = changed.get(self.certs.name(name), (None, None))
+            if old is None:
+                continue
+            self.disconnect_from_endpoint(endpoint)
+            if new is None:
+                self.log.warning("%s's key left the keyring, disconnected", name)
+            else:
+                self.log.info("%s's key changed, reconnecting", name)
+                self.connect_to_endpoint(endpoint)
+
+    def _who_are_you_socket(self, endpoint):
+        req = self.mk_socket(zmq.REQ, enable_curve=False)
+        req.linger = 0  # nobody cares about a question we stopped waiting for
+        req.connect(endpoint.format(zmq.REQ))
+        self.log.debug("sending cleartext request: %s", WHO_ARE_YOU)
+        req.send(WHO_ARE_YOU)
+        return req
+
+    def who_are_you_request(self, endpoint, timeout=None):
+        """ask endpoint who it is and wait up to timeout seconds (default
+        self.wai_timeout) for (identity, public key); (None, None) if we
+        didn't get them"""
+        timeout = self.wai_timeout if timeout is None else timeout
+        req = self._who_are_you_socket(endpoint)
+        try:
+            self.log.debug("waiting for reply")
+            if not req.poll(int(timeout * 1000)):
+                self.log.error("no who-are-you reply from %s", endpoint)
+                return None, None
+            res = req.recv_multipart()
+        finally:
+            req.close()
+        self.log.debug("received reply: %s", res)
+        if len(res) == 2:
+            return res
+        return None, None
+
+    def bootstrap(self, endpoint, timeout=None):
+        """start learning endpoint's key without waiting for the answer. When
+        it comes, we connect to endpoint (see who_are_you_answered()); when
+        it doesn't, we ask again later, backing off (see run_timers()).
+        Returns whatever ask_who_are_you() did, None if we already were"""
+        endpoint = self._as_endpoint(endpoint)
+        key = endpoint.format(zmq.REQ)
+        if key in self.bootstrapping:
+            return None
+        self.bootstrapping[key] = endpoint
+        return self.ask_who_are_you(endpoint, timeout=timeout)
+
+    def ask_who_are_you(self, endpoint, timeout=None):
+        """send endpoint a "Who are you?" that poll() picks the answer to up
+        (see wai_workflow()); returns the REQ socket"""
+        timeout = self.wai_timeout if timeout is None else timeout
+        req = self._who_are_you_socket(endpoint)
+        self.wai[req] = (endpoint, time.monotonic() + timeout)
+        self.poller.register(req, zmq.POLLIN)
+        self.dispatch[req] = self.wai_dispatch(req, endpoint)
+        self.wake_timers()
+        return req
+
+    def _end_wai(self, req):
+        self.poller.unregister(req)
+        self.dispatch.pop(req, None)
+        req.close()
+        return self.wai.pop(req)[0]
+
+    def wai_workflow(self, req):
+        res = req.recv_multipart()
+        self.log.debug("received reply: %s", res)
+        endpoint = self._end_wai(req)
+        if len(res) == 2:
+            self.who_are_you_answered(endpoint, *res)
+        else:
+            self.who_are_you_answered(endpoint, None, None)
+
+    def who_are_you_answered(self, endpoint, node_id, public_key):
+        """connect to endpoint if we learned its key, otherwise schedule
+        another try"""
+        key = endpoint.format(zmq.REQ)
+        if not node_id:
+            when = self.bootstrap_retry.failed(key) - time.monotonic()
+            self.log.info("asking %s who they are again in %0.1fs", endpoint, when)
+            self.wake_timers()
+            return
+        self.bootstrapping.pop(key, None)
+        self.bootstrap_retry.reset(key)
+        self.save_endpoint_pubkey(endpoint, node_id, public_key)
+        self.connect_to_endpoint(endpoint)
+
+    def pubkey_pathname(self, node_id):
+        if isinstance(node_id, Endpoint):
+            node_id = node_id.identity or node_id.host
+        return self.certs.pathname(node_id)
+
+    def known_pubkey(self, node_id):
+        """node_id's public key from the keyring, None if we don't know it"""
+        if isinstance(node_id, Endpoint):
+            node_id = node_id.identity or node_id.host
+        return self.certs.get(node_id)
+
+    def learn_or_load_endpoint_pubkey(self, endpoint):
+        ret = self.known_pubkey(endpoint)
+        if ret is None:
+            self.log.debug("no key for %s yet, trying to learn certificate", endpoint)
+            node_id, public_key = self.who_are_you_request(endpoint)
+            if node_id:
+                self.save_endpoint_pubkey(endpoint, node_id, public_key)
+                ret = self.known_pubkey(endpoint)
+        if ret is None:
+            raise IOError(f"unable to learn or load the public key for {endpoint}")
+        return ret
+
+    def save_endpoint_pubkey(self, endpoint, node_id, public_key):
+        """remember the who-are-you answer for endpoint; returns the key file"""
+        endpoint.identity = node_id.decode()
+        return self.certs.add(node_id, public_key)
+
+    def connect_to_endpoints(self, *endpoints, timeout=None):
+        """connect to endpoints, asking all the ones whose keys we don't know
+        yet who they are at once. We connect to each of them as it answers,
+        for up to timeout seconds (default self.wai_timeout); the ones that
+        haven't answered by then keep getting asked in the background (see
+        bootstrap()), so one dead seed can't hold up the rest"""
+        self.log.debug("connecting remote endpoints")
+        timeout = self.wai_timeout if timeout is None else timeout
+        waiting = zmq.Poller()
+        for item in endpoints:
+            endpoint = self._as_endpoint(item)
+            if self.known_pubkey(endpoint) is not None:
+                self.connect_to_endpoint(endpoint)
+                continue
+            req = self.bootstrap(endpoint, timeout=timeout)
+            if req is not None:
+                waiting.register(req, zmq.POLLIN)
+        deadline = time.monotonic() + timeout
+        while waiting.sockets:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            for req, _ in waiting.poll(max(1, int(left * 1000))):
+                waiting.unregister(req)
+                self.wai_workflow(req)
+        if waiting.sockets:
+            self.log.warning(
+                "still waiting for %s",
+                ", ".join(str(self.wai[r][0]) for r, _ in waiting.sockets),
+            )
+        self.log.debug("remote endpoints connected")
+        return self
@@ -0,0 +1,165 @@
+# coding: utf-8
+
+import zmq
+
+from .msg import channel_filters, channel_frame
+
+
+class ChannelsMixin:
+    """the channel half of a StupidNode: the channels we subscribe() to (and
+    so the prefixes our SUB sockets filter on) and the ones our subscribers
+    asked for, which our XPUB tells us about (see pub_workflow())
+
+    Our XPUB only hears from the nodes that connect to us, so it can't tell
+    us what the nodes our DEALERs talk to want. Relays tell each other (see
+    jzmq.relay.RelayNode.send_interest()): what each neighbor asked for goes
+    in interest, and we only deal a named channel to the neighbors that
+    asked for it (or never said, see peer_wants())."""
+
+    def __init__(self, channels):
+        self.channels = set(channels)  # named channels we want (see subscribe())
+        self.downstream = set()  # SUBSCRIBE prefixes our subscribers sent us
+        self.published = self.publish_skipped = 0
+        self._sub_filters = self.sub_filters()
+        # neighbor (our DEALER to it, or its name if it connected to us) ->
+        # (its name, the named channels it asked us for; None: all of them)
+        self.interest = dict()
+        self.advertised = dict()  # neighbor -> what we last asked it for
+        self._interest_stale = True
+
+    def pub_workflow(self):
+        """our XPUB hands us a frame for each (un)subscription: 1 or 0 and
+        the prefix. XPUB only passes on the first subscribe and the last
+        unsubscribe for each prefix, so a set is all we need to keep."""
+        changed = False
+        while True:
+            # publish_message() may have beaten poll() to them
+            try:
+                sub = self.pub.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            prefix = sub[1:]
+            if sub[:1] == b"\x01" and prefix not in self.downstream:
+                self.downstream.add(prefix)
+                changed = True
+            elif sub[:1] == b"\x00" and prefix in self.downstream:
+                self.downstream.discard(prefix)
+                changed = True
+        if changed:
+            self.log.debug("downstream subscriptions now %s", self.downstream)
+            self.interest_changed()
+
+    def has_subscribers(self, channel=""):
+        """True if any of our subscribers would get a message on channel"""
+        if self.pub.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+            self.pub_workflow()
+        for prefix in self.downstream:
+            for lead in channel_filters(channel):
+                # we only know how the first frame starts, so a longer
+                # prefix than that might match too
+                if prefix.startswith(lead) or lead.startswith(prefix):
+                    return True
+        return False
+
+    def interest_changed(self):
+        """called when our subscribers' subscriptions change; StupidNodes
+        don't relay, so they don't care"""
+
+    def wants(self, channel):
+        """True if channel is one we subscribe()d to (or the default one)"""
+        return not channel or channel in self.channels
+
+    def subscribe(self, *channels):
+        """start receiving the named channels, on the SUB sockets we already
+        have as well as the ones we connect later"""
+        self.channels.update(channels)
+        self._resubscribe()
+
+    def unsubscribe(self, *channels):
+        self.channels.difference_update(channels)
+        self._resubscribe()
+
+    def sub_filters(self):
+        """the SUBSCRIBE prefixes our SUB sockets should have"""
+        ret = set()
+        for channel in ("",) + tuple(self.channels):
+            ret.update(channel_filters(channel))
+        return ret
+
+    def downstream_channels(self):
+        """the named channels our subscribers asked for; None if one of them
+        takes every channel"""
+        ret = set()
+        lead = channel_frame("")
+        for prefix in self.downstream:
+            if prefix.startswith(lead) and len(prefix) > len(lead):
+                ret.add(str(prefix[len(lead) :], "utf-8", "replace"))
+            elif lead.startswith(prefix):
+                return None
+        return ret
+
+    def peer_wants(self, sock, channel):
+        """True if the neighbor behind our DEALER sock wants channel: it asked
+        for it, or never told us what it wants"""
+        if not channel:
+            return True
+        _, wants = self.interest.get(sock, (None, None))
+        return wants is None or channel in wants
+
+    def heard_interest(self, neighbor, name, wants):
+        """neighbor (named name) asked us for the channels in wants (None for
+        all of them)"""
+        wants = None if wants is None else set(wants)
+        if self.interest.get(neighbor) != (name, wants):
+            self.log.debug(
+                "%s wants %s", name, "everything" if wants is None else wants
+            )
+            self.interest[neighbor] = (name, wants)
+            self._interest_stale = True
+
+    def forget_interest(self, neighbor):
+        self.interest.pop(neighbor, None)
+        self.advertised.pop(neighbor, None)
+        self._interest_stale = True
+        self.wake_timers()
+
+    def interest_pending(self):
+        """True if what we ask some neighbor for may have changed"""
+        return self._interest_stale or any(
+            sock not in self.advertised for sock in self.dealer
+        )
+
+    def wants_for(self, neighbor):
+        """the named channels to ask neighbor for (None: all of them): ours,
+        the ones our other neighbors asked us for, and the ones our XPUB says
+        somebody who never told us (eg a StupidNode) wants. What neighbor
+        itself asked for doesn't count: it has those already"""
+        name = self.interest[neighbor][0] if neighbor in self.interest else None
+        ret, told = set(self.channels), set()
+        for other, wants in self.interest.values():
+            if wants is None:
+                if other != name:
+                    return None
+                told = None  # neighbor explains whatever our XPUB says
+                continue
+            if other != name:
+                ret |= wants
+            if told is not None:
+                told |= wants
+        if told is None:
+            return ret
+        downstream = self.downstream_channels()
+        return None if downstream is None else ret | (downstream - told)
+
+    def _resubscribe(self):
+        self._interest_stale = True
+        self.wake_timers()
+        filters = self.sub_filters()
+        added = filters - self._sub_filters
+        removed = self._sub_filters - filters
+        self._sub_filters = filters
+        for sock in self.sub:
+            for prefix in added:
+                sock.setsockopt(zmq.SUBSCRIBE, prefix)
+            for prefix in removed:
+                sock.setsockopt(zmq.UNSUBSCRIBE, prefix)
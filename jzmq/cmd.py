@@ -4,10 +4,17 @@
 import os
 import threading
 import logging
+from types import SimpleNamespace
 import click
 from prompt_toolkit import prompt
 from prompt_toolkit.patch_stdout import patch_stdout
-from .node import RelayNode as Node, DEFAULT_KEYRING
+from .node import DEFAULT_KEYRING, DEFAULT_MAX_BATCH
+from .relay import RelayNode as Node
+from .msg import WIRE_BINARY, WIRE_TEXT, DEFAULT_WIRE
+from .dedup import DEDUP_BACKENDS, DEFAULT_DEDUP
+from .route import RouteQueue, RouteOptions
+from .sockopts import SOCKOPT_PROFILES, SocketOptions
+from .outbound import OVERFLOW_POLICIES, DEFAULT_OUTBOUND_POLICY, OutboundOptions
 
 ALIVE = True
 
@@ -16,7 +23,10 @@ def jzmq_node_tasks(node):
     while ALIVE:
         msgs = node.poll(50)
         for msg in msgs:
-            print(f"{msg.name}: {msg.msg}")
+            if msg.channel:
+                print(f"{msg.name}#{msg.channel}: {msg.msg}")
+            else:
+                print(f"{msg.name}: {msg.msg}")
     node.closekill()
 
 
@@ -39,29 +49,71 @@ class ChatNode(Node):
 @click.option(
     "--vi-input/--emacs-input", "vi_mode", default=os.environ.get("JZMQ_VI_MODE")
 )
-def chat(
-    laddr, raddr, identity, verbosity, keyring, vi_mode
-):  # pylint: disable=unused-argument
+@click.option(
+    "-w",
+    "--wire",
+    type=click.Choice((WIRE_BINARY, WIRE_TEXT)),
+    default=DEFAULT_WIRE,
+    show_default=True,
+    help="tag format to send (use text on a bus with older nodes)",
+)
+@click.option(
+    "--dedup",
+    type=click.Choice(tuple(DEDUP_BACKENDS)),
+    default=DEFAULT_DEDUP,
+    show_default=True,
+    help="duplicate suppression backend (bloom keeps memory flat on busy hubs)",
+)
+@click.option(
+    "--max-batch",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MAX_BATCH,
+    show_default=True,
+    help="max messages read from one socket per poll",
+)
+@click.option(
+    "--spill-dir",
+    type=click.Path(file_okay=False),
+    help="spool undeliverable whispers here instead of dropping them",
+)
+@click.option(
+    "-c",
+    "--channel",
+    "channels",
+    multiple=True,
+    default=list(),
+    help="join this channel too (see /join)",
+)
+@click.option(
+    "--sockopts",
+    "profiles",
+    type=click.Choice(tuple(SOCKOPT_PROFILES)),
+    multiple=True,
+    help="socket option profile (HWMs, buffers, keepalive); later ones win",
+)
+@click.option(
+    "-o",
+    "--sockopt",
+    "sockopts",
+    multiple=True,
+    metavar="[TYPE.]OPTION=N",
+    help="set one socket option (eg dealer.sndhwm=10000), after the profiles",
+)
+@click.option(
+    "--outbound-policy",
+    type=click.Choice(tuple(OVERFLOW_POLICIES)),
+    default=DEFAULT_OUTBOUND_POLICY,
+    show_default=True,
+    help="what to do when a slow peer's outbound queue fills up",
+)
+def chat(**kw):
     global ALIVE
-
-    log_level = logging.ERROR
-    if verbosity > 0:
-        log_level = logging.INFO
-        if verbosity > 1:
-            log_level = logging.DEBUG
-        if verbosity < 4:
-            logging.getLogger("zmq.auth").propagate = False
-            logging.getLogger("asyncio").propagate = False
+    opts = SimpleNamespace(**kw)  # the options above, by parameter name
 
     with patch_stdout():
-        logging.basicConfig(
-            level=log_level,
-            datefmt="%Y-%m-%d %H:%M:%S",
-            format="%(name)s [%(process)d] %(levelname)s: %(message)s",
-        )
-
-        node = ChatNode(laddr, identity=identity, keyring=keyring)
-        node.connect_to_endpoints(*raddr)
+        setup_logging(opts.verbosity)
+        node = make_chat_node(opts)
+        node.connect_to_endpoints(*opts.raddr)
         node_thread = threading.Thread(target=jzmq_node_tasks, args=(node,))
         node_thread.start()
         identity = node.identity
@@ -70,7 +122,7 @@ def chat(
 
         while ALIVE:
             try:
-                line = prompt(f"{identity}> ", vi_mode=vi_mode)
+                line = prompt(f"{identity}> ", vi_mode=opts.vi_mode)
             except KeyboardInterrupt:
                 print(f"{identity}: ^C break")
                 break
@@ -84,17 +136,74 @@ def chat(
 
             if line and line.strip():
                 if line.startswith("/"):
-                    if len(line) > 1:
-                        cmd, *args = line[1:].split()
-                        if cmd == "whisper" and len(args) > 1:
-                            target, *args = args
-                            node.route_message(target, args)
-                            continue
-                    print("/whisper target message")
-                    print("/help: this help")
+                    chat_command(node, line[1:].split())
                 else:
                     node.publish_message(line)
 
     node.publish_message("* exit")
     ALIVE = False
     node_thread.join()
+
+
+def setup_logging(verbosity):
+    log_level = logging.ERROR
+    if verbosity > 0:
+        log_level = logging.INFO
+        if verbosity > 1:
+            log_level = logging.DEBUG
+        if verbosity < 4:
+            logging.getLogger("zmq.auth").propagate = False
+            logging.getLogger("asyncio").propagate = False
+
+    logging.basicConfig(
+        level=log_level,
+        datefmt="%Y-%m-%d %H:%M:%S",
+        format="%(name)s [%(process)d] %(levelname)s: %(message)s",
+    )
+
+
+def make_chat_node(opts):
+    try:
+        sockopts = SocketOptions(*opts.profiles)
+        for spec in opts.sockopts:
+            sockopts.update(SocketOptions.parse(spec))
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--sockopt") from e
+
+    return ChatNode(
+        opts.laddr,
+        identity=opts.identity,
+        keyring=opts.keyring,
+        wire=opts.wire,
+        dedup=opts.dedup,
+        max_batch=opts.max_batch,
+        channels=opts.channels,
+        sockopts=sockopts,
+        outbound_opts=OutboundOptions(policy=opts.outbound_policy),
+        route_opts=RouteOptions(queue=RouteQueue(spill=opts.spill_dir)),
+    )
+
+
+def chat_command(node, words):
+    """run the /command in words, or print the help"""
+    if words:
+        cmd, *args = words
+        if cmd == "whisper" and len(args) > 1:
+            target, *args = args
+            node.route_message(target, args)
+            return
+        if cmd == "say" and len(args) > 1:
+            channel, *args = args
+            node.publish_message(args, channel=channel)
+            return
+        if cmd == "join" and args:
+            node.subscribe(*args)
+            return
+        if cmd == "part" and args:
+            node.unsubscribe(*args)
+            return
+    print("/whisper target message")
+    print("/say channel message")
+    print("/join channel [channel ...]")
+    print("/part channel [channel ...]")
+    print("/help: this help")
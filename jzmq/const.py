@@ -7,6 +7,9 @@ DEFAULT_DIRECTED_PORT = 5557
 DEFAULT_CLEARTEXT_PORT = 5558
 
 DEFAULT_PROTO = "tcp"
+NAMED_PROTOS = ("inproc", "ipc")  # addressed by name or path, not host:port
+# never leave the host (the filesystem guards ipc), so no CURVE
+CLEARTEXT_PROTOS = ("inproc", "ipc")
 
 DEFAULT_PORTS = (
     DEFAULT_PUBLISH_PORT,
@@ -0,0 +1,433 @@
+# coding: utf-8
+
+import time
+import math
+import hashlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+
+DEFAULT_DEDUP = "sequence"
+DEFAULT_DEDUP_MAXLEN = 100000
+DEFAULT_BLOOM_FP_RATE = 0.001
+DEFAULT_BLOOM_BYTES = 1 << 20
+DEFAULT_REORDER_WINDOW = 64
+DEFAULT_PEER_TIMEOUT = 3600
+
+
+class DedupCache(ABC):
+    """Remember recently seen tags for about window seconds
+
+    This is the interface RelayNode.recent expects: add(tag), `tag in
+    cache`, expire() and seen(). Subclasses pick the storage (and have to
+    implement all four abstract methods to be instantiated); this base
+    class keeps the counters.
+    """
+
+    def __init__(self, window=10, clock=time.time):
+        self.window = window
+        self.clock = clock
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    @abstractmethod
+    def add(self, tag):
+        """remember tag"""
+
+    @abstractmethod
+    def expire(self, now=None):
+        """forget the tags older than window"""
+
+    @abstractmethod
+    def __contains__(self, tag):
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    def seen(self, tag, update=False):
+        """True if tag is a repeat; otherwise (optionally) remember it"""
+        self.expire()
+        if tag in self:
+            self.hits += 1
+            return True
+        self.misses += 1
+        if update:
+            self.add(tag)
+        return False
+
+    def stats(self):
+        return dict(
+            size=len(self),
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expired=self.expired,
+        )
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}{self.stats()}"
+
+
+class OrderedDedup(DedupCache):
+    """insertion ordered tag -> first-seen-time map
+
+    Entries are added in local receive order, so the oldest entry is always
+    at the head and expiry just pops from there. add, lookup and expiry are
+    all amortized O(1); maxlen is a hard cap on the number of tags kept (the
+    oldest are evicted first).
+    """
+
+    def __init__(self, window=10, maxlen=DEFAULT_DEDUP_MAXLEN, clock=time.time):
+        super().__init__(window=window, clock=clock)
+        self.maxlen = maxlen
+        self._seen = OrderedDict()
+
+    def add(self, tag):
+        if tag in self._seen:
+            return
+        self._seen[tag] = self.clock()
+        if len(self._seen) > self.maxlen:
+            self._seen.popitem(last=False)
+            self.evictions += 1
+
+    def expire(self, now=None):
+        old = (self.clock() if now is None else now) - self.window
+        # OrderedDict iterates its linked list, so peeking the head is O(1)
+        while self._seen and next(iter(self._seen.values())) <= old:
+            self._seen.popitem(last=False)
+            self.expired += 1
+
+    def __contains__(self, tag):
+        return tag in self._seen
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class _Bloom:
+    def __init__(self, nbits, k):
+        self.nbits = nbits
+        self.k = k
+        self.bits = bytearray((nbits + 7) // 8)
+        self.count = 0
+
+    def positions(self, h1, h2):
+        return ((h1 + i * h2) % self.nbits for i in range(self.k))
+
+    def add(self, h1, h2):
+        for p in self.positions(h1, h2):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, h):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self.positions(*h))
+
+    @property
+    def fill(self):
+        return bin(int.from_bytes(self.bits, "little")).count("1") / self.nbits
+
+
+class BloomDedup(DedupCache):
+    """rotating Bloom filters keyed on (tag.name, tag.time)
+
+    max_bytes is split evenly between the generations. Every
+    window/(generations-1) seconds (or sooner, once the newest filter holds
+    as many tags as it was sized for) the oldest filter is cleared and
+    becomes the newest, so a tag is remembered for at least window seconds
+    and memory stays flat no matter the message rate. In exchange, about
+    fp_rate of new tags are wrongly reported as repeats.
+    """
+
+    def __init__(
+        self,
+        window=10,
+        fp_rate=DEFAULT_BLOOM_FP_RATE,
+        max_bytes=DEFAULT_BLOOM_BYTES,
+        generations=2,
+        clock=time.time,
+    ):
+        super().__init__(window=window, clock=clock)
+        if generations < 2:
+            raise ValueError("BloomDedup needs at least 2 generations")
+        self.fp_rate = fp_rate
+        self.max_bytes = max_bytes
+        self.rotate_every = window / (generations - 1)
+
+        # each filter gets an equal share of the false positive budget
+        nbits = max(8, (max_bytes // generations) * 8)
+        each_fp = fp_rate / generations
+        self.capacity = max(1, int(-nbits * math.log(2) ** 2 / math.log(each_fp)))
+        k = max(1, round(nbits / self.capacity * math.log(2)))
+
+        self._filters = deque(_Bloom(nbits, k) for _ in range(generations))
+        self._rotated = self.clock()
+
+    @staticmethod
+    def hash(tag):
+        d = hashlib.blake2b(
+            f"{tag.name}\0{tag.time!r}\0{tag.seq}".encode(), digest_size=16
+        ).digest()
+        return int.from_bytes(d[:8], "little"), int.from_bytes(d[8:], "little") | 1
+
+    def rotate(self):
+        """clear the oldest filter and make it the newest; returns how many
+        tags were dropped"""
+        old = self._filters.pop()
+        self._filters.appendleft(_Bloom(old.nbits, old.k))
+        return old.count
+
+    def _contains(self, h):
+        return any(h in f for f in self._filters)
+
+    def _add(self, h):
+        if self._filters[0].count >= self.capacity:
+            self.evictions += self.rotate()
+        self._filters[0].add(*h)
+
+    def add(self, tag):
+        h = self.hash(tag)
+        if not self._contains(h):
+            self._add(h)
+
+    def seen(self, tag, update=False):
+        self.expire()
+        h = self.hash(tag)
+        if self._contains(h):
+            self.hits += 1
+            return True
+        self.misses += 1
+        if update:
+            self._add(h)
+        return False
+
+    def expire(self, now=None):
+        now = self.clock() if now is None else now
+        behind = int((now - self._rotated) // self.rotate_every)
+        if behind > 0:
+            for _ in range(min(behind, len(self._filters))):
+                self.expired += self.rotate()
+            self._rotated += behind * self.rotate_every
+
+    def __contains__(self, tag):
+        return self._contains(self.hash(tag))
+
+    def __len__(self):
+        return sum(f.count for f in self._filters)
+
+    @property
+    def fill(self):
+        """fraction of bits set in the newest filter"""
+        return self._filters[0].fill
+
+    @property
+    def estimated_fp_rate(self):
+        """chance that a brand new tag hits any of the filters"""
+        miss = 1.0
+        for f in self._filters:
+            miss *= 1 - f.fill**f.k
+        return 1 - miss
+
+    @property
+    def nbytes(self):
+        return sum(len(f.bits) for f in self._filters)
+
+    def stats(self):
+        ret = super().stats()
+        ret.update(
+            fill=self.fill,
+            estimated_fp_rate=self.estimated_fp_rate,
+            capacity=self.capacity,
+            nbytes=self.nbytes,
+        )
+        return ret
+
+
+class _Peer:
+    def __init__(self, seq, tag_time, now):
+        self.first = seq  # lowest sequence number we can count as lost
+        self.hwm = seq  # highest sequence number seen
+        # bit i set: we've seen hwm-i. Numbers below first were sent before
+        # we heard of this peer; they're still welcome (as reordered) while
+        # they fit in the window, but we don't miss them if they never come
+        self.mask = 1
+        self.time = tag_time  # tag time of the hwm message
+        self.heard = now
+        self.received = 1
+        self.duplicates = self.lost = self.reordered = self.restarts = 0
+
+    def missing(self, reorder):
+        """bitmask of the numbers in the window we're still waiting for"""
+        valid = (1 << min(reorder, self.hwm - self.first + 1)) - 1
+        return ~self.mask & valid
+
+
+class SequenceDedup(DedupCache):
+    """per-sender high-water mark plus a small out-of-order window
+
+    Published messages carry a sequence number (Tag.seq) per sender and
+    channel, so all we need per (sender, channel) is the highest number
+    seen and a bitmask of the last reorder numbers below it. Memory is
+    O(peers) instead of O(messages), and numbers that fall out of the window
+    without ever arriving are counted as lost for that sender. Each channel
+    is numbered on its own because nodes only get the channels they (or
+    their neighbors) asked for; a shared count would show gaps everywhere.
+
+    A sequence number at or below the high-water mark with a tag time newer
+    than the high-water message means the sender restarted. Unsequenced tags
+    (seq 0: legacy text tags and dealt control messages) go to fallback.
+    Peers we haven't heard from in peer_timeout seconds are forgotten.
+    """
+
+    def __init__(
+        self,
+        window=10,
+        reorder=DEFAULT_REORDER_WINDOW,
+        peer_timeout=DEFAULT_PEER_TIMEOUT,
+        fallback=None,
+        clock=time.time,
+    ):
+        super().__init__(window=window, clock=clock)
+        self.reorder = reorder
+        self.peer_timeout = peer_timeout
+        self.fallback = (
+            OrderedDedup(window=window, clock=clock) if fallback is None else fallback
+        )
+        self.peers = OrderedDict()  # (sender name, channel) -> _Peer
+
+    def _advance(self, peer, tag):
+        shift = tag.seq - peer.hwm
+        full = (1 << self.reorder) - 1
+        missing = peer.missing(self.reorder)
+        if shift >= self.reorder:
+            # the whole old window leaves, and so do the gap numbers that
+            # don't fit in the new one
+            peer.lost += shift - self.reorder + bin(missing).count("1")
+            peer.mask = 1
+        else:
+            peer.lost += bin(missing >> (self.reorder - shift)).count("1")
+            peer.mask = ((peer.mask << shift) | 1) & full
+        peer.hwm = tag.seq
+        peer.time = max(peer.time, tag.time)
+
+    def _lookup(self, tag, update):
+        key = (tag.name, tag.channel)
+        peer = self.peers.get(key)
+        if peer is None:
+            if update:
+                self.peers[key] = _Peer(tag.seq, tag.time, self.clock())
+            return False
+
+        if update:
+            peer.heard = self.clock()
+            self.peers.move_to_end(key)
+
+        if tag.seq > peer.hwm:
+            if update:
+                peer.received += 1
+                self._advance(peer, tag)
+            return False
+
+        if tag.time > peer.time:
+            if update:
+                self.peers[key] = _Peer(tag.seq, tag.time, peer.heard)
+                self.peers[key].restarts = peer.restarts + 1
+            return False
+
+        off = peer.hwm - tag.seq
+        if off >= self.reorder or peer.mask >> off & 1:
+            # too old to tell is as good as a repeat
+            peer.duplicates += 1
+            return True
+
+        if update:
+            peer.received += 1
+            peer.reordered += 1
+            peer.mask |= 1 << off
+        return False
+
+    def seen(self, tag, update=False):
+        if not tag.seq:
+            return self.fallback.seen(tag, update=update)
+        self.expire()
+        if self._lookup(tag, update):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, tag):
+        if not tag.seq:
+            self.fallback.add(tag)
+        else:
+            self._lookup(tag, True)
+
+    def expire(self, now=None):
+        now = self.clock() if now is None else now
+        old = now - self.peer_timeout
+        while self.peers and next(iter(self.peers.values())).heard <= old:
+            self.peers.popitem(last=False)
+            self.expired += 1
+
+    def __contains__(self, tag):
+        if not tag.seq:
+            return tag in self.fallback
+        peer = self.peers.get((tag.name, tag.channel))
+        if peer is None or tag.seq > peer.hwm or tag.time > peer.time:
+            return False
+        off = peer.hwm - tag.seq
+        return off >= self.reorder or bool(peer.mask >> off & 1)
+
+    def __len__(self):
+        return len(self.peers) + len(self.fallback)
+
+    @property
+    def losses(self):
+        """sender name -> sequence numbers that never arrived (on any
+        channel)"""
+        ret = dict()
+        for (name, _), peer in self.peers.items():
+            ret[name] = ret.get(name, 0) + peer.lost
+        return ret
+
+    def peer_stats(self, name, channel=""):
+        peer = self.peers[(name, channel)]
+        return dict(
+            hwm=peer.hwm,
+            received=peer.received,
+            duplicates=peer.duplicates,
+            lost=peer.lost,
+            reordered=peer.reordered,
+            restarts=peer.restarts,
+        )
+
+    def stats(self):
+        ret = super().stats()
+        ret.update(
+            peers=len(self.peers),
+            lost=sum(peer.lost for peer in self.peers.values()),
+            reordered=sum(peer.reordered for peer in self.peers.values()),
+            fallback=self.fallback.stats(),
+        )
+        return ret
+
+
+DEDUP_BACKENDS = {
+    "ordered": OrderedDedup,
+    "bloom": BloomDedup,
+    "sequence": SequenceDedup,
+}
+
+
+def make_dedup(spec=DEFAULT_DEDUP, window=10):
+    """turn a backend name, DedupCache class or DedupCache into a DedupCache"""
+    if isinstance(spec, DedupCache):
+        return spec
+    if isinstance(spec, str):
+        try:
+            spec = DEDUP_BACKENDS[spec]
+        except KeyError as e:
+            raise ValueError(
+                f"unknown dedup backend {spec!r}, try one of {tuple(DEDUP_BACKENDS)}"
+            ) from e
+    return spec(window=window)
@@ -6,6 +6,7 @@ from .util import MyRE
 from .const import *
 
 _slurpies = (
+    MyRE(r"^(?P<proto>inproc|ipc)://(?P<host>.+)$"),
     MyRE(
         r"^(?:(?P<proto>.+)://)?(?P<host>[^:/]+|\[?[a-fA-F0-9:]+\]?)(?:$|:(?P<ports>.+?)$)"
     ),
@@ -22,6 +23,7 @@ class Endpoint:
     * an address and port pair (e.g. host:5555)
     * an address and port list (e.g., host:5555,5556,5557)
     * a whole URL (e.g., tcp://host:555), which can also have a port list
+    * inproc://name or ipc:///some/path
 
     Any specified ports drop into slots in this order:
 
@@ -33,6 +35,13 @@ class Endpoint:
     values in the series are incremented from the last specified.  That is,
     'host:80' implies 'host:80,81,82' and 'host:80,85' implies
     'host:80,85,86'.
+
+    inproc and ipc endpoints have no ports; each socket gets its own
+    address instead: inproc://name-pub, ipc:///some/path-router, etc.
+    Nodes only talk inproc through a shared context (see
+    jzmq.runtime.Runtime). Neither uses CURVE: inproc never leaves the
+    process, and the permissions on the ipc path's directory decide who
+    gets to connect to it.
     """
 
     host = "localhost"
@@ -76,23 +85,42 @@ class Endpoint:
                 proto = slurpizer["proto"]
                 if proto:
                     self.proto = proto
+                break
         self.identity = identity
 
     def __repr__(self):
         if self.identity is not None:
             return str(self.identity)
+        if self.named:
+            return f"{self.proto}://{self.host}"
         return f"{self.host}:[pub={self.pub} pull={self.pull} router={self.router}]"
 
-    def port(self, ptype=zmq.PUB):
-        if ptype in (zmq.PUB, zmq.SUB):
-            return self.pub
+    @property
+    def named(self):
+        """True for inproc and ipc, which have names instead of ports"""
+        return self.proto in NAMED_PROTOS
+
+    @property
+    def curve(self):
+        """whether the CURVE sockets to and from here should use CURVE"""
+        return self.proto not in CLEARTEXT_PROTOS
+
+    def role(self, ptype=zmq.PUB):
+        """which of our ports (pub, pull, router or rep) ptype uses"""
+        if ptype in (zmq.PUB, zmq.SUB, zmq.XPUB, zmq.XSUB):
+            return "pub"
         if ptype in (zmq.PULL, zmq.PUSH):
-            return self.pull
+            return "pull"
         if ptype in (zmq.ROUTER, zmq.DEALER):
-            return self.router
+            return "router"
         if ptype in (zmq.REP, zmq.REQ):
-            return self.rep
+            return "rep"
         raise ValueError(f"unknown type: {ptype}")
 
+    def port(self, ptype=zmq.PUB):
+        return getattr(self, self.role(ptype))
+
     def format(self, ptype=zmq.PUB):
+        if self.named:
+            return f"{self.proto}://{self.host}-{self.role(ptype)}"
         return f"{self.proto}://{self.host}:{self.port(ptype=ptype)}"
@@ -0,0 +1,196 @@
+# coding: utf-8
+
+import os
+import time
+import logging
+import tempfile
+from threading import Lock
+
+import zmq.auth
+
+from .util import scrub_identity_name_for_certfile
+
+DEFAULT_KEYRING_RESCAN = 5  # seconds between looks at the keyring directory
+
+log = logging.getLogger(__name__)
+
+
+class Keyring:
+    """in-memory index of the public keys in a keyring directory
+
+    Each NAME.key file holds the public key of the node whose identity
+    scrubs to NAME (see jzmq.util.scrub_identity_name_for_certfile). We parse
+    a file when it's new or its mtime or size changed, so get() never touches
+    the disk and rescan() costs a stat per file.
+
+    A Keyring is also a CURVE credentials provider (see
+    zmq.auth.Authenticator.configure_curve_callback): callback() allows
+    exactly the keys in the index, so certs copied into (or deleted from) the
+    directory take effect without restarting the auth thread. An unknown key
+    rescans right away if the directory changed since we last looked, which
+    is how a peer whose cert was copied in a moment ago gets in without
+    waiting for the next scheduled rescan.
+    """
+
+    def __init__(self, path, interval=DEFAULT_KEYRING_RESCAN, clock=time.monotonic):
+        self.path = path
+        self.interval = interval
+        self.clock = clock
+        self.keys = dict()  # NAME -> z85 public key
+        self.allowed = frozenset()  # the keys callback() lets in
+        self.rescans = 0
+        self._stats = dict()  # NAME -> (mtime_ns, size) when we parsed it
+        self._dir_mtime = None
+        self._next = 0
+        self._changed = dict()  # what changed since the last changes()
+        # the auth thread's callback() can rescan while the node does
+        self._lock = Lock()
+
+    def pathname(self, node_id):
+        return os.path.join(self.path, self.name(node_id) + ".key")
+
+    @staticmethod
+    def name(node_id):
+        return scrub_identity_name_for_certfile(node_id)
+
+    def get(self, node_id, default=None):
+        return self.keys.get(self.name(node_id), default)
+
+    def __contains__(self, node_id):
+        return self.name(node_id) in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _listdir(self):
+        ret = dict()
+        try:
+            entries = list(os.scandir(self.path))
+        except FileNotFoundError:
+            return ret
+        for entry in entries:
+            # NAME.key_secret doesn't end in .key, so only public keys match
+            if not entry.name.endswith(".key"):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            ret[entry.name[:-4]] = (st.st_mtime_ns, st.st_size)
+        return ret
+
+    def _load(self, name):
+        try:
+            public_key, _ = zmq.auth.load_certificate(
+                os.path.join(self.path, name + ".key")
+            )
+        except (OSError, ValueError) as e:
+            log.error("unable to load %s.key from %s: %s", name, self.path, e)
+            return None
+        return public_key
+
+    def _dir_changed(self):
+        try:
+            return os.stat(self.path).st_mtime_ns != self._dir_mtime
+        except FileNotFoundError:
+            return self._dir_mtime is not None
+
+    def rescan(self):
+        """bring the index up to date with the directory; returns
+        {NAME: (old key, new key)} for every key that appeared, changed or
+        went away (None for a missing key)"""
+        with self._lock:
+            self._next = self.clock() + self.interval
+            self.rescans += 1
+            try:
+                self._dir_mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                self._dir_mtime = None
+            stats = self._listdir()
+            changed = dict()
+            for name in set(self._stats) - set(stats):
+                old = self.keys.pop(name, None)
+                if old is not None:
+                    changed[name] = (old, None)
+            for name, st in stats.items():
+                if self._stats.get(name) == st:
+                    continue
+                old, new = self.keys.get(name), self._load(name)
+                if new is None:
+                    self.keys.pop(name, None)
+                else:
+                    self.keys[name] = new
+                if new != old:
+                    changed[name] = (old, new)
+            self._stats = stats
+            for name, (old, new) in changed.items():
+                old = self._changed.pop(name, (old, None))[0]
+                if old != new:
+                    self._changed[name] = (old, new)
+            if changed:
+                self.allowed = frozenset(self.keys.values())
+                log.debug("keyring %s changed: %s", self.path, sorted(changed))
+            return changed
+
+    def changes(self):
+        """everything rescan() found changed since we last asked (whoever
+        called rescan(), the auth thread included), like rescan() returns it"""
+        with self._lock:
+            ret, self._changed = self._changed, dict()
+        return ret
+
+    def timeout(self):
+        """seconds until the next scheduled rescan"""
+        return max(0, self._next - self.clock())
+
+    def maybe_rescan(self):
+        """rescan() if it's time; returns what changed ({} if we didn't
+        look)"""
+        if self.clock() < self._next:
+            return dict()
+        return self.rescan()
+
+    def add(self, node_id, public_key):
+        """write public_key to node_id's key file and index it; when there
+        already is a key file, index that instead. Returns the pathname"""
+        pname = self.pathname(node_id)
+        with self._lock:
+            if not os.path.isfile(pname):
+                os.makedirs(self.path, mode=0o0700, exist_ok=True)
+                # write and rename, so nobody sharing the keyring (or
+                # rescanning it) ever parses half a key file
+                fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+                with os.fdopen(fd, "wb") as fh:
+                    fh.write(b"# generated via rep/req pubkey transfer\n\n")
+                    fh.write(b"metadata\n")
+                    # NOTE: in zmq/auth/certs.py's _write_key_file,
+                    # metadata should be key-value pairs; roughly like the
+                    # following (although with their particular py2/py3
+                    # nerosis edited out):
+                    #
+                    # f.write('metadata\n')
+                    #     for k,v in metadata.items():
+                    #         f.write(f"    {k} = {v}\n")
+                    fh.write(b"curve\n")
+                    fh.write(b'    public-key = "')
+                    fh.write(public_key)
+                    fh.write(b'"')
+                os.replace(tmp, pname)
+            else:
+                # somebody beat us to it; theirs is the one we'll use
+                public_key = self._load(self.name(node_id))
+            if public_key is not None:
+                self.keys[self.name(node_id)] = public_key
+                self.allowed = self.allowed | {public_key}
+        return pname
+
+    def callback(self, domain, key):  # pylint: disable=unused-argument
+        """CURVE credentials provider: is key (z85) one of ours?"""
+        if key in self.allowed:
+            return True
+        if self._dir_changed():
+            self.rescan()
+        return key in self.allowed
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path}, {len(self.keys)} keys)"
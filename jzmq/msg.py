@@ -1,32 +1,94 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import struct
 from time import time as now
 from jzmq.util import MyRE
 
 TAG_RE = MyRE(r"<(.+?):(\d+|\d+\.\d+)>")
 
+WIRE_TEXT = "text"
+WIRE_BINARY = "binary"
+DEFAULT_WIRE = WIRE_BINARY
+
+# The binary tag frame is a fixed header followed by the (utf-8) sender name:
+#
+#   magic:B version:B flags:B time:d seq:Q name_len:B name
+#
+# 0xff can never start a utf-8 string, so a binary header can't be confused
+# with a legacy "<name:time>" tag (or with any other text frame). Later
+# versions may only append after the name, so we decode the part we know for
+# any version >= 1. On bench/micro.py a binary tag encodes in about half the
+# time of a text one and decodes in about a third.
+#
+# flags say what follows the name. Nothing does yet: WIRE_FLAG_HOPS is
+# reserved for a hop list (a count byte, then a length byte and a utf-8 name
+# per hop), which we'll append once something reads it. Decoders skip
+# whatever follows the name, so setting a flag doesn't need a new version.
+WIRE_MAGIC = 0xFF
+WIRE_VERSION = 1
+WIRE_HEADER = struct.Struct("!BBBdQB")
+WIRE_FLAG_HOPS = 0x01
+
+# Messages on a named channel lead with a channel frame: 0xfe (which can't
+# start a utf-8 string either) and the utf-8 channel name. SUB sockets
+# filter on the first frame, so subscribing to the channel frame's prefix
+# picks out the channel (and, like any zmq topic, every channel it's a prefix
+# of). Messages on the default channel ("") have no channel frame at all; they
+# start with a tag frame, so the default channel's filters are the two ways a
+# tag frame can start.
+CHANNEL_MAGIC = 0xFE
+DEFAULT_CHANNEL_FILTERS = (bytes((WIRE_MAGIC,)), b"<")
+
 
 def decode_part(x):
     try:
         x = x.decode()
     except AttributeError:
-        pass
+        if hasattr(x, "buffer"):  # zmq.Frame from recv_multipart(copy=False)
+            x = str(x.buffer, "utf-8")
     return x
 
 
+def encode_part(x, *a, **kw):
+    if isinstance(x, (bytes, bytearray)):
+        return x
+    return x.encode(*a, **kw)
+
+
+def channel_frame(channel):
+    return bytes((CHANNEL_MAGIC,)) + channel.encode()
+
+
+def channel_filters(channel):
+    """the SUBSCRIBE prefixes that pick out channel"""
+    if not channel:
+        return DEFAULT_CHANNEL_FILTERS
+    return (channel_frame(channel),)
+
+
+def decode_channel(part):
+    """the channel name if part is a channel frame; otherwise None"""
+    part = getattr(part, "bytes", part)  # zmq.Frame; header frames are small
+    if isinstance(part, (bytes, bytearray, memoryview)):
+        if part[:1] == bytes((CHANNEL_MAGIC,)):
+            return str(part[1:], "utf-8")
+    return None
+
+
 class StupidMessage(list):
     publish_mark = True
 
     def __init__(self, *parts):
-        super().__init__(decode_part(x) for x in parts)
+        if parts:
+            super().__init__(decode_part(x) for x in parts)
 
     def encode(self, *a, prefix=None, **kw):
         if prefix is None:
             prefix = tuple()
         if not isinstance(prefix, (tuple, list)):
             prefix = (prefix,)
-        return tuple(x.encode(*a, **kw) for x in prefix) + tuple(
+        return tuple(encode_part(x, *a, **kw) for x in prefix) + tuple(
             x.encode(*a, **kw) for x in self
         )
 
@@ -35,8 +97,8 @@ class StupidMessage(list):
 
 
 class Tag:
-    def __init__(self, name, time=None):
-        if TAG_RE.match(name):
+    def __init__(self, name, time=None, seq=0, flags=0):
+        if name[:1] == "<" and TAG_RE.match(name):
             name = TAG_RE.group(1)
             if time is None:
                 time = TAG_RE.group(2)
@@ -45,41 +107,168 @@ class Tag:
             self.time = float(time)
         except TypeError:
             self.time = now()
+        self.seq = seq
+        self.flags = flags
+        # the channel travels in its own frame, not in the tag frame; the
+        # message sets it so dedup can tell the channels' sequences apart
+        self.channel = ""
+
+    @classmethod
+    def decode(cls, part):
+        """return a Tag if part looks like a tag frame (binary or legacy text)
+        or a Tag; otherwise return None"""
+        if isinstance(part, Tag):
+            return part
+        part = getattr(part, "bytes", part)  # zmq.Frame; header frames are small
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            if part and part[0] == WIRE_MAGIC:
+                return cls.unpack(part)
+            if part[:1] != b"<":
+                return None
+            part = decode_part(part)
+        if isinstance(part, str) and part[:1] == "<" and TAG_RE.match(part):
+            return cls(TAG_RE.group(1), TAG_RE.group(2))
+        return None
+
+    @classmethod
+    def unpack(cls, part):
+        """decode a binary tag frame; ValueError if it's malformed"""
+        try:
+            magic, version, flags, time, seq, nlen = WIRE_HEADER.unpack_from(part)
+        except struct.error as e:
+            raise ValueError(f"truncated tag header: {e}") from e
+        if magic != WIRE_MAGIC or version < 1:
+            raise ValueError(
+                f"not a binary tag header (magic={magic} version={version})"
+            )
+        end = WIRE_HEADER.size + nlen
+        if len(part) < end:
+            raise ValueError(f"truncated tag name ({len(part)} of {end} bytes)")
+        # a bad name raises UnicodeDecodeError, which is a ValueError too
+        return cls(str(part[WIRE_HEADER.size : end], "utf-8"), time, seq, flags)
+
+    def pack(self):
+        name = self.name.encode()
+        if len(name) > 255:
+            raise ValueError(f"{self!r} is too large to pack")
+        return (
+            WIRE_HEADER.pack(
+                WIRE_MAGIC, WIRE_VERSION, self.flags, self.time, self.seq, len(name)
+            )
+            + name
+        )
 
     def __str__(self):
         return f"<{self.name}:{self.time}>"
 
-    def encode(self, *a, **kw):
-        return self.__str__().encode(*a, **kw)
+    def encode(self, *a, wire=None, **kw):
+        if (wire or DEFAULT_WIRE) == WIRE_BINARY:
+            return self.pack()
+        return str(self).encode(*a, **kw)
 
     __repr__ = __str__
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.name == other.name and self.time == other.time
+            return (
+                self.name == other.name
+                and self.time == other.time
+                and self.seq == other.seq
+                and self.channel == other.channel
+            )
 
     def __hash__(self):
-        return (self.name, self.time).__hash__()
+        return (self.name, self.time, self.seq, self.channel).__hash__()
 
 
 class TaggedMessage(StupidMessage):
-    def __init__(self, *parts, sep=" ", name="unknown"):
+    # the raw tag and payload frames this message was received as (see
+    # from_frames()); encode() hands these back untouched so a relay can
+    # forward the message without re-encoding it
+    frames = None
+    # payload frames nobody has read yet; they're decoded the first time the
+    # payload is (see _payload()), so a relay that only looks at the tag
+    # never decodes them at all
+    _lazy = None
+
+    def __init__(self, *parts, sep=" ", name="unknown", seq=0, channel="", lazy=False):
+        tag = parts[0] if parts else None
+        if not isinstance(tag, Tag):  # from_frames() hands us a decoded tag
+            if parts and decode_channel(parts[0]) is not None:
+                channel, *parts = parts
+                channel = decode_channel(channel)
+            tag = Tag.decode(parts[0]) if parts else None
+        if tag is not None:
+            parts = parts[1:]
+        if lazy:
+            self._lazy = tuple(parts)
+            parts = ()
         super().__init__(*parts)
 
         self.sep = sep
+        self.tag = Tag(name, seq=seq) if tag is None else tag
+        self.tag.channel = self.channel = channel
 
-        if len(self) < 1:
-            self.tag = Tag(name)
-        else:
-            if isinstance(self[0], Tag):
-                self.tag = Tag(self[0].name, self[0].time)
-                self.pop(0)
-            else:
-                if isinstance(self[0], str) and TAG_RE.match(self[0]):
-                    self.tag = Tag(TAG_RE.group(1), TAG_RE.group(2))
-                    self.pop(0)
-                else:
-                    self.tag = Tag(name)
+    @classmethod
+    def from_frames(cls, frames, accept=None):
+        """build a message from received parts (bytes or zmq.Frame) and keep
+        the frames for forwarding. The payload is decoded when something
+        reads it, not here. If accept is given, it's called with the decoded
+        tag; when it returns false, we return None"""
+        channel = decode_channel(frames[0]) if frames else None
+        body = frames if channel is None else frames[1:]
+        tag = Tag.decode(body[0]) if body else None
+        if tag is None:
+            return cls(*frames)
+        tag.channel = channel or ""
+        if accept is not None and not accept(tag):
+            return None
+        msg = cls(tag, *body[1:], channel=channel or "", lazy=True)
+        msg.frames = tuple(frames)
+        return msg
+
+    def decode_payload(self):
+        """decode the payload now if it hasn't been; UnicodeDecodeError (a
+        ValueError) if it isn't utf-8"""
+        self._payload()
+        return self
+
+    def _payload(self):
+        if self._lazy is not None:
+            parts = [decode_part(x) for x in self._lazy]
+            self._lazy = None
+            super().extend(parts)
+
+    def raw(self, idx):
+        """payload part idx as bytes (or a memoryview), without decoding
+        the payload"""
+        if self._lazy is not None:
+            part = self._lazy[idx]
+            return getattr(part, "buffer", part)  # zmq.Frame
+        return encode_part(super().__getitem__(idx))
+
+    def part_is(self, idx, text):
+        """whether payload part idx is text, without decoding the payload"""
+        if idx >= len(self):
+            return False
+        return self.raw(idx) == text.encode()
+
+    def __iter__(self):
+        self._payload()
+        return super().__iter__()
+
+    def __getitem__(self, idx):
+        self._payload()
+        return super().__getitem__(idx)
+
+    def __contains__(self, item):
+        self._payload()
+        return super().__contains__(item)
+
+    def __len__(self):
+        if self._lazy is not None:
+            return len(self._lazy)
+        return super().__len__()
 
     def __eq__(self, other):
         if isinstance(other, TaggedMessage):
@@ -90,13 +279,21 @@ class TaggedMessage(StupidMessage):
         return self.msg
 
     def __repr__(self):
+        if self.channel:
+            return f"TaggedMessage[{self.tag}#{self.channel}]{tuple(self)}"
         return f"TaggedMessage[{self.tag}]{tuple(self)}"
 
-    def encode(self, *a, **kw):
-        return super().encode(*a, prefix=self.tag, **kw)
+    def encode(self, *a, wire=None, **kw):
+        if self.frames is not None:
+            return self.frames
+        prefix = (self.tag.encode(*a, wire=wire, **kw),)
+        if self.channel:
+            prefix = (channel_frame(self.channel),) + prefix
+        return super().encode(*a, prefix=prefix, **kw)
 
     @property
     def msg(self):
+        self._payload()  # str.join() reads the list directly, not via __iter__
         return self.sep.join(self)
 
     @property
@@ -107,25 +304,31 @@ class TaggedMessage(StupidMessage):
     def name(self):
         return self.tag.name
 
+    @property
+    def seq(self):
+        return self.tag.seq
+
 
 class RoutedMessage(TaggedMessage):
     @classmethod
-    def decode(cls, parts):
+    def decode(cls, parts, keep_frames=False):
+        if parts and decode_channel(parts[0]) is not None:
+            return None  # published on a channel, never routed
         route_parts = list()
-        tag = None
-        msg_parts = list()
 
-        for part in parts:
-            part = decode_part(part)
-            if tag:
-                msg_parts.append(part)
-            elif TAG_RE.match(part):
-                tag = Tag(TAG_RE.group(1), TAG_RE.group(2))
-            else:
-                route_parts.append(part)
+        for i, part in enumerate(parts):
+            tag = Tag.decode(part)
+            if tag is not None:
+                break
+            route_parts.append(decode_part(part))
+        else:
+            return None
 
-        if route_parts and tag and msg_parts:
-            return cls(route_parts, *([tag] + msg_parts))
+        if route_parts and len(parts) > i + 1:
+            msg = cls(route_parts, tag, *parts[i + 1 :], lazy=keep_frames)
+            if keep_frames:
+                msg.frames = tuple(parts[i:])
+            return msg
 
     def __init__(self, to, *parts, **kw):
         super().__init__(*parts, **kw)
@@ -148,10 +351,13 @@ class RoutedMessage(TaggedMessage):
     def prefix(self):
         return self.to + (self.tag,)
 
-    def encode(self, *a, **kw):
+    def encode(self, *a, wire=None, **kw):
+        if self.frames is not None:
+            return tuple(encode_part(x, *a, **kw) for x in self.to) + self.frames
+        prefix = self.to + (self.tag.encode(*a, wire=wire, **kw),)
         # we want TaggedMessage's ancestor, not RoutedMessage's ancestor
         # pylint: disable=bad-super-call
-        return super(TaggedMessage, self).encode(*a, prefix=self.prefix, **kw)
+        return super(TaggedMessage, self).encode(*a, prefix=prefix, **kw)
 
     def __repr__(self):
         return f"RoutedMessage[{self.tag}]{tuple(self)} -> {self.to}"
@@ -2,60 +2,101 @@
 
 import os
 import sys, signal
-import re
 import logging
-import time
-from collections import deque
-from threading import Thread
+from collections import namedtuple, Counter, defaultdict
+from functools import partial
+from itertools import count
 from socket import gethostname
 
 import zmq
 from zmq.auth.thread import ThreadAuthenticator
 
-from .msg import TaggedMessage, RoutedMessage, Tag
+from .msg import TaggedMessage, RoutedMessage, DEFAULT_WIRE
 from .util import zmq_socket_type_name
 from .endpoint import Endpoint
-
-ROUTE_QUEUE_LEN = 10
+from .sockopts import make_sockopts, DEFAULT_SOCKOPTS
+from .runtime import Runtime
+from .wai import WhoAreYouOptions, shared_wai_service
+from .outbound import Outbound, OutboundOptions
+from .route import RouteOptions, RoutingMixin
+from .bootstrap import BootstrapMixin
+from .channels import ChannelsMixin
+
+DEFAULT_MAX_BATCH = 32  # max messages poll() drains from one socket per wakeup
 DEFAULT_KEYRING = os.path.expanduser(os.path.join("~", ".config", "jzmq", "keyring"))
 BROADCAST_PREFIX = "!BCAST!"
 
-
-def scrub_identity_name_for_certfile(x):
-    if isinstance(x, (bytes, bytearray)):
-        x = x.decode()
-    return re.sub(r"[^\w\d_-]+", "_", x)
+# poll() dispatch entry for each socket in the poller (see StupidNode.dispatch)
+Dispatch = namedtuple("Dispatch", ("kind", "idx", "endpoint", "handler"))
 
 
-class StupidNode:
-    pubkey = privkey = None
-    channel = ""  # subscription filter or something (I think)
+class StupidNode(BootstrapMixin, ChannelsMixin, RoutingMixin):
     PORTS = 4  # as we add or remove ports, make sure this is the number of ports a StupidNode uses
-
-    def __init__(self, endpoint="*", identity=None, keyring=DEFAULT_KEYRING):
-        self.keyring = keyring
+    zero_copy = False  # receive zmq.Frames and forward them without re-encoding
+    authenticator = ThreadAuthenticator
+
+    def __init__(
+        self,
+        endpoint="*",
+        identity=None,
+        keyring=DEFAULT_KEYRING,
+        wire=DEFAULT_WIRE,
+        max_batch=DEFAULT_MAX_BATCH,
+        channels=(),
+        sockopts=DEFAULT_SOCKOPTS,
+        outbound_opts=None,
+        route_opts=None,
+        wai_opts=None,
+        runtime=None,
+    ):
+        """channels are the named channels to subscribe() to right away (the
+        default channel "" is always subscribed). keyring is a directory or a
+        jzmq.keyring.Keyring. The other options are documented where they're
+        defined: sockopts (jzmq.sockopts.make_sockopts), outbound_opts
+        (jzmq.outbound.OutboundOptions), route_opts (jzmq.route.RouteOptions),
+        wai_opts (jzmq.wai.WhoAreYouOptions) and runtime (jzmq.runtime.Runtime)."""
+        wai_opts = WhoAreYouOptions() if wai_opts is None else wai_opts
+        self.max_batch = max(1, max_batch)
+        self.wire = wire  # tag frame format we send; we receive either format
+        self.sockopts = make_sockopts(sockopts)
+        self.hwm_drops = Counter()  # socket kind -> messages dropped at the HWM
+        self.outbound = dict()  # DEALER -> Outbound
+        self.outbound_opts = (
+            OutboundOptions() if outbound_opts is None else outbound_opts
+        )
         self.endpoint = (
             endpoint if isinstance(endpoint, Endpoint) else Endpoint(endpoint)
         )
         self.endpoints = list()
-        self.identity = identity or f"{gethostname()}-{self.endpoint.pub}"
+        self.identity = identity or (
+            f"{gethostname()}-{self.endpoint.host}"
+            if self.endpoint.named
+            else f"{gethostname()}-{self.endpoint.pub}"
+        )
         self.log = logging.getLogger(f"{self.identity}")
 
-        self.log.debug("begin node setup / creating context")
+        self.log.debug("begin node setup")
 
-        self.ctx = zmq.Context()
-        self.cleartext_ctx = zmq.Context()
+        if runtime is None:
+            # a Runtime just for us, that goes away with us (see closekill())
+            runtime = Runtime(
+                wai_service=shared_wai_service(),
+                name=self.identity,
+                cleartext_ctx=wai_opts.cleartext_ctx,
+                autoclose=True,
+            )
+        self.runtime = runtime
 
-        self.start_auth()
+        BootstrapMixin.__init__(self, keyring, wai_opts)
 
         self.log.debug("creating sockets")
 
-        self.pub = self.mk_socket(zmq.PUB)
-        self.router = self.mk_socket(zmq.ROUTER)
+        # an XPUB so we can see what our subscribers are interested in
+        self.pub = self.mk_socket(zmq.XPUB, curve_keys=self.endpoint.curve)
+        self.router = self.mk_socket(zmq.ROUTER, curve_keys=self.endpoint.curve)
         self.router.router_mandatory = (
             1  # one of the few opts that can be set after bind()
         )
-        self.rep = self.mk_socket(zmq.REP, enable_curve=False)
 
         self.sub = list()
         self.dealer = list()
@@ -64,159 +105,181 @@ class StupidNode:
 
         self.bind(self.pub)
         self.bind(self.router)
-        self.bind(self.rep, enable_curve=False)
+
+        ChannelsMixin.__init__(self, channels)
+        RoutingMixin.__init__(
+            self, RouteOptions() if route_opts is None else route_opts
+        )
 
         self.log.debug("registering polling")
 
         self.poller = zmq.Poller()
+        self.poller.register(self.pub, zmq.POLLIN)
         self.poller.register(self.router, zmq.POLLIN)
 
+        # socket -> Dispatch, so poll() never has to search the socket lists
+        self.dispatch = dict()
+        self._rebuild_dispatch()
+
         self.log.debug("configuring interrupt signal")
         signal.signal(signal.SIGINT, self.interrupt)
 
-        self.log.debug("configuring WAI Reply Thread")
-        self._who_are_you_thread = Thread(target=self.who_are_you_reply_machine)
-        self._who_are_you_continue = True
-        self._who_are_you_thread.start()
+        self.start_who_are_you()
 
-        self.route_queue = deque(list(), ROUTE_QUEUE_LEN)
-        self.routes = dict()
+        # sequence numbers for the tags we publish, counted per channel (our
+        # neighbors only get the channels they want, see jzmq.dedup)
+        self.seq = defaultdict(partial(count, 1))
 
         self.log.debug("node setup complete")
 
-    def who_are_you_reply_machine(self):
-        while self._who_are_you_continue:
-            if self.rep.poll(200):
-                self.log.debug("wai polled, trying to recv")
-                msg = self.rep.recv()
-                ttype = zmq_socket_type_name(self.rep)
-                self.log.debug('received "%s" over %s socket', msg, ttype)
-                msg = [self.identity.encode(), self.pubkey]
-                self.log.debug('sending "%s" as reply over %s socket', msg, ttype)
-                self.rep.send_multipart(msg)
-        self.log.debug("wai thread seems finished, loop broken")
-
-    def start_auth(self):
-        self.log.debug("starting auth thread")
-        self.auth = ThreadAuthenticator(self.ctx)
-        self.auth.start()
-        self.auth.allow("127.0.0.1")
-        self.auth.configure_curve(domain="*", location=self.keyring)
-        self.load_or_create_key()
-
     @property
-    def key_basename(self):
-        return scrub_identity_name_for_certfile(self.identity)
+    def ctx(self):
+        return self.runtime.ctx
 
     @property
-    def key_filename(self):
-        return os.path.join(self.keyring, self.key_basename + ".key")
+    def cleartext_ctx(self):
+        return self.runtime.cleartext_ctx
 
     @property
-    def secret_key_filename(self):
-        return self.key_filename + "_secret"
-
-    def load_key(self):
-        self.log.debug("loading node key-pair")
-        self.pubkey, self.privkey = zmq.auth.load_certificate(self.secret_key_filename)
+    def auth(self):
+        return self.runtime.auth
 
-    def load_or_create_key(self):
-        try:
-            self.load_key()
-        except IOError as e:
-            self.log.debug("error loading key: %s", e)
-            self.log.debug("creating node key-pair")
-            os.makedirs(self.keyring, mode=0o0700, exist_ok=True)
-            zmq.auth.create_certificates(self.keyring, self.key_basename)
-            self.load_key()
-
-    def preprocess_message(self, msg, msg_class=TaggedMessage):
+    def preprocess_message(
+        self, msg, msg_class=TaggedMessage, sequenced=False, channel="", encode=True
+    ):
+        """returns msg as a msg_class and its encoding (None unless encode)"""
         if not isinstance(msg, msg_class):
             if not isinstance(msg, (list, tuple)):
                 msg = (msg,)
-            msg = msg_class(*msg, name=self.identity)
-        rmsg = repr(msg)
-        emsg = msg.encode()
-        return msg, rmsg, emsg
-
-    def route_failed(self, msg):
-        if not isinstance(msg, RoutedMessage):
-            raise TypeError("msg must already be a RoutedMessage")
-        msg.failures += 1
-        if msg.failures <= 5:
-            self.log.debug("(re)queueing %s for later delivery", repr(msg))
-            if len(self.route_queue) == self.route_queue.maxlen:
-                self.log.error(
-                    "route_queue full, discarding %s", repr(self.route_queue[0])
-                )
-            self.route_queue.append(msg)
-        else:
-            self.log.error("discarding %s after %d failures", repr(msg), msg.failures)
-
-    def route_message(self, to, msg):
-        if isinstance(to, StupidNode):
-            to = to.identity
-        if isinstance(to, (list, tuple)):
-            to = to[-1]
-        R = self.routes.get(to)
-        if R:
-            to = (R[0], to)
-        if isinstance(msg, RoutedMessage):
-            msg.to = to
-        else:
-            # preprocess passes *msg to msg_class() -- ie, RoutedMessage(to, *msg)
-            if isinstance(msg, list):
-                msg = tuple(msg)
-            elif not isinstance(msg, tuple):
-                msg = (msg,)
-            msg = (to,) + msg
-        tmsg, rmsg, emsg = self.preprocess_message(msg, msg_class=RoutedMessage)
-        self.log.debug("routing message %s -- encoding: %s", rmsg, emsg)
-        try:
-            self.router.send_multipart(emsg)
-        except zmq.error.ZMQError as zmq_e:
-            self.log.debug("route to %s failed: %s", to, zmq_e)
-            if "Host unreachable" not in str(zmq_e):
-                raise
-            self.route_failed(tmsg)
+            seq = next(self.seq[channel]) if sequenced else 0
+            msg = msg_class(*msg, name=self.identity, seq=seq, channel=channel)
+        emsg = msg.encode(wire=self.wire) if encode else None
+        return msg, emsg
+
+    def run_timers(self):
+        """disconnect slow peers (see jzmq.outbound.disconnect), do the
+        bootstrap chores (see run_bootstrap_timers()) and retry the
+        destinations whose backoff has run out"""
+        for sock in [s for s, out in self.outbound.items() if out.slow]:
+            endpoint = self.dispatch[sock].endpoint
+            self.log.warning(
+                "disconnecting %s, dropping %d queued message(s): %s",
+                endpoint,
+                len(self.outbound[sock]),
+                self.outbound[sock],
+            )
+            for parts in self.outbound[sock].queue:
+                self.outbound_evicted(parts)  # routed ones get another go
+            self.disconnect_from_endpoint(self.dispatch[sock].idx)
+        self.run_bootstrap_timers()
+        self.retry_routes()
+
+    def timer_timeout(self):
+        """seconds until run_timers() has something to do"""
+        if self.evicted or any(out.slow for out in self.outbound.values()):
+            return 0
+        timeouts = [self.retry.timeout(), *self.bootstrap_timeouts()]
+        return min(t for t in timeouts if t is not None)
+
+    def wake_timers(self):
+        """called when timer_timeout() may have moved up; poll() runs the
+        timers every time anyway, so there's nothing to do here"""
+
+    def _send(self, sock, parts):
+        """send (or queue) parts on sock; False if a DEALER's outbound queue
+        dropped them"""
+        out = self.outbound.get(sock)
+        if out is not None:
+            sent = out.send(parts)
+            if not sent:
+                self.log.debug("outbound queue full, dropped a message: %s", out)
+            if out.queue:
+                # poll() flushes it once the socket is writable again
+                self.poller.modify(sock, zmq.POLLIN | zmq.POLLOUT)
+            if out.slow:
+                self.wake_timers()
+            return sent
+        # the ROUTER (router_mandatory) raises zmq.Again at the HWM, and so
+        # does the PUB if the sockopts give it xpub_nodrop; otherwise it drops
+        # without telling anyone
+        sock.send_multipart(parts, flags=zmq.NOBLOCK)
+        return True
+
+    def flush_outbound(self, sock):
+        if self.outbound[sock].flush():
+            self.poller.modify(sock, zmq.POLLIN)
+
+    def outbound_stats(self):
+        """endpoint -> the stats of the outbound queue of our DEALER to it"""
+        return {
+            self.endpoints[idx]: self.outbound[sock].stats()
+            for idx, sock in enumerate(self.dealer)
+        }
 
     def deal_message(self, msg):
         self.log.debug("dealing message (actually publishing with no_publish=True)")
         self.publish_message(msg, no_publish=True)
 
-    def publish_message(self, msg, no_deal=False, no_deal_to=None, no_publish=False):
-        tmsg, rmsg, emsg = self.preprocess_message(msg)
-        self.log.debug(
-            "publishing message %s no_publish=%s, no_deal=%s, no_deal_to=%s",
-            rmsg,
-            no_publish,
-            no_deal,
-            no_deal_to,
+    def publish_message(
+        self, msg, no_deal=False, no_deal_to=None, no_publish=False, channel=""
+    ):
+        """channel only applies when msg isn't a TaggedMessage already (those
+        keep their own). When no subscriber wants msg's channel we skip the
+        PUB send, and we only deal it to the neighbors that want it (see
+        peer_wants()); when nothing gets sent at all we never encode msg."""
+        # only messages that flood the whole bus get a sequence number;
+        # anything else would look like a gap to the nodes that never see it
+        tmsg, emsg = self.preprocess_message(
+            msg, sequenced=not no_publish, channel=channel, encode=False
         )
+        # checked once here rather than by each log call in the loop below
+        debug = self.log.isEnabledFor(logging.DEBUG)
+        if debug:
+            self.log.debug(
+                "publishing message %r no_publish=%s, no_deal=%s, no_deal_to=%s",
+                tmsg,
+                no_publish,
+                no_deal,
+                no_deal_to,
+            )
         self.local_workflow(tmsg)
         if not no_publish:
-            self.pub.send_multipart(emsg)
-        if no_deal:
+            if self.has_subscribers(tmsg.channel):
+                emsg = tmsg.encode(wire=self.wire)
+                try:
+                    self._send(self.pub, emsg)
+                    self.published += 1
+                except zmq.Again:
+                    self.log.debug("PUB at its HWM, dropped %r", tmsg)
+                    self.hwm_drops["pub"] += 1
+            else:
+                if debug:
+                    self.log.debug("no subscribers for %r, not publishing", tmsg)
+                self.publish_skipped += 1
+        if no_deal or not self.dealer:
             return
         if no_deal_to is None:
             ok_send = lambda x: True
         elif callable(no_deal_to):
             ok_send = no_deal_to
         elif isinstance(no_deal_to, zmq.Socket):
-            npt_i = self.dealer.index(no_deal_to)
+            npt_i = self.dispatch[no_deal_to].idx
             ok_send = lambda x: x != npt_i
         elif isinstance(no_deal_to, int):
             ok_send = lambda x: x != no_deal_to
         elif isinstance(no_deal_to, (list, tuple)):
             ok_send = lambda x: x not in no_deal_to
         for i, sock in enumerate(self.dealer):
-            if ok_send(i):
-                self.log.debug("dealing message %s to %s", rmsg, self.endpoints[i])
-                sock.send_multipart(emsg)
-            else:
-                self.log.debug("not sending %s to %s", rmsg, self.endpoints[i])
-
-    def mk_socket(self, stype, enable_curve=True):
+            if ok_send(i) and self.peer_wants(sock, tmsg.channel):
+                if debug:
+                    self.log.debug("dealing message %r to %s", tmsg, self.endpoints[i])
+                if emsg is None:
+                    emsg = tmsg.encode(wire=self.wire)
+                self._send(sock, emsg)
+            elif debug:
+                self.log.debug("not sending %r to %s", tmsg, self.endpoints[i])
+
+    def mk_socket(self, stype, enable_curve=True, curve_keys=True):
         # defaults:
         # socket.setsockopt(zmq.LINGER, -1) # infinite
         # socket.setsockopt(zmq.IDENTITY, None)
@@ -226,10 +289,17 @@ class StupidNode:
         # socket.setsockopt(zmq.TCP_KEEPALIVE_IDLE, -1)
         # socket.setsockopt(zmq.RECONNECT_IVL, 100)
         # socket.setsockopt(zmq.RECONNECT_IVL_MAX, 0) # 0 := always use IVL
+        #
+        # self.sockopts (see jzmq.sockopts) overrides any of these, and sets
+        # the HWMs and buffer sizes, before we bind or connect
 
         # the above can be accessed as attributes instead (they are case
         # insensitive, we choose lower case below so it looks like boring
         # python)
+        #
+        # curve_keys=False leaves a crypto context socket without our keys,
+        # for talking to inproc and ipc endpoints (see Endpoint.curve): a
+        # socket with keys insists on a CURVE handshake
 
         if enable_curve:
             socket = self.ctx.socket(stype)
@@ -243,30 +313,67 @@ class StupidNode:
             )
 
         socket.linger = 1
-        socket.identity = self.identity.encode()
         socket.reconnect_ivl = 1000
         socket.reconnect_ivl_max = 10000
 
         if enable_curve:
-            socket.curve_secretkey = self.privkey
-            socket.curve_publickey = self.pubkey
-
-        return socket
+            # not on the REQs: a REP turns away a second connection with the
+            # same identity while it still has a request from the first
+            socket.identity = self.identity.encode()
+            if curve_keys:
+                socket.curve_secretkey = self.privkey
+                socket.curve_publickey = self.pubkey
+                # the Runtime checks whoever connects against our keyring
+                # only (not on the others: with a domain, NULL asks ZAP too)
+                socket.zap_domain = self.zap_domain.encode()
+
+        return self.sockopts.apply(socket)
 
     def local_workflow(self, msg):
-        self.log.debug("start local_workflow %s", repr(msg))
+        self.log.debug("start local_workflow %r", msg)
         msg = self.local_react(msg)
         if msg:
             msg = self.all_react(msg)
         return msg
 
-    def sub_workflow(self, socket):
-        idx = self.sub.index(socket)
+    def _rebuild_dispatch(self):
+        # connect_to_endpoint() adds entries as it goes; anything that shifts
+        # the indexes (eg disconnect_from_endpoint()) rebuilds the whole thing
+        self.dispatch.clear()
+        self.dispatch[self.pub] = Dispatch(
+            "pub", None, self.endpoint, self.pub_workflow
+        )
+        self.dispatch[self.router] = Dispatch(
+            "router", None, self.endpoint, self.router_workflow
+        )
+        if self.wai_service is None:
+            self.dispatch[self.rep] = Dispatch(
+                "rep", None, self.endpoint, self.who_are_you_reply
+            )
+        for idx, endpoint in enumerate(self.endpoints):
+            self._add_dispatch(idx, endpoint)
+        for req, (endpoint, _) in self.wai.items():
+            self.dispatch[req] = self.wai_dispatch(req, endpoint)
+
+    def wai_dispatch(self, req, endpoint):
+        """the poll() dispatch entry for the who-are-you request req"""
+        return Dispatch("wai", None, endpoint, partial(self.wai_workflow, req))
+
+    def _add_dispatch(self, idx, endpoint):
+        sub, deal = self.sub[idx], self.dealer[idx]
+        self.dispatch[sub] = Dispatch(
+            "sub", idx, endpoint, partial(self.sub_workflow, sub, idx)
+        )
+        self.dispatch[deal] = Dispatch(
+            "dealer", idx, endpoint, partial(self.dealer_workflow, deal, idx)
+        )
+
+    def sub_workflow(self, socket, idx=None):
+        if idx is None:
+            idx = self.dispatch[socket].idx
         enp = self.endpoints[idx]
         msg = self.sub_receive(socket, idx)
-        self.log.debug(
-            "start sub_workflow (idx=%d -> endpoint=%s) %s", idx, enp, repr(msg)
-        )
+        self.log.debug("start sub_workflow (idx=%d -> endpoint=%s) %r", idx, enp, msg)
         for react in (self.sub_react, self.nonlocal_react, self.all_react):
             if msg:
                 msg = react(msg, idx=idx)
@@ -275,7 +382,7 @@ class StupidNode:
 
     def router_workflow(self):
         msg = self.router_receive()
-        self.log.debug("start router_workflow %s", repr(msg))
+        self.log.debug("start router_workflow %r", msg)
         for react in (self.router_react, self.nonlocal_react, self.all_react):
             if not msg:
                 break
@@ -283,13 +390,12 @@ class StupidNode:
         self.log.debug("end router_workflow")
         return msg
 
-    def dealer_workflow(self, socket):
-        idx = self.dealer.index(socket)
+    def dealer_workflow(self, socket, idx=None):
+        if idx is None:
+            idx = self.dispatch[socket].idx
         enp = self.endpoints[idx]
         msg = self.dealer_receive(socket, idx)
-        self.log.debug(
-            "start deal_workflow (idx=%d -> endpoint=%s) %s", idx, enp, repr(msg)
-        )
+        self.log.debug("start deal_workflow (idx=%d -> endpoint=%s) %r", idx, enp, msg)
         for react in (self.dealer_react, self.nonlocal_react, self.all_react):
             if not msg:
                 break
@@ -297,29 +403,46 @@ class StupidNode:
         self.log.debug("end deal_workflow")
         return msg
 
+    def accept_tag(self, tag):  # pylint: disable=unused-argument
+        """called with the tag of each zero_copy message before its payload is
+        decoded; return False to drop the message right there"""
+        return True
+
+    def decode_message(self, parts, routed=False):
+        """parts as a RoutedMessage (when routed is true and they look routed)
+        or a TaggedMessage. Frames we can't decode are logged and dropped
+        (we return None) rather than raised out of poll()"""
+        try:
+            if routed:
+                rm = RoutedMessage.decode(parts, keep_frames=self.zero_copy)
+                if rm:
+                    return rm
+            if self.zero_copy:
+                return TaggedMessage.from_frames(parts, accept=self.accept_tag)
+            return TaggedMessage(*parts)
+        except ValueError as e:
+            self.log.warning("dropping malformed %d-part message: %s", len(parts), e)
+        return None
+
     def sub_receive(self, socket, idx):  # pylint: disable=unused-argument
-        return TaggedMessage(*socket.recv_multipart())
+        return self.decode_message(socket.recv_multipart(copy=not self.zero_copy))
 
     def dealer_receive(self, socket, idx):  # pylint: disable=unused-argument
-        msg = socket.recv_multipart()
-        rm = RoutedMessage.decode(msg)
-        if rm:
-            return rm
+        msg = self.decode_message(
+            socket.recv_multipart(copy=not self.zero_copy), routed=True
+        )
         # dealer's always receive a routed message if it doesn't appear to be
-        # routed, then it's simply intended for us. In that case, build a
-        # tagged message and mark it as non-publish
-        msg = TaggedMessage(*msg)
-        msg.publish_mark = False
+        # routed, then it's simply intended for us. In that case, mark the
+        # tagged message as non-publish
+        if msg and not isinstance(msg, RoutedMessage):
+            msg.publish_mark = False
         return msg
 
     def router_receive(self):
         # we ignore the source ID (in '_') and just believe the msg.tag.name ... it's
         # roughly the same thing anyway
-        _, *msg = self.router.recv_multipart()
-        rm = RoutedMessage.decode(msg)
-        if rm:
-            return rm
-        return TaggedMessage(*msg)
+        _, *msg = self.router.recv_multipart(copy=not self.zero_copy)
+        return self.decode_message(msg, routed=True)
 
     def all_react(self, msg, idx=None):  # pylint: disable=unused-argument
         return msg
@@ -347,37 +470,58 @@ class StupidNode:
     def poll(self, timeo=500, other_cb=None):
         """Check to see if there's any incoming messages. If anything seems ready to receive,
         invoke the related workflow or invoke other_cb (if given) on the socket item.
+
+        Each ready socket is drained of up to max_batch queued messages before
+        we move on to the next one, so a burst costs one poll() rather than
+        one per message, but one busy peer can't starve the others.
+
+        We never wait past the next timer (see run_timers()), which runs
+        before we return.
         """
-        items = dict(self.poller.poll(timeo))
         ret = list()
-        for item in items:
-            if items[item] != zmq.POLLIN:
+        ttime = self.timer_timeout()
+        if ttime is not None:
+            ttime = int(ttime * 1000)
+            timeo = ttime if timeo is None or timeo < 0 else min(timeo, ttime)
+        for item, events in self.poller.poll(timeo):
+            if events & zmq.POLLOUT and item in self.outbound:
+                self.flush_outbound(item)
+            if not events & zmq.POLLIN:
                 continue
-            if item in self.sub:
-                res = self.sub_workflow(item)
-            elif item in self.dealer:
-                res = self.dealer_workflow(item)
-            elif item is self.router:
-                res = self.router_workflow()
+            dispatch = self.dispatch.get(item)
+            if dispatch is not None:
+                handler = dispatch.handler
             elif callable(other_cb):
-                res = other_cb(item)
+                handler = partial(other_cb, item)
             else:
-                res = None
-                if False and isinstance(item, zmq.Socket):
-                    self.log.error(
-                        "no workflow defined for socket of type %s -- received: %s",
-                        zmq_socket_type_name(item),
-                        item.recv_multipart(),
-                    )
-                else:
-                    self.log.error(
-                        "no workflow defined for socket of type %s -- regarding as fatal",
-                        zmq_socket_type_name(item),
-                    )
-                    # note: this normally doesn't trigger an exit... thanks threading
-                    raise Exception("unhandled poll item")
-            if isinstance(res, TaggedMessage):
-                ret.append(res)
+                self.log.error(
+                    "no workflow defined for socket of type %s -- regarding as fatal",
+                    zmq_socket_type_name(item),
+                )
+                # note: this normally doesn't trigger an exit... thanks threading
+                raise Exception("unhandled poll item")
+            ret.extend(self._drain(item, handler))
+        self.run_timers()
+        return ret
+
+    def _drain(self, item, handler):
+        ret = list()
+        batch = self.max_batch if isinstance(item, zmq.Socket) else 1
+        for i in range(batch):
+            # zmq.EVENTS tells us whether another recv would hit EAGAIN
+            # without actually trying one (wai_workflow() closes its socket)
+            if i and (item.closed or not item.getsockopt(zmq.EVENTS) & zmq.POLLIN):
+                break
+            res = handler()
+            # relays see (and pass on) channels their subscribers want, but
+            # only the ones we asked for come out of poll()
+            if isinstance(res, TaggedMessage) and self.wants(res.channel):
+                try:
+                    # zero_copy messages are still undecoded; what we
+                    # hand out should read as text like any other
+                    ret.append(res.decode_payload())
+                except ValueError as e:
+                    self.log.warning("dropping message %s: %s", res.tag, e)
         return ret
 
     def interrupt(self, signo, eframe):  # pylint: disable=unused-argument
@@ -386,37 +530,36 @@ class StupidNode:
         sys.exit(0)
 
     def closekill(self):
-        if hasattr(self, "auth") and self.auth is not None:
-            if self.auth.is_alive():
-                self.log.debug("trying to stop auth thread")
-                self.auth.stop()
-                self.log.debug("auth thread seems to have stopped")
-            del self.auth
-
-        if hasattr(self, "_who_are_you_thread"):
-            if self._who_are_you_thread.is_alive():
-                self.log.debug("WAI Thread seems to be alive, trying to join")
-                self._who_are_you_continue = False
-                self._who_are_you_thread.join()
-                self.log.debug("WAI Thread seems to jave joined us.")
-            del self._who_are_you_thread
-
-        if hasattr(self, "cleartext_ctx"):
-            self.log.debug("destroying cleartext context")
-            self.cleartext_ctx.destroy(1)
-            del self.cleartext_ctx
-
-        if hasattr(self, "ctx"):
-            self.log.debug("destroying crypto context")
-            self.ctx.destroy(1)
-            del self.ctx
+        runtime = getattr(self, "runtime", None)
+        if runtime is None:
+            return  # closed already (or never got that far)
+        self.stop_who_are_you()
+        bound = [getattr(self, name, None) for name in ("pub", "router", "rep")]
+        for sock in (
+            *bound,
+            *getattr(self, "sub", ()),
+            *getattr(self, "dealer", ()),
+            *getattr(self, "wai", ()),
+        ):
+            if sock is None or sock.closed:
+                continue
+            if sock in bound and self.endpoint.proto == "ipc":
+                # libzmq leaves the files of bound ipc sockets behind
+                try:
+                    os.unlink(sock.last_endpoint.decode()[len("ipc://") :])
+                except OSError:
+                    pass
+            sock.close()
+        del self.runtime
+        runtime.detach(self)
 
     def __del__(self):
-        self.log.debug("%s is being deleted", self)
+        if hasattr(self, "log"):  # not if __init__ refused its arguments
+            self.log.debug("%s is being deleted", self)
         self.closekill()
 
     def bind(self, socket, enable_curve=True):
-        if enable_curve:
+        if enable_curve and self.endpoint.curve:
             socket.curve_server = True  # must come before bind
         try:
             f = self.endpoint.format(socket.type)
@@ -424,86 +567,35 @@ class StupidNode:
         except zmq.ZMQError as e:
             raise zmq.ZMQError(f"unable to bind {f}: {e}") from e
 
-    def who_are_you_request(self, endpoint):
-        req = self.mk_socket(zmq.REQ, enable_curve=False)
-        req.connect(endpoint.format(zmq.REQ))
-        msg = b"Who are you?"
-        self.log.debug("sending cleartext request: %s", msg)
-        req.send(msg)
-        self.log.debug("waiting for reply")
-        res = req.recv_multipart()
-        self.log.debug("received reply: %s", res)
-        if len(res) == 2:
-            return res
-        req.close()
-        return None, None
-
-    def pubkey_pathname(self, node_id):
-        if isinstance(node_id, Endpoint):
-            node_id = Endpoint.host
-        fname = scrub_identity_name_for_certfile(node_id) + ".key"
-        pname = os.path.join(self.keyring, fname)
-        return pname
-
-    def learn_or_load_endpoint_pubkey(self, endpoint):
-        epubk_pname = self.pubkey_pathname(endpoint)
-        if not os.path.isfile(epubk_pname):
-            self.log.debug(
-                "%s does not exist yet, trying to learn certificate", epubk_pname
-            )
-            node_id, public_key = self.who_are_you_request(endpoint)
-            if node_id:
-                endpoint.identity = node_id.decode()
-                epubk_pname = self.pubkey_pathname(node_id)
-                if not os.path.isfile(epubk_pname):
-                    with open(epubk_pname, "wb") as fh:
-                        fh.write(b"# generated via rep/req pubkey transfer\n\n")
-                        fh.write(b"metadata\n")
-                        # NOTE: in zmq/auth/certs.py's _write_key_file,
-                        # metadata should be key-value pairs; roughly like the
-                        # following (although with their particular py2/py3
-                        # nerosis edited out):
-                        #
-                        # f.write('metadata\n')
-                        #     for k,v in metadata.items():
-                        #         f.write(f"    {k} = {v}\n")
-                        fh.write(b"curve\n")
-                        fh.write(b'    public-key = "')
-                        fh.write(public_key)
-                        fh.write(b'"')
-        self.log.debug("loading certificate %s", epubk_pname)
-        ret, _ = zmq.auth.load_certificate(epubk_pname)
-        return ret
-
-    def connect_to_endpoints(self, *endpoints):
-        self.log.debug("connecting remote endpoints")
-        for item in endpoints:
-            self.connect_to_endpoint(item)
-        self.log.debug("remote endpoints connected")
-        return self
-
     def _create_connected_socket(self, endpoint, stype, pubkey, preconnect=None):
         self.log.debug(
             "creating %s socket to endpoint=%s", zmq_socket_type_name(stype), endpoint
         )
-        s = self.mk_socket(stype)
-        s.curve_serverkey = pubkey
+        s = self.mk_socket(stype, curve_keys=endpoint.curve)
+        if endpoint.curve:
+            s.curve_serverkey = pubkey
         if callable(preconnect):
             preconnect(s)
         s.connect(endpoint.format(stype))
         return s
 
-    def connect_to_endpoint(self, endpoint):
+    def _as_endpoint(self, endpoint):
         if isinstance(endpoint, StupidNode):
-            endpoint = endpoint.endpoint
+            return endpoint.endpoint
+        if not isinstance(endpoint, Endpoint):
+            return Endpoint(endpoint)
+        return endpoint
 
-        elif not isinstance(endpoint, Endpoint):
-            endpoint = Endpoint(endpoint)
+    def connect_to_endpoint(self, endpoint):
+        endpoint = self._as_endpoint(endpoint)
 
         self.log.debug("learning or loading endpoint=%s pubkey", endpoint)
         epk = self.learn_or_load_endpoint_pubkey(endpoint)
 
-        sos = lambda s: s.setsockopt_string(zmq.SUBSCRIBE, self.channel)
+        def sos(s):
+            for prefix in self._sub_filters:
+                s.setsockopt(zmq.SUBSCRIBE, prefix)
+
         sub = self._create_connected_socket(endpoint, zmq.SUB, epk, sos)
         self.poller.register(sub, zmq.POLLIN)
         self.sub.append(sub)
@@ -511,94 +603,38 @@ class StupidNode:
         deal = self._create_connected_socket(endpoint, zmq.DEALER, epk)
         self.poller.register(deal, zmq.POLLIN)
         self.dealer.append(deal)
+        self.outbound[deal] = Outbound(
+            deal, *self.outbound_opts, on_evict=self.outbound_evicted
+        )
 
         self.endpoints.append(endpoint)
+        self._add_dispatch(len(self.endpoints) - 1, endpoint)
 
         return self
 
+    def disconnect_from_endpoint(self, endpoint):
+        """close the SUB and DEALER sockets for endpoint (an Endpoint, an
+        identity, a StupidNode or an index into self.endpoints)"""
+        idx = self._endpoint_index(endpoint)
+        endpoint = self.endpoints.pop(idx)
+        self.log.debug("disconnecting endpoint=%s", endpoint)
+        self.routes.forget_via(self.dealer[idx])
+        self.outbound.pop(self.dealer[idx])
+        for sock in (self.sub.pop(idx), self.dealer.pop(idx)):
+            self.poller.unregister(sock)
+            sock.close()
+        self._rebuild_dispatch()
+        return endpoint
+
+    def _endpoint_index(self, endpoint):
+        if isinstance(endpoint, StupidNode):
+            endpoint = endpoint.endpoint
+        if isinstance(endpoint, int):
+            return endpoint
+        for idx, item in enumerate(self.endpoints):
+            if item is endpoint or item.identity == endpoint:
+                return idx
+        raise ValueError(f"not connected to {endpoint}")
+
     def __repr__(self):
         return f"{self.__class__.__name__}({self.identity})"
-
-
-class RelayNode(StupidNode):
-    def __init__(self, *a, dup_time=10, **kw):
-        super().__init__(*a, **kw)
-        self.recent = set()
-        self.dup_time = dup_time
-
-    def cleanup_recent(self):
-        old = time.time() - self.dup_time
-        self.recent = set(x for x in self.recent if x.time > old)
-
-    def is_repeat(self, tag, update_recent=False):
-        if not isinstance(tag, Tag):
-            tag = Tag(tag)
-        self.cleanup_recent()
-        if tag in self.recent:
-            self.log.debug("%r may be a repeat, not (re)broadcasting", tag)
-            return True
-        if update_recent:
-            self.recent.add(tag)
-        return False
-
-    def local_react(self, msg):
-        msg = super().local_react(msg)
-        self.recent.add(msg.tag)
-        return msg
-
-    def handle_broadcast(self, msg, idx=None):
-        if len(msg) == 3 and msg[1] == "where is" and msg[2] == self.identity:
-            self.deal_message((BROADCAST_PREFIX, "I am here"))
-        elif len(msg) == 2 and msg[1] == "I am here":
-            self.deal_message((BROADCAST_PREFIX, "I route", msg.name))
-            self.routes[msg.name] = tuple()
-            self.route_update()
-        elif len(msg) >= 3 and msg[1] == "I route":
-            route_portion = tuple(msg[2:])
-            if self.identity in route_portion or msg.name in route_portion:
-                self.log.info("this route came back around apparently: %s", msg)
-                return False
-            route = (msg.name,) + route_portion
-            self.deal_message((BROADCAST_PREFIX, "I route") + route)
-            for i, item in enumerate(route):
-                self.routes[item] = route[:i]
-            self.route_update()
-        else:
-            self.publish_message(msg, no_deal_to=idx)
-        return False
-
-    def nonlocal_react(self, msg, idx=None):
-        msg = super().nonlocal_react(msg, idx=idx)
-        if msg:
-            if self.is_repeat(msg.tag, update_recent=True):
-                return False
-            if msg[0] == BROADCAST_PREFIX and len(msg) > 1:
-                return self.handle_broadcast(msg, idx=idx)
-            if msg.publish_mark:
-                self.publish_message(msg, no_deal_to=idx)
-        return msg
-
-    def routed_react(self, msg, idx=None):
-        self.log.info(
-            "received routed message %s intended for %s", repr(msg), msg.to[-1]
-        )
-        self.route_message(msg.to[-1], msg)
-        return False
-
-    def route_failed(self, msg):
-        super().route_failed(msg)
-        self.publish_message((BROADCAST_PREFIX, "where is", msg.to[-1]))
-
-    def route_update(self):
-        self.log.debug("routes updated to %s", self.routes)
-        todo = list()
-        for msg in self.route_queue:
-            self.log.debug(
-                "is msg.to=%s in self.routes=%s now?", msg.to, list(self.routes)
-            )
-            if msg.to[-1] in self.routes:
-                todo.append(msg)
-        for msg in todo:
-            self.route_queue.remove(msg)
-            self.log.debug("retrying failed route message")
-            self.route_message(msg.to, msg)
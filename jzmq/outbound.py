@@ -0,0 +1,147 @@
+# coding: utf-8
+
+import time
+from collections import deque, namedtuple
+
+import zmq
+
+DEFAULT_OUTBOUND_MAX = 1000  # messages queued per peer past the socket's HWM
+DEFAULT_OUTBOUND_POLICY = "drop-oldest"
+DEFAULT_OUTBOUND_TIMEOUT = 0.5  # seconds the "block" policy waits for room
+
+
+def drop_oldest(out, parts):
+    evicted = out.queue.popleft()
+    out.dropped += 1
+    out.queue.append(parts)
+    if out.on_evict is not None:
+        out.on_evict(evicted)
+    return True
+
+
+def drop_newest(out, parts):  # pylint: disable=unused-argument
+    out.dropped += 1
+    return False
+
+
+def block(out, parts):
+    """wait up to out.timeout for the peer to make room, then drop parts"""
+    deadline = time.monotonic() + out.timeout
+    while len(out.queue) >= out.max_messages:
+        left = deadline - time.monotonic()
+        if left <= 0 or not out.sock.poll(int(left * 1000), zmq.POLLOUT):
+            return drop_newest(out, parts)
+        out.flush()
+    out.queue.append(parts)
+    return True
+
+
+def disconnect(out, parts):
+    """give up on the peer: the node disconnects it at its next poll()"""
+    out.slow = True
+    return drop_newest(out, parts)
+
+
+OVERFLOW_POLICIES = {
+    "drop-oldest": drop_oldest,
+    "drop-newest": drop_newest,
+    "block": block,
+    "disconnect": disconnect,
+}
+
+
+class OutboundOptions(
+    namedtuple(
+        "OutboundOptions",
+        ("max_messages", "policy", "timeout"),
+        defaults=(
+            DEFAULT_OUTBOUND_MAX,
+            DEFAULT_OUTBOUND_POLICY,
+            DEFAULT_OUTBOUND_TIMEOUT,
+        ),
+    )
+):
+    """how each DEALER's Outbound queue behaves (StupidNode(outbound_opts=...)):
+    what the peer's HWM won't take waits there, up to max_messages messages,
+    then policy decides (timeout is how long the "block" policy waits)"""
+
+
+class Outbound:
+    """bounded queue of encoded messages waiting for one DEALER's peer
+
+    send() never blocks on the socket: what the HWM won't take right away
+    is queued (in order) until the poller says the socket is writable again
+    and the node calls flush(). When the queue is full too, policy decides:
+    a name from OVERFLOW_POLICIES or any policy(outbound, parts) callable
+    that returns True if it queued parts. Policies that push queued messages
+    out to make room (drop-oldest) hand them to on_evict(parts), if given,
+    since send() already told whoever sent them that they went out.
+    """
+
+    def __init__(
+        self,
+        sock,
+        max_messages=DEFAULT_OUTBOUND_MAX,
+        policy=DEFAULT_OUTBOUND_POLICY,
+        timeout=DEFAULT_OUTBOUND_TIMEOUT,
+        on_evict=None,
+    ):
+        if isinstance(policy, str):
+            try:
+                policy = OVERFLOW_POLICIES[policy]
+            except KeyError as e:
+                raise ValueError(
+                    f"unknown overflow policy {policy!r}, "
+                    f"try one of {tuple(OVERFLOW_POLICIES)}"
+                ) from e
+        self.sock = sock
+        self.max_messages = max(1, max_messages)
+        self.policy = policy
+        self.timeout = timeout
+        self.on_evict = on_evict
+        self.queue = deque()
+        self.slow = False
+        self.sent = self.queued = self.dropped = 0
+
+    def _try(self, parts):
+        try:
+            self.sock.send_multipart(parts, flags=zmq.NOBLOCK)
+        except zmq.Again:
+            return False
+        self.sent += 1
+        return True
+
+    def send(self, parts):
+        """send parts now or queue them; False if they were dropped"""
+        if not self.queue and self._try(parts):
+            return True
+        if len(self.queue) >= self.max_messages:
+            self.flush()
+        if len(self.queue) < self.max_messages:
+            self.queue.append(parts)
+        elif not self.policy(self, parts):
+            return False
+        self.queued += 1
+        return True
+
+    def flush(self):
+        """send as much of the queue as the socket takes; True once it's
+        empty"""
+        while self.queue and self._try(self.queue[0]):
+            self.queue.popleft()
+        return not self.queue
+
+    def __len__(self):
+        return len(self.queue)
+
+    def stats(self):
+        return dict(
+            depth=len(self.queue),
+            sent=self.sent,
+            queued=self.queued,
+            dropped=self.dropped,
+            slow=self.slow,
+        )
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}{self.stats()}"
@@ -0,0 +1,189 @@
+# coding: utf-8
+
+import zmq
+
+from .msg import Tag
+from .dedup import make_dedup, DEFAULT_DEDUP
+from .route import DistanceVector, DEFAULT_DV_INTERVAL
+from .node import StupidNode, BROADCAST_PREFIX
+
+# interest adverts: (BROADCAST_PREFIX, WANTS, *channels), see send_interest()
+WANTS = "wants"
+WANTS_EVERYTHING = "wants everything"
+
+
+class RelayNode(StupidNode):
+    def __init__(
+        self,
+        *a,
+        dup_time=10,
+        dedup=DEFAULT_DEDUP,
+        zero_copy=False,
+        dv_interval=DEFAULT_DV_INTERVAL,
+        **kw,
+    ):
+        """dedup picks the RelayNode.recent backend: a name from
+        jzmq.dedup.DEDUP_BACKENDS, a DedupCache class or a DedupCache.
+        dv_interval is how often we re-send our whole route table to our
+        neighbors (changes go out as soon as we poll())"""
+        super().__init__(*a, **kw)
+        self.dup_time = dup_time
+        self.recent = make_dedup(dedup, window=dup_time)
+        self.zero_copy = zero_copy
+        self.dv = DistanceVector(self.routes, self.identity, interval=dv_interval)
+
+    def cleanup_recent(self):
+        self.recent.expire()
+
+    def is_repeat(self, tag, update_recent=False):
+        if not isinstance(tag, Tag):
+            tag = Tag(tag)
+        if self.recent.seen(tag, update=update_recent):
+            self.log.debug("%r may be a repeat, not (re)broadcasting", tag)
+            return True
+        return False
+
+    def accept_tag(self, tag):
+        # zero_copy relays drop repeats before decoding the payload; everyone
+        # else still finds them in nonlocal_react() below
+        return not self.is_repeat(tag)
+
+    def local_react(self, msg):
+        msg = super().local_react(msg)
+        self.recent.add(msg.tag)
+        return msg
+
+    def handle_broadcast(self, msg, idx=None):
+        # idx is the endpoint msg came from (over its PUB or ROUTER), so we
+        # reach things it knows about through our DEALER to it; otherwise msg
+        # came in on our ROUTER from downstream
+        via = None if idx is None else self.dealer[idx]
+        # route adverts are only for the neighbors, so they stop here; what
+        # changed for us goes out in our own advert at the end of poll()
+        if len(msg) == 3 and msg[1] == "where is" and msg[2] == self.identity:
+            self.dv.full()
+            self.wake_timers()
+        elif len(msg) >= 2 and msg[1] in (WANTS, WANTS_EVERYTHING):
+            wants = None if msg[1] == WANTS_EVERYTHING else msg[2:]
+            self.heard_interest(msg.name if via is None else via, msg.name, wants)
+            self.wake_timers()
+        elif len(msg) >= 2 and msg[1] == "dv":
+            try:
+                entries = self.dv.decode(msg[2:])
+            except ValueError as e:
+                self.log.error("ignoring route advert %r: %s", msg, e)
+                return False
+            self.route_update(*self.dv.receive(msg.name, entries, via=via))
+            self.wake_timers()
+        else:
+            self.publish_message(msg, no_deal_to=idx)
+        return False
+
+    def nonlocal_react(self, msg, idx=None):
+        msg = super().nonlocal_react(msg, idx=idx)
+        if msg:
+            if self.is_repeat(msg.tag, update_recent=True):
+                return False
+            # part_is() leaves a zero_copy payload undecoded, so relaying
+            # costs the same whatever the payload's size
+            if msg.part_is(0, BROADCAST_PREFIX) and len(msg) > 1:
+                return self.handle_broadcast(msg, idx=idx)
+            if msg.publish_mark:
+                self.publish_message(msg, no_deal_to=idx)
+        return msg
+
+    def routed_react(self, msg, idx=None):
+        if msg.to[-1] == self.identity:
+            # the last hop was one of our DEALERs' peers, sending up to us
+            msg.publish_mark = False
+            return msg
+        self.log.info("received routed message %r intended for %s", msg, msg.to[-1])
+        self.route_message(msg.to[-1], msg)
+        return False
+
+    def sub_filters(self):
+        # we have to hear whatever our subscribers want to hear from us. In a
+        # cycle that interest can keep itself alive after the subscriber is
+        # gone, which costs some bandwidth but never delivers anything extra
+        return super().sub_filters() | self.downstream
+
+    def interest_changed(self):
+        self._resubscribe()
+
+    def run_timers(self):
+        super().run_timers()
+        self.send_routes()
+        self.send_interest()
+
+    def timer_timeout(self):
+        ret = self.dv.timeout()
+        retry = super().timer_timeout()
+        return ret if retry is None else min(ret, retry)
+
+    def send_interest(self):
+        """tell each neighbor which named channels to send us (see
+        wants_for()), when that changed. The ones we connected to hear it
+        over our DEALER to them, the ones that connected to us (once they've
+        told us who they are) over our ROUTER"""
+        if not self.interest_pending():
+            return
+        self._interest_stale = False
+        routed = [x for x in self.interest if isinstance(x, str)]
+        for neighbor in self.dealer + routed:
+            wants = self.wants_for(neighbor)
+            if neighbor in self.advertised and self.advertised[neighbor] == wants:
+                continue
+            self.advertised[neighbor] = wants
+            if wants is None:
+                msg = (BROADCAST_PREFIX, WANTS_EVERYTHING)
+            else:
+                msg = (BROADCAST_PREFIX, WANTS) + tuple(sorted(wants))
+            _, emsg = self.preprocess_message(msg)
+            if not isinstance(neighbor, str):
+                self._send(neighbor, emsg)
+                continue
+            try:
+                self.router.send_multipart((neighbor.encode(),) + emsg, zmq.NOBLOCK)
+            except zmq.Again:
+                # at the HWM: we'll ask again next time
+                del self.advertised[neighbor]
+                self._interest_stale = True
+            except zmq.error.ZMQError as zmq_e:
+                self.log.debug("%s is gone: %s", neighbor, zmq_e)
+                self.forget_interest(neighbor)
+
+    def send_routes(self):
+        """advertise whatever changed in our routes (or all of them, when
+        it's time) to our neighbors, over the PUB and the DEALERs both, so
+        nodes that only connect out still find out how to send upstream"""
+        entries = self.dv.advert()
+        if entries:
+            self.publish_message((BROADCAST_PREFIX, "dv") + self.dv.encode(entries))
+
+    def connect_to_endpoint(self, endpoint):
+        ret = super().connect_to_endpoint(endpoint)
+        self.wake_timers()  # so we tell the new neighbor what we want
+        return ret
+
+    def disconnect_from_endpoint(self, endpoint):
+        self.forget_interest(self.dealer[self._endpoint_index(endpoint)])
+        ret = super().disconnect_from_endpoint(endpoint)
+        self.wake_timers()
+        return ret
+
+    def route_failed(self, msg):
+        super().route_failed(msg)
+        dest = msg.to[-1]
+        if self.retry.discover(dest):
+            self.publish_message((BROADCAST_PREFIX, "where is", dest))
+
+    def route_update(self, *dests):
+        """retry the queued messages for dests (routes we just learned)"""
+        self.log.debug("routes updated to %s", self.routes)
+        for dest in dests:
+            if dest not in self.route_queue or dest not in self.routes:
+                continue
+            self.retry.reset(dest)
+            for msg in self.route_queue.pop(dest):
+                self.log.debug("retrying failed route message %r", msg)
+                self.route_message(dest, msg)
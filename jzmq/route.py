@@ -0,0 +1,751 @@
+# coding: utf-8
+
+import os
+import time
+import heapq
+import random
+import struct
+from collections import deque, namedtuple
+
+import zmq
+
+from .msg import RoutedMessage, WIRE_BINARY
+from .util import scrub_identity_name_for_certfile
+
+DEFAULT_ROUTE_TTL = 600  # seconds a learned route is trusted without news
+DEFAULT_ROUTE_FAILURES = 3  # unreachable next hops before we drop a route
+DEFAULT_ROUTE_CANDIDATES = 4  # paths kept per destination
+DEFAULT_ROUTE_QUEUE_LEN = 100  # undeliverable messages kept per destination
+DEFAULT_ROUTE_QUEUE_BYTES = 1 << 20  # ... and their total size
+DEFAULT_ROUTE_MSG_TTL = 300  # seconds we keep trying to deliver a message
+DEFAULT_RETRY_BASE = 0.25  # seconds before the first retry to a destination
+DEFAULT_RETRY_CAP = 30  # the longest we'll back off between retries
+DEFAULT_DV_INTERVAL = 30  # seconds between full route advertisements
+DV_INFINITY = 16  # advertised hops that mean "can't get there from here"
+
+# spool files start with the (unscrubbed) destination name, length-prefixed;
+# then records: expiry time and frame count, then length-prefixed frames
+SPOOL_NAME = struct.Struct("!H")
+SPOOL_HEADER = struct.Struct("!dI")
+SPOOL_FRAME = struct.Struct("!I")
+
+_ANY = object()  # RouteTable.forget(via=) default: any via will do
+
+
+class RouteOptions(
+    namedtuple("RouteOptions", ("ttl", "queue"), defaults=(DEFAULT_ROUTE_TTL, None))
+):
+    """how a node routes (StupidNode(route_opts=...)): ttl is how long a
+    learned route is trusted (see RouteTable) and queue is the RouteQueue
+    that holds undeliverable messages (give it a spill directory to ride out
+    long partitions); None makes a default one"""
+
+
+class Route:
+    """one way to reach a destination
+
+    path is the list of nodes between us and the destination (empty when it's
+    directly connected), so the next hop is path[0] or the destination itself.
+    hops defaults to the length of the whole path, but a distance-vector
+    route only knows its next hop and how far the neighbor says it is.
+    via is the DEALER socket that reaches the next hop when it's upstream of
+    us, or None when it's connected to our ROUTER.
+    """
+
+    __slots__ = ("dest", "path", "hops", "via", "last_seen", "failures")
+
+    def __init__(self, dest, path, last_seen, via=None, hops=None):
+        self.dest = dest
+        self.path = tuple(path)
+        self.hops = len(self.path) + 1 if hops is None else hops
+        self.via = via
+        self.last_seen = last_seen
+        self.failures = 0
+
+    @property
+    def next_hop(self):
+        return self.path[0] if self.path else self.dest
+
+    @property
+    def to(self):
+        """the RoutedMessage.to for this route
+
+        The ROUTER eats the first frame to pick the next hop; a DEALER has
+        only the one peer, so we just name the destination and let the next
+        hop (which may be the destination) take it from there.
+        """
+        if self.path and self.via is None:
+            return (self.path[0], self.dest)
+        return (self.dest,)
+
+    def rank(self):
+        return (self.failures, self.hops, -self.last_seen)
+
+    def __repr__(self):
+        hops = ">".join(self.path + (self.dest,))
+        way = "router" if self.via is None else "dealer"
+        return f"Route({hops} by {way}, failures={self.failures})"
+
+
+class RouteTable:
+    """destination -> ranked candidate Routes
+
+    Candidates are ordered fewest failures first, then fewest hops, then most
+    recently heard about. Re-learning a path refreshes it and forgives its
+    failures; a path that fails max_failures times, or that nobody has
+    mentioned for ttl seconds, is dropped. Lookups expire lazily, the same
+    way the dedup caches do. version changes whenever a route comes or goes
+    or its hops or failures change, so DistanceVector can tell when it has
+    news to share.
+    """
+
+    def __init__(
+        self,
+        ttl=DEFAULT_ROUTE_TTL,
+        max_failures=DEFAULT_ROUTE_FAILURES,
+        max_candidates=DEFAULT_ROUTE_CANDIDATES,
+        clock=time.time,
+    ):
+        self.ttl = ttl
+        self.max_failures = max_failures
+        self.max_candidates = max_candidates
+        self.clock = clock
+        self.version = 0
+        self._routes = dict()
+
+    def learn(self, dest, path=(), via=None, hops=None):
+        """remember (or refresh) path as a way to reach dest; returns the Route"""
+        path = tuple(path)
+        now = self.clock()
+        candidates = self._routes.setdefault(dest, list())
+        for route in candidates:
+            if route.path == path and route.via is via:
+                if route.failures or (hops is not None and hops != route.hops):
+                    self.version += 1
+                route.last_seen = now
+                route.failures = 0
+                if hops is not None:
+                    route.hops = hops
+                break
+        else:
+            route = Route(dest, path, now, via=via, hops=hops)
+            candidates.append(route)
+            self.version += 1
+        candidates.sort(key=Route.rank)
+        del candidates[self.max_candidates :]
+        return route
+
+    def failed(self, route):
+        """count a delivery failure against route, dropping it if it's had
+        enough; returns True if it was dropped"""
+        route.failures += 1
+        self.version += 1
+        if route.failures >= self.max_failures:
+            self._remove(route)
+            return True
+        self._routes.get(route.dest, list()).sort(key=Route.rank)
+        return False
+
+    def _remove(self, route):
+        candidates = self._routes.get(route.dest)
+        if candidates and route in candidates:
+            candidates.remove(route)
+            self.version += 1
+            if not candidates:
+                del self._routes[route.dest]
+
+    def forget(self, dest, path=None, via=_ANY):
+        """drop every route to dest, or just the one using path (and via)"""
+        if path is None:
+            if self._routes.pop(dest, None):
+                self.version += 1
+            return
+        for route in list(self._routes.get(dest, ())):
+            if route.path == tuple(path) and (via is _ANY or route.via is via):
+                self._remove(route)
+
+    def forget_via(self, via):
+        """drop every route that leaves through via (eg, a closed DEALER)"""
+        for dest in list(self._routes):
+            for route in list(self._routes[dest]):
+                if route.via is via:
+                    self._remove(route)
+
+    def _expire(self, dest, old):
+        for route in list(self._routes.get(dest, ())):
+            if route.last_seen <= old:
+                self._remove(route)
+
+    def expire(self, now=None):
+        old = (self.clock() if now is None else now) - self.ttl
+        for dest in list(self._routes):
+            self._expire(dest, old)
+
+    def candidates(self, dest):
+        """the live routes to dest, best first"""
+        # only dest's routes: a lookup shouldn't cost O(table)
+        self._expire(dest, self.clock() - self.ttl)
+        return list(self._routes.get(dest, ()))
+
+    def best(self, dest):
+        candidates = self.candidates(dest)
+        return candidates[0] if candidates else None
+
+    def get(self, dest, default=None):
+        """the best path to dest (like the old routes dict)"""
+        route = self.best(dest)
+        return default if route is None else route.path
+
+    def __contains__(self, dest):
+        return bool(self.candidates(dest))
+
+    def __iter__(self):
+        self.expire()
+        return iter(list(self._routes))
+
+    def __len__(self):
+        self.expire()
+        return len(self._routes)
+
+    def __repr__(self):
+        return f"RouteTable({self._routes})"
+
+
+class _Pending:
+    __slots__ = ("msg", "expires", "nbytes", "frames")
+
+    def __init__(self, msg, expires, nbytes, frames=None):
+        self.msg = msg
+        self.expires = expires
+        self.nbytes = nbytes
+        self.frames = frames  # msg encoded, kept only if we might spool it
+
+
+class RouteQueue:
+    """per-destination store-and-forward queues for routed messages
+
+    Each destination gets its own queue of at most max_messages messages and
+    max_bytes (encoded) bytes, and each message is kept for at most ttl
+    seconds. When a queue is over its limits the oldest messages go to an
+    append-only spool file under spill (if given), otherwise they're dropped.
+    pop(dest) hands back the spooled messages first, then the queued ones,
+    so they come out in the order they went in.
+    """
+
+    SPOOL_SUFFIX = ".spool"
+
+    def __init__(
+        self,
+        max_messages=DEFAULT_ROUTE_QUEUE_LEN,
+        max_bytes=DEFAULT_ROUTE_QUEUE_BYTES,
+        ttl=DEFAULT_ROUTE_MSG_TTL,
+        spill=None,
+        clock=time.time,
+    ):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill = spill
+        self.clock = clock
+        self._queues = dict()
+        self._nbytes = dict()
+        self.queued = self.dropped = self.expired = self.spilled = 0
+        if spill is not None:
+            os.makedirs(spill, mode=0o0700, exist_ok=True)
+
+    @staticmethod
+    def _encode(msg):
+        return [
+            x.bytes if isinstance(x, zmq.Frame) else x
+            for x in msg.encode(wire=WIRE_BINARY)
+        ]
+
+    def put(self, msg):
+        """queue msg for msg.to[-1]; returns the messages dropped to fit it"""
+        self.expire()
+        dest = msg.to[-1]
+        frames = self._encode(msg)
+        nbytes = sum(len(x) for x in frames)
+        queue = self._queues.setdefault(dest, deque())
+        if self.spill is None:
+            frames = None
+        queue.append(_Pending(msg, self.clock() + self.ttl, nbytes, frames))
+        self._nbytes[dest] = self._nbytes.get(dest, 0) + nbytes
+        self.queued += 1
+
+        dropped = list()
+        while len(queue) > 1 and (
+            len(queue) > self.max_messages or self._nbytes[dest] > self.max_bytes
+        ):
+            item = queue.popleft()
+            self._nbytes[dest] -= item.nbytes
+            if self.spill is not None:
+                self._spool(dest, item)
+            else:
+                self.dropped += 1
+                dropped.append(item.msg)
+        return dropped
+
+    def spool_filename(self, dest):
+        fname = scrub_identity_name_for_certfile(dest) + self.SPOOL_SUFFIX
+        return os.path.join(self.spill, fname)
+
+    def _spool(self, dest, item):
+        with open(self.spool_filename(dest), "ab") as fh:
+            if not fh.tell():
+                name = dest.encode()
+                fh.write(SPOOL_NAME.pack(len(name)))
+                fh.write(name)
+            fh.write(SPOOL_HEADER.pack(item.expires, len(item.frames)))
+            for frame in item.frames:
+                fh.write(SPOOL_FRAME.pack(len(frame)))
+                fh.write(frame)
+        self.spilled += 1
+
+    def _unspool(self, dest):
+        if self.spill is None:
+            return list()
+        fname = self.spool_filename(dest)
+        try:
+            with open(fname, "rb") as fh:
+                buf = fh.read()
+        except FileNotFoundError:
+            return list()
+        os.unlink(fname)
+
+        ret = list()
+        now = self.clock()
+        try:
+            (pos,) = SPOOL_NAME.unpack_from(buf)
+        except struct.error:
+            return ret
+        pos += SPOOL_NAME.size
+        while pos + SPOOL_HEADER.size <= len(buf):
+            expires, nframes = SPOOL_HEADER.unpack_from(buf, pos)
+            pos += SPOOL_HEADER.size
+            frames = list()
+            for _ in range(nframes):
+                (flen,) = SPOOL_FRAME.unpack_from(buf, pos)
+                pos += SPOOL_FRAME.size
+                frames.append(buf[pos : pos + flen])
+                pos += flen
+            if expires <= now:
+                self.expired += 1
+                continue
+            msg = RoutedMessage.decode(frames)
+            if msg is not None:
+                ret.append(msg)
+        return ret
+
+    def pop(self, dest):
+        """remove and return everything still waiting for dest, oldest first"""
+        ret = self._unspool(dest)
+        now = self.clock()
+        for item in self._queues.pop(dest, ()):
+            if item.expires <= now:
+                self.expired += 1
+            else:
+                ret.append(item.msg)
+        self._nbytes.pop(dest, None)
+        return ret
+
+    def expire(self, now=None):
+        """drop queued (not spooled) messages past their ttl"""
+        now = self.clock() if now is None else now
+        for dest in list(self._queues):
+            queue = self._queues[dest]
+            while queue and queue[0].expires <= now:
+                self._nbytes[dest] -= queue.popleft().nbytes
+                self.expired += 1
+            if not queue:
+                del self._queues[dest]
+                del self._nbytes[dest]
+
+    @property
+    def dests(self):
+        """destinations with messages waiting (in memory or spooled)"""
+        ret = set(self._queues)
+        if self.spill is not None:
+            # file names are scrubbed; the real name starts the file
+            for fname in os.listdir(self.spill):
+                if not fname.endswith(self.SPOOL_SUFFIX):
+                    continue
+                try:
+                    with open(os.path.join(self.spill, fname), "rb") as fh:
+                        (nlen,) = SPOOL_NAME.unpack(fh.read(SPOOL_NAME.size))
+                        ret.add(str(fh.read(nlen), "utf-8"))
+                except (OSError, struct.error):
+                    continue  # popped meanwhile, or never got a name in
+        return ret
+
+    def __contains__(self, dest):
+        return dest in self._queues or (
+            self.spill is not None and os.path.isfile(self.spool_filename(dest))
+        )
+
+    def __len__(self):
+        """messages waiting in memory"""
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def nbytes(self):
+        return sum(self._nbytes.values())
+
+    def stats(self):
+        return dict(
+            size=len(self),
+            nbytes=self.nbytes,
+            dests=len(self._queues),
+            queued=self.queued,
+            dropped=self.dropped,
+            expired=self.expired,
+            spilled=self.spilled,
+        )
+
+
+class _Retry:
+    __slots__ = ("attempts", "due", "quiet")
+
+    def __init__(self):
+        self.attempts = 0
+        self.due = None  # when we next retry, None if nothing is scheduled
+        self.quiet = None  # no more "where is" broadcasts until then
+
+
+class RetryScheduler:
+    """per-destination exponential backoff for undeliverable routed messages
+
+    failed(dest) schedules a retry for dest (unless one already is) about
+    base * factor**attempts seconds out, capped at cap and shortened by up
+    to jitter of itself so a crowd of nodes doesn't retry in lockstep.
+    due() hands back the destinations whose time has come. discover(dest)
+    says whether we may broadcast another "where is" for dest: at most once
+    per backoff interval, however many messages pile up behind it.
+    """
+
+    def __init__(
+        self,
+        base=DEFAULT_RETRY_BASE,
+        cap=DEFAULT_RETRY_CAP,
+        factor=2,
+        jitter=0.5,
+        clock=time.monotonic,
+        rand=random.random,
+    ):
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.jitter = jitter
+        self.clock = clock
+        self.rand = rand
+        self._state = dict()
+        self._heap = list()
+        self.retries = self.discoveries = self.suppressed = 0
+
+    def interval(self, dest):
+        """the un-jittered backoff interval for dest right now"""
+        state = self._state.get(dest)
+        attempts = 0 if state is None else state.attempts
+        return min(self.cap, self.base * self.factor**attempts)
+
+    def failed(self, dest):
+        """note a failed delivery to dest; returns when we'll retry"""
+        state = self._state.setdefault(dest, _Retry())
+        if state.due is None:
+            delay = self.interval(dest) * (1 - self.jitter * self.rand())
+            state.attempts += 1
+            state.due = self.clock() + delay
+            heapq.heappush(self._heap, (state.due, dest))
+        return state.due
+
+    def discover(self, dest):
+        """True if it's time for another "where is" broadcast about dest"""
+        state = self._state.setdefault(dest, _Retry())
+        now = self.clock()
+        if state.quiet is not None and now < state.quiet:
+            self.suppressed += 1
+            return False
+        # failed() already bumped attempts, so back up one step
+        step = max(0, state.attempts - 1)
+        state.quiet = now + min(self.cap, self.base * self.factor**step)
+        self.discoveries += 1
+        return True
+
+    def reset(self, dest):
+        """dest is reachable again, forget its backoff"""
+        self._state.pop(dest, None)
+
+    def due(self, now=None):
+        """pop the destinations that should be retried now"""
+        now = self.clock() if now is None else now
+        ret = list()
+        while self._heap and self._heap[0][0] <= now:
+            due, dest = heapq.heappop(self._heap)
+            state = self._state.get(dest)
+            # entries for reset (or rescheduled) destinations are just skipped
+            if state is not None and state.due == due:
+                state.due = None
+                ret.append(dest)
+        self.retries += len(ret)
+        return ret
+
+    def timeout(self, now=None):
+        """seconds until the next retry, or None if nothing is scheduled"""
+        now = self.clock() if now is None else now
+        while self._heap:
+            due, dest = self._heap[0]
+            state = self._state.get(dest)
+            if state is not None and state.due == due:
+                return max(0, due - now)
+            heapq.heappop(self._heap)
+        return None
+
+    def __contains__(self, dest):
+        return dest in self._state
+
+    def stats(self):
+        return dict(
+            pending=sum(1 for s in self._state.values() if s.due is not None),
+            retries=self.retries,
+            discoveries=self.discoveries,
+            suppressed=self.suppressed,
+        )
+
+
+class DistanceVector:
+    """what we've told our neighbors about routes, and when to tell them again
+
+    An advert is a list of (dest, hops, next_hop) entries: how far we are
+    from dest (we're 0 from ourselves) and who we'd hand a message for it to.
+    Every interval seconds, or after full(), advert() hands back the whole
+    table; in between it only has the entries whose best route changed since
+    the last one (and withdrawals, hops >= infinity, for destinations we lost),
+    so a burst of changes costs one advert rather than one per change.
+
+    receive() turns a neighbor's advert into routes through that neighbor. We
+    ignore (and forget) anything the neighbor reaches through us -- split
+    horizon, so two nodes don't count each other up to infinity -- and a route
+    only ever names its next hop, so adverts stay the same size however long
+    the paths get.
+    """
+
+    def __init__(
+        self,
+        routes,
+        identity,
+        interval=DEFAULT_DV_INTERVAL,
+        infinity=DV_INFINITY,
+        clock=time.monotonic,
+    ):
+        self.routes = routes
+        self.identity = identity
+        self.interval = interval
+        self.infinity = infinity
+        self.clock = clock
+        self.advertised = dict()  # dest -> (hops, next_hop) as last sent
+        # we start out quiet: nobody needs our routes until somebody asks
+        # "where is" (see full()) or the first interval is up
+        self._version = routes.version
+        self._full = False
+        self._next_full = clock() + interval
+        self.sent = self.entries_sent = self.received = self.entries_received = 0
+        self.triggered = self.full_sent = 0
+
+    def table(self):
+        """dest -> (hops, next_hop) for everything we can reach"""
+        ret = {self.identity: (0, self.identity)}
+        for dest in self.routes:
+            route = self.routes.best(dest)
+            if route is not None:
+                ret[dest] = (min(route.hops, self.infinity), route.next_hop)
+        return ret
+
+    def full(self):
+        """make the next advert a full one (eg, a neighbor just showed up)"""
+        self._full = True
+
+    def pending(self, now=None):
+        now = self.clock() if now is None else now
+        return (
+            self._full or now >= self._next_full or self.routes.version != self._version
+        )
+
+    def timeout(self, now=None):
+        """seconds until advert() has something to say"""
+        now = self.clock() if now is None else now
+        if self._full or self.routes.version != self._version:
+            return 0
+        return max(0, self._next_full - now)
+
+    def advert(self, now=None):
+        """the entries our neighbors should hear about now (often none)"""
+        now = self.clock() if now is None else now
+        if not self.pending(now):
+            return list()
+        full = self._full or now >= self._next_full
+        table = self.table()
+        ret = [
+            (dest, hops, next_hop)
+            for dest, (hops, next_hop) in table.items()
+            if full or self.advertised.get(dest) != (hops, next_hop)
+        ]
+        ret.extend(
+            (dest, self.infinity, self.identity)
+            for dest, (hops, _) in self.advertised.items()
+            if dest not in table and hops < self.infinity
+        )
+        self.advertised = table
+        self._version = self.routes.version
+        if full:
+            self._full = False
+            self._next_full = now + self.interval
+            self.full_sent += 1
+        elif ret:
+            self.triggered += 1
+        if ret:
+            self.sent += 1
+            self.entries_sent += len(ret)
+        return ret
+
+    def receive(self, neighbor, entries, via=None):
+        """learn routes through neighbor from its advert; returns the
+        destinations we can now reach through it"""
+        self.received += 1
+        self.entries_received += len(entries)
+        ret = list()
+        for dest, hops, next_hop in entries:
+            if dest == self.identity:
+                continue
+            path = () if dest == neighbor else (neighbor,)
+            if next_hop == self.identity or hops + 1 >= self.infinity:
+                self.routes.forget(dest, path, via=via)
+            else:
+                self.routes.learn(dest, path, via=via, hops=hops + 1)
+                ret.append(dest)
+        return ret
+
+    @staticmethod
+    def encode(entries):
+        """flatten entries into message parts"""
+        return tuple(
+            part
+            for dest, hops, next_hop in entries
+            for part in (dest, str(hops), next_hop)
+        )
+
+    @staticmethod
+    def decode(parts):
+        """message parts back into entries; raises ValueError if they're bad"""
+        parts = [str(x) for x in parts]
+        if len(parts) % 3:
+            raise ValueError("distance vector entries come in threes")
+        return [
+            (parts[i], int(parts[i + 1]), parts[i + 2]) for i in range(0, len(parts), 3)
+        ]
+
+    def stats(self):
+        return dict(
+            sent=self.sent,
+            entries_sent=self.entries_sent,
+            received=self.received,
+            entries_received=self.entries_received,
+            triggered=self.triggered,
+            full=self.full_sent,
+        )
+
+
+class RoutingMixin:
+    """the routing half of a StupidNode: route_message() tries the known
+    routes to a destination best first, and what none of them takes waits
+    in route_queue until retry says it's time to try again"""
+
+    def __init__(self, route_opts):
+        self.route_queue = (
+            RouteQueue() if route_opts.queue is None else route_opts.queue
+        )
+        self.retry = RetryScheduler()
+        self.routes = RouteTable(ttl=route_opts.ttl)
+        self.evicted = list()  # see outbound_evicted()
+
+    def route_failed(self, msg):
+        if not isinstance(msg, RoutedMessage):
+            raise TypeError("msg must already be a RoutedMessage")
+        # no cap on failures: route_queue's ttl decides when we give up
+        msg.failures += 1
+        self.log.debug("(re)queueing %r for later delivery", msg)
+        for dropped in self.route_queue.put(msg):
+            self.log.error("route_queue full, discarding %r", dropped)
+        self.retry.failed(msg.to[-1])
+        self.wake_timers()
+
+    def outbound_evicted(self, parts):
+        """a DEALER's Outbound pushed parts out of its queue to make room
+        (see jzmq.outbound.drop_oldest). If they were a routed message, its
+        send looked like it worked, so the next retry_routes() hands it to
+        route_failed() (not the send that evicted it: that may be routing)"""
+        msg = RoutedMessage.decode(parts)
+        if msg is not None:
+            self.evicted.append(msg)
+            self.wake_timers()
+
+    def retry_routes(self):
+        """route_failed() the routed messages our outbound queues evicted and
+        route the queued messages whose retry backoff has run out"""
+        evicted, self.evicted = self.evicted, list()
+        for msg in evicted:
+            self.log.warning("outbound queue full, requeueing %r", msg)
+            self.route_failed(msg)
+        for dest in self.retry.due():
+            msgs = self.route_queue.pop(dest)
+            if msgs:
+                self.log.debug("retrying %d message(s) to %s", len(msgs), dest)
+            for msg in msgs:
+                self.route_message(dest, msg)
+
+    def route_message(self, to, msg):
+        to = getattr(to, "identity", to)  # we can route to a node too
+        if isinstance(to, (list, tuple)):
+            to = to[-1]
+        dest = to
+        # best route first; with no routes at all we try dest directly
+        candidates = self.routes.candidates(dest) or [None]
+        if candidates[0] is not None:
+            to = candidates[0].to
+        if isinstance(msg, RoutedMessage):
+            msg.to = to
+        else:
+            # preprocess passes *msg to msg_class() -- ie, RoutedMessage(to, *msg)
+            if isinstance(msg, list):
+                msg = tuple(msg)
+            elif not isinstance(msg, tuple):
+                msg = (msg,)
+            msg = (to,) + msg
+        tmsg, emsg = self.preprocess_message(msg, msg_class=RoutedMessage)
+        unreachable = set()
+        for route in candidates:
+            hop = dest if route is None else route.next_hop
+            if hop not in unreachable:
+                if route is not None and tmsg.to != route.to:
+                    tmsg.to = route.to
+                    emsg = tmsg.encode(wire=self.wire)
+                sock = self.router if route is None or route.via is None else route.via
+                self.log.debug("routing message %r -- encoding: %s", tmsg, emsg)
+                try:
+                    if self._send(sock, emsg):
+                        return
+                    self.log.debug("route to %s failed: outbound queue full", tmsg.to)
+                    unreachable.add(hop)
+                except zmq.Again:
+                    # router_mandatory: the peer's queue is at the HWM
+                    self.log.debug("route to %s failed: HWM reached", tmsg.to)
+                    self.hwm_drops["router"] += 1
+                    unreachable.add(hop)
+                except zmq.error.ZMQError as zmq_e:
+                    self.log.debug("route to %s failed: %s", tmsg.to, zmq_e)
+                    if "Host unreachable" not in str(zmq_e):
+                        raise
+                    unreachable.add(hop)
+            if route is not None:
+                # every route through an unreachable hop counts as failed
+                self.routes.failed(route)
+        self.route_failed(tmsg)
@@ -0,0 +1,144 @@
+# coding: utf-8
+
+import os
+import logging
+from itertools import count
+from threading import Lock
+
+import zmq
+
+from .wai import WhoAreYouService, WAI_SHARED, shared_cleartext_context
+
+DEFAULT_IO_THREADS = 1
+
+log = logging.getLogger(__name__)
+
+
+def process_footprint():
+    """OS threads (zmq's I/O threads included) and open file descriptors in
+    this process; None for what /proc can't tell us"""
+
+    def entries(path):
+        try:
+            return len(os.listdir(path))
+        except OSError:
+            return None
+
+    return dict(threads=entries("/proc/self/task"), fds=entries("/proc/self/fd"))
+
+
+class Runtime:
+    """the zmq contexts, authenticator and who-are-you service any number of
+    nodes can share (StupidNode(runtime=...))
+
+    On its own a node makes a Runtime just for itself, with two contexts (an
+    I/O thread each) and an authenticator; on a shared one it only costs its
+    sockets. The authenticator starts with the first node (it's that node's
+    authenticator class unless we're given one). Each node gets a ZAP domain
+    of its own (attach() returns it, the node sets it on its sockets) and a
+    connection to a node's sockets is let in by that node's keyring alone:
+    sharing a Runtime doesn't share trust. cleartext_ctx is the context for the
+    who-are-you sockets: None makes one, WAI_SHARED uses
+    shared_cleartext_context() and anything else is a zmq.Context we don't
+    own. close() (or leaving a with block) closes whatever nodes are still
+    attached, then the contexts and the who-are-you service if we made it;
+    with autoclose, so does detaching the last node.
+    """
+
+    def __init__(
+        self,
+        io_threads=DEFAULT_IO_THREADS,
+        authenticator=None,
+        wai_service=None,
+        name="jzmq",
+        cleartext_ctx=None,
+        autoclose=False,
+    ):
+        self.name = name
+        self.io_threads = io_threads
+        self.ctx = zmq.Context(io_threads=io_threads)
+        if cleartext_ctx == WAI_SHARED:
+            cleartext_ctx = shared_cleartext_context()
+        self._own_cleartext_ctx = cleartext_ctx is None
+        self.cleartext_ctx = zmq.Context() if cleartext_ctx is None else cleartext_ctx
+        self.authenticator = authenticator
+        self._own_wai_service = wai_service is None
+        if wai_service is None:
+            wai_service = WhoAreYouService(name=f"{name}-wai")
+        self.wai_service = wai_service
+        self.autoclose = autoclose
+        self.auth = None
+        self.nodes = list()
+        self.domains = dict()  # ZAP domain -> node
+        self._domain_ids = count(1)
+        self.baseline = process_footprint()
+        self._lock = Lock()
+
+    def attach(self, node):
+        """start sharing with node; returns the ZAP domain for its sockets"""
+        with self._lock:
+            if self.auth is None:
+                factory = self.authenticator or node.authenticator
+                log.debug("%s starting %s", self, factory.__name__)
+                self.auth = factory(self.ctx)
+                self.auth.start()
+                self.auth.allow("127.0.0.1")
+            domain = f"{self.name}-{next(self._domain_ids)}"
+            self.domains[domain] = node
+            self.auth.configure_curve_callback(domain=domain, credentials_provider=self)
+            self.nodes.append(node)
+        return domain
+
+    def detach(self, node):
+        with self._lock:
+            self.nodes = [x for x in self.nodes if x is not node]
+            for domain in [d for d, x in self.domains.items() if x is node]:
+                del self.domains[domain]
+                if self.auth is not None:
+                    self.auth.credentials_providers.pop(domain, None)
+            last = not self.nodes
+        if last and self.autoclose:
+            self.close()
+
+    def callback(self, domain, key):
+        """CURVE credentials provider: is key in the keyring of the node
+        whose ZAP domain this is?"""
+        node = self.domains.get(domain)
+        return node is not None and node.certs.callback(domain, key)
+
+    def stats(self):
+        """how many nodes we have and how many threads and file descriptors
+        the process gained, per node, since we started. Our own threads (the
+        authenticator, the contexts' I/O and reaper threads, the who-are-you
+        service) are in there too, so the per node numbers keep shrinking
+        as nodes are added"""
+        now = process_footprint()
+        ret = dict(nodes=len(self.nodes), io_threads=self.io_threads, **now)
+        for what, n in now.items():
+            per_node = None
+            if n is not None and self.nodes:
+                per_node = (n - self.baseline[what]) / len(self.nodes)
+            ret[f"{what}_per_node"] = per_node
+        return ret
+
+    def close(self):
+        self.autoclose = False  # the nodes detaching below mustn't close us again
+        for node in list(self.nodes):
+            node.closekill()
+        if self.auth is not None:
+            self.auth.stop()
+            self.auth = None
+        if self._own_wai_service:
+            self.wai_service.close()
+        if self._own_cleartext_ctx:
+            self.cleartext_ctx.destroy(1)
+        self.ctx.destroy(1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name}, {len(self.nodes)} nodes)"
@@ -0,0 +1,129 @@
+# coding: utf-8
+
+import zmq
+
+DEFAULT_SOCKOPTS = "default"
+
+# "*" applies to every socket type; "pub" and "sub" cover XPUB and XSUB too
+SOCKOPT_PROFILES = {
+    # libzmq's own defaults: 1000 message HWMs, OS buffer sizes, no keepalive
+    "default": {},
+    # producers that burst faster than the slowest peer drains; the PUB
+    # drops and the DEALERs block only after a lot more has piled up
+    "bursty": {
+        "pub": dict(sndhwm=100000, sndbuf=1 << 20),
+        "sub": dict(rcvhwm=100000, rcvbuf=1 << 20),
+        "router": dict(sndhwm=100000, rcvhwm=100000),
+        "dealer": dict(sndhwm=100000, rcvhwm=100000),
+    },
+    # notice peers that vanished without closing their connections (NAT
+    # timeouts, pulled cables) in a couple of minutes instead of hours
+    "keepalive": {
+        "*": dict(
+            tcp_keepalive=1,
+            tcp_keepalive_idle=60,
+            tcp_keepalive_intvl=10,
+            tcp_keepalive_cnt=6,
+        ),
+    },
+}
+
+
+def _socket_types(key):
+    """the socket types (None: all of them) a profile key applies to"""
+    if key in (None, "*"):
+        return (None,)
+    if isinstance(key, int):
+        return (key,)
+    name = key.upper()
+    try:
+        stype = getattr(zmq, name)
+    except AttributeError as e:
+        raise ValueError(f"unknown socket type {key!r}") from e
+    if name in ("PUB", "SUB"):
+        return (stype, getattr(zmq, "X" + name))
+    return (stype,)
+
+
+def _option(name):
+    try:
+        opt = getattr(zmq, name.upper())
+    except AttributeError as e:
+        raise ValueError(f"unknown socket option {name!r}") from e
+    if opt == zmq.CONFLATE:
+        # libzmq conflates single frames, and every jzmq message is multipart
+        raise ValueError("conflate would keep the last frame of each message only")
+    return opt
+
+
+class SocketOptions:
+    """socket type -> {option name: value}, applied by StupidNode.mk_socket()
+
+    Options are the lower case zmq names (sndhwm, tcp_keepalive, ...).
+    Later updates win, and options for a specific type win over the "*"
+    ones. HWMs and buffer sizes only affect connections made after they're
+    set, which is why mk_socket() applies them before anything is bound or
+    connected.
+
+    Setting xpub_nodrop on the pub gets its HWM drops counted (see
+    StupidNode.hwm_drops), but then one full subscriber queue fails the send
+    for every subscriber.
+    """
+
+    def __init__(self, *profiles):
+        self.options = dict()
+        for profile in profiles:
+            self.update(profile)
+
+    def update(self, profile):
+        if isinstance(profile, str):
+            try:
+                profile = SOCKOPT_PROFILES[profile]
+            except KeyError as e:
+                raise ValueError(
+                    f"unknown sockopt profile {profile!r}, "
+                    f"try one of {tuple(SOCKOPT_PROFILES)}"
+                ) from e
+        elif isinstance(profile, SocketOptions):
+            profile = profile.options
+        for key, opts in profile.items():
+            for name in opts:
+                _option(name)
+            for stype in _socket_types(key):
+                self.options.setdefault(stype, dict()).update(opts)
+        return self
+
+    def for_type(self, stype):
+        ret = dict(self.options.get(None, ()))
+        ret.update(self.options.get(stype, ()))
+        return ret
+
+    def apply(self, socket):
+        for name, value in self.for_type(socket.type).items():
+            socket.setsockopt(_option(name), value)
+        return socket
+
+    @staticmethod
+    def parse(spec):
+        """'dealer.sndhwm=5000' -> {'dealer': {'sndhwm': 5000}}"""
+        try:
+            what, value = spec.split("=", 1)
+            key, name = what.rsplit(".", 1) if "." in what else ("*", what)
+            return {key: {name: int(value, 0)}}
+        except ValueError as e:
+            raise ValueError(f"expected [type.]option=integer, not {spec!r}") from e
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}{self.options}"
+
+
+def make_sockopts(spec=DEFAULT_SOCKOPTS):
+    """turn a profile name, a {type: {option: value}} dict, a list of those
+    or a SocketOptions into a SocketOptions"""
+    if isinstance(spec, SocketOptions):
+        return spec
+    if spec is None:
+        return SocketOptions()
+    if isinstance(spec, (list, tuple)):
+        return SocketOptions(*spec)
+    return SocketOptions(spec)
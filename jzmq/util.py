@@ -200,3 +200,9 @@ def get_ports(ports=DEFAULT_PORTS, proto=DEFAULT_PROTO, max_tries=10):
     raise Exception(
         f"unable to find a set of ports starting at {oports} (ending near {ports})"
     )
+
+
+def scrub_identity_name_for_certfile(x):
+    if isinstance(x, (bytes, bytearray)):
+        x = x.decode()
+    return re.sub(r"[^\w\d_-]+", "_", x)
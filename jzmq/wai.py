@@ -0,0 +1,147 @@
+# coding: utf-8
+
+import os
+import logging
+from collections import namedtuple
+from threading import Thread, Lock, Event
+
+import zmq
+
+WHO_ARE_YOU = b"Who are you?"
+DEFAULT_WAI_TIMEOUT = 5  # seconds to wait for a "Who are you?" reply
+
+# who answers the "Who are you?"s a node gets: one thread for every node in
+# the process, the node's own poll() (so nobody can learn its key while it
+# isn't polling) or any WhoAreYouService
+WAI_SHARED = "shared"
+WAI_POLL = "poll"
+DEFAULT_WAI_SERVICE = WAI_SHARED
+
+log = logging.getLogger(__name__)
+
+
+class WhoAreYouOptions(
+    namedtuple(
+        "WhoAreYouOptions",
+        ("timeout", "service", "cleartext_ctx"),
+        defaults=(DEFAULT_WAI_TIMEOUT, DEFAULT_WAI_SERVICE, None),
+    )
+):
+    """how a node asks and answers "Who are you?" (StupidNode(wai_opts=...))
+
+    timeout is how long we wait for a peer's answer (see bootstrap()).
+    service is WAI_SHARED (the Runtime's service; shared_wai_service() for a
+    node without one), WAI_POLL or a WhoAreYouService. cleartext_ctx is the
+    context for the REP and REQ sockets of a node without a Runtime (see
+    shared_cleartext_context())
+    """
+
+
+class WhoAreYouService:
+    """one thread answering "Who are you?" on the REP sockets of any number
+    of nodes
+
+    register(node) hands node.rep to the thread, which calls
+    node.who_are_you_reply() whenever it's readable; unregister(node) hands
+    it back (it returns once the thread has let go, so the node can close
+    the socket). The thread sleeps in zmq_poll() until a REP or a
+    (un)registration wakes it, and exits when it has nothing left to watch.
+    close() gives back the pipe that wakes it, once nothing is registered.
+    """
+
+    def __init__(self, name="jzmq-wai"):
+        self.name = name
+        self.answered = 0
+        self._lock = Lock()
+        self._pending = list()  # (REP, node or None to unregister, Event)
+        self._thread = None
+        self._wake_r, self._wake_w = os.pipe()
+
+    def register(self, node):
+        self._request(node.rep, node)
+
+    def unregister(self, node):
+        self._request(node.rep, None)
+
+    def _request(self, rep, node):
+        done = Event()
+        with self._lock:
+            self._pending.append((rep, node, done))
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        os.write(self._wake_w, b".")
+        done.wait()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    @property
+    def closed(self):
+        return self._wake_r is None
+
+    def close(self):
+        with self._lock:
+            if self._thread is not None:
+                raise RuntimeError(f"{self} still has nodes registered")
+            if self._wake_r is not None:
+                os.close(self._wake_r)
+                os.close(self._wake_w)
+                self._wake_r = self._wake_w = None
+
+    def _run(self):
+        poller = zmq.Poller()
+        poller.register(self._wake_r, zmq.POLLIN)
+        nodes = dict()  # REP -> node
+        while True:
+            for item, _ in poller.poll():
+                if item == self._wake_r:
+                    os.read(self._wake_r, 4096)
+                    continue
+                node = nodes.get(item)
+                if node is None:
+                    continue
+                try:
+                    node.who_are_you_reply()
+                    self.answered += 1
+                except Exception:  # pylint: disable=broad-except
+                    log.exception("error answering for %s", node)
+            with self._lock:
+                pending, self._pending = self._pending, list()
+                for rep, node, done in pending:
+                    if node is not None:
+                        nodes[rep] = node
+                        poller.register(rep, zmq.POLLIN)
+                    elif nodes.pop(rep, None) is not None:
+                        poller.unregister(rep)
+                    done.set()
+                if not nodes:
+                    self._thread = None
+                    return
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name}, running={self.running})"
+
+
+_shared = dict()
+_shared_lock = Lock()
+
+
+def shared_wai_service():
+    """the WhoAreYouService nodes use unless they're told otherwise"""
+    with _shared_lock:
+        if "service" not in _shared:
+            _shared["service"] = WhoAreYouService()
+        return _shared["service"]
+
+
+def shared_cleartext_context():
+    """one context for the REP and REQ sockets of every node in the process
+    that asks for it (WhoAreYouOptions(cleartext_ctx=WAI_SHARED)); nodes
+    never destroy it. With cleartext_ctx=None a node makes (and destroys) its
+    own, and any other value is a zmq.Context to use"""
+    with _shared_lock:
+        if "ctx" not in _shared:
+            _shared["ctx"] = zmq.Context()
+        return _shared["ctx"]
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import os
 import re
 import logging
 from collections import namedtuple
@@ -28,9 +29,27 @@ class Tdesc(namedtuple("Tdesc", ("mtype", "tag", "src", "rcpt"))):
         return self.rcpt[0]
 
 
-def read_tarch_description(file="NOTES.txt"):
+def next_ports():
+    """the next set of free ports, as "port0,port1,..." (see jzmq.Endpoint)"""
     global ports
+    ports = get_ports(increment_ports(ports))
+    return ",".join(str(x) for x in ports)
 
+
+def tarch_addr(transport, name, ipc_dir=None):
+    """where node name listens on the inproc and ipc transports; ipc socket
+    files go in ipc_dir, which the caller has to clean up"""
+    if transport == "ipc":
+        if ipc_dir is None:
+            raise ValueError("ipc nodes need an ipc_dir for their socket files")
+        return f"ipc://{os.path.abspath(ipc_dir)}/{name}"
+    return f"{transport}://tarch-{name}"
+
+
+def read_tarch_description(file="NOTES.txt", transport="tcp", ipc_dir=None):
+    """nodes and tests from file; on the inproc and ipc transports the
+    nodes don't take any ports (and inproc ones have to share a Runtime).
+    ipc nodes listen in ipc_dir (see tarch_addr())"""
     node_map = dict()
     test_list = list()
     node_connection_re = re.compile(r"\b(?P<lhs>[A-Z])\s*→\s*(?P<rhs>[A-Z])\b")
@@ -51,9 +70,13 @@ def read_tarch_description(file="NOTES.txt"):
             if all_test or "TEST_ARCH" in line:
                 for lhs, rhs in node_connection_re.findall(line):
                     for _hs in (lhs, rhs):
-                        if _hs not in node_map:
-                            ports = get_ports(increment_ports(ports))
-                            pstring = ",".join(str(x) for x in ports)
+                        if _hs not in node_map and transport != "tcp":
+                            addr = tarch_addr(transport, _hs, ipc_dir)
+                            node_map[_hs] = Ndesc(
+                                f"tarch({_hs})@{transport}", addr, addr, list()
+                            )
+                        elif _hs not in node_map:
+                            pstring = next_ports()
                             node_map[_hs] = Ndesc(
                                 f"tarch({_hs}):{pstring}",
                                 f"*:{pstring}",
@@ -70,7 +93,7 @@ def read_tarch_description(file="NOTES.txt"):
     for node in node_map.values():
         log.debug(
             "[read desc] found node %s with endpoints %s",
-            node.ident.split(":")[0],
+            re.split(r"[:@]", node.ident)[0],
             node.endpoints,
         )
     for test in test_list:
@@ -79,7 +102,7 @@ def read_tarch_description(file="NOTES.txt"):
     return TarchDesc(node_map, test_list)
 
 
-def generate_nodes(tarch_desc):
+def generate_nodes(tarch_desc, keyring="t/test-keyring", **node_kw):
     tmp = list()
 
     log.info("creating tarch nodes")
@@ -89,7 +112,7 @@ def generate_nodes(tarch_desc):
         raddrs = tuple(tarch_desc[n].raddr for n in endpn)
         rids = tuple(tarch_desc[n].ident for n in endpn)
         log.info("creating %s → %s", tn.ident, ", ".join(rids))
-        rn = Node(tn.laddr, identity=tn.ident, keyring="t/test-keyring")
+        rn = Node(tn.laddr, identity=tn.ident, keyring=keyring, **node_kw)
         tmp.append((rn, raddrs))
 
     for node, raddrs in tmp:
@@ -4,6 +4,7 @@
 import os
 import time
 import logging
+import tempfile
 from glob import glob
 import pytest
 import zmq
@@ -18,11 +19,40 @@ def always_true():
     return True
 
 
+class FakeClock:
+    def __init__(self, t=1000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def free_ports():
+    """free_ports(n): n sets of free ports ("port0,port1,..." each), for nodes
+    to listen on ("*:{ports}") and be found at ("localhost:{ports}")"""
+
+    def allocate(n):
+        return [t.arch.next_ports() for _ in range(n)]
+
+    return allocate
+
+
 # NOTE: it's tempting to try to use @pytest.mark.parametrize here, but
 # that doesn't work on fixtures... it only generates fixtures for test functions
 @pytest.fixture(scope="session", params=["NOTES.txt"] + glob("t/resource/tarch/*.txt"))
-def tarch_desc(request):
-    yield t.arch.read_tarch_description(file=request.param)
+def tarch_file(request):
+    yield request.param
+
+
+@pytest.fixture(scope="session")
+def tarch_desc(tarch_file):
+    yield t.arch.read_tarch_description(file=tarch_file)
 
 
 @pytest.fixture(scope="session")
@@ -36,16 +66,47 @@ def tarch_tests(tarch_desc):
 
 
 @pytest.fixture(scope="function")
-def tarch(tarch_desc):
-    log.info("created tarch nodes")
-    nodes = t.arch.generate_nodes(tarch_desc.arch)
-    time.sleep(0.1)  # give everything an moment to connect
-
-    yield nodes
+def make_tarch(tarch_file, tarch_desc):
+    """make_tarch(transport="tcp", **node_kw) makes the tarch nodes with
+    node_kw, listening on transport; they're closed when the test is done.
+    inproc endpoints only reach sockets in the same context, so inproc nodes
+    share a Runtime unless node_kw has one; ipc nodes listen in a temporary
+    directory of their own"""
+    made, runtimes, ipc_dirs = list(), list(), list()
+
+    def make(transport="tcp", **node_kw):
+        desc = tarch_desc
+        if transport != "tcp":
+            ipc_dir = None
+            if transport == "ipc":
+                ipc_dirs.append(tempfile.TemporaryDirectory(prefix="jzmq-tarch-"))
+                ipc_dir = ipc_dirs[-1].name
+            desc = t.arch.read_tarch_description(
+                file=tarch_file, transport=transport, ipc_dir=ipc_dir
+            )
+        if transport == "inproc" and "runtime" not in node_kw:
+            node_kw["runtime"] = jzmq.Runtime()
+            runtimes.append(node_kw["runtime"])
+        log.info("creating tarch nodes")
+        nodes = t.arch.generate_nodes(desc.arch, **node_kw)
+        made.extend(nodes)
+        time.sleep(0.1)  # give everything an moment to connect
+        return nodes
+
+    yield make
 
     log.info("destroying tarch nodes")
-    for node in nodes:
+    for node in made:
         node.closekill()
+    for runtime in runtimes:
+        runtime.close()
+    for ipc_dir in ipc_dirs:
+        ipc_dir.cleanup()
+
+
+@pytest.fixture(scope="function")
+def tarch(make_tarch):
+    yield make_tarch()
 
 
 #################### logging filter opts
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import pytest
+from jzmq.aio import AsyncNode
+from jzmq.outbound import OutboundOptions
+
+MSG_WAIT = 2  # seconds
+
+
+def test_async_nodes(tmp_path, free_ports):  # pylint: disable=undefined-loop-variable
+    # both nodes share one keyring; the authenticators see each other's
+    # keys as they're created
+    keyring = str(tmp_path)
+    pa, pb = free_ports(2)
+
+    async def main():
+        A = AsyncNode(f"*:{pa}", identity="aio_A", keyring=keyring)
+        B = AsyncNode(f"*:{pb}", identity="aio_B", keyring=keyring)
+        try:
+            await A.aconnect_to_endpoints(f"localhost:{pb}")
+            assert A.endpoints[0].identity == "aio_B"
+
+            # PUB drops everything until the SUB's subscription shows up
+            for _ in range(int(MSG_WAIT / 0.1)):
+                await B.publish_message("hello")
+                try:
+                    msg = await asyncio.wait_for(A.recv(), 0.1)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+            assert str(msg) == "hello"
+            assert msg.name == "aio_B"
+            await asyncio.sleep(0.1)
+            while not A.incoming.empty():
+                A.incoming.get_nowait()
+
+            await A.publish_message("hi there")
+            msg = await asyncio.wait_for(B.recv(), MSG_WAIT)
+            assert str(msg) == "hi there"
+
+            await B.route_message("aio_A", "psst")
+            async for msg in A:
+                assert str(msg) == "psst"
+                break
+
+            A.disconnect_from_endpoint("aio_B")
+            assert len(A._tasks) == len(A.dispatch) + 1
+        finally:
+            await A.aclose()
+            await B.aclose()
+
+    asyncio.run(main())
+
+
+def test_async_outbound(tmp_path, free_ports):
+    # dealer sends queue in the node's Outbound when the peer's HWM is full,
+    # and the awaitable completes once they've been flushed
+    keyring = str(tmp_path)
+    pa, pb = free_ports(2)
+    sockopts = {"dealer": dict(sndhwm=1, sndbuf=4096)}
+    big = "x" * (1 << 16)
+
+    async def main():
+        A = AsyncNode(f"*:{pa}", identity="aio_A", keyring=keyring, sockopts=sockopts)
+        B = AsyncNode(f"*:{pb}", identity="aio_B", keyring=keyring, sockopts=sockopts)
+        try:
+            await A.aconnect_to_endpoints(f"localhost:{pb}")
+            sends = [A.deal_message(f"{i} {big}") for i in range(20)]
+            assert len(A.outbound[A.dealer[0]]) > 0
+            await asyncio.wait_for(asyncio.gather(*sends), MSG_WAIT)
+            assert not A.outbound[A.dealer[0]].queue
+            got = [await asyncio.wait_for(B.recv(), MSG_WAIT) for _ in range(20)]
+            assert [str(m).split()[0] for m in got] == [str(i) for i in range(20)]
+        finally:
+            await A.aclose()
+            await B.aclose()
+
+        with pytest.raises(ValueError):
+            AsyncNode(
+                f"*:{pa}",
+                identity="aio_A",
+                keyring=keyring,
+                outbound_opts=OutboundOptions(policy="block"),
+            )
+
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+from jzmq import Node
+from jzmq.wai import WhoAreYouOptions
+
+WAIT = 0.5  # seconds connect_to_endpoints() waits for answers
+
+
+def test_bootstrap_past_dead_seed(tmp_path, free_ports):
+    keyring = str(tmp_path)
+    pa, pb, pc = free_ports(3)  # nobody listens on pc, yet
+    A = Node(
+        f"*:{pa}",
+        identity="boot_A",
+        keyring=keyring,
+        wai_opts=WhoAreYouOptions(timeout=WAIT),
+    )
+    B = Node(f"*:{pb}", identity="boot_B", keyring=keyring)
+    C = None
+    try:
+        start = time.monotonic()
+        assert A.who_are_you_request(A._as_endpoint(f"localhost:{pc}")) == (None, None)
+        A.connect_to_endpoints(f"localhost:{pc}", f"localhost:{pb}")
+        assert time.monotonic() - start < 4 * WAIT
+        assert [str(e) for e in A.endpoints] == ["boot_B"]
+        assert len(A.bootstrapping) == 1  # still asking the dead one
+
+        C = Node(f"*:{pc}", identity="boot_C", keyring=keyring)
+        deadline = time.monotonic() + 10
+        while len(A.endpoints) < 2 and time.monotonic() < deadline:
+            A.poll(100)
+        assert [str(e) for e in A.endpoints] == ["boot_B", "boot_C"]
+        assert not A.bootstrapping and not A.wai
+        assert [d.kind for d in A.dispatch.values()].count("wai") == 0
+    finally:
+        for node in (A, B, C):
+            if node is not None:
+                node.closekill()
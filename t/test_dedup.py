@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# coding: utf-8
+# pylint: disable=redefined-outer-name
+
+import pytest
+from jzmq.msg import Tag
+from jzmq.dedup import (
+    DedupCache,
+    OrderedDedup,
+    BloomDedup,
+    SequenceDedup,
+    make_dedup,
+)
+
+
+def test_ordered_dedup(clock):
+    dd = OrderedDedup(window=10, clock=clock)
+    t0, t1 = Tag("t0"), Tag("t1")
+
+    assert not dd.seen(t0, update=True)
+    assert dd.seen(t0)
+    assert not dd.seen(t1)
+    assert t1 not in dd
+
+    clock.t += 5
+    dd.add(t1)
+    assert len(dd) == 2
+
+    clock.t += 6
+    assert not dd.seen(t0)  # expired
+    assert dd.seen(t1)
+    assert dd.stats() == dict(size=1, hits=2, misses=3, evictions=0, expired=1)
+
+
+def test_ordered_dedup_maxlen(clock):
+    dd = OrderedDedup(window=10, maxlen=3, clock=clock)
+    tags = [Tag(f"t{i}") for i in range(5)]
+    for tag in tags:
+        dd.add(tag)
+    assert len(dd) == 3
+    assert dd.evictions == 2
+    assert tags[0] not in dd
+    assert tags[-1] in dd
+
+
+def test_make_dedup():
+    dd = make_dedup("ordered", window=3)
+    assert isinstance(dd, OrderedDedup)
+    assert dd.window == 3
+    assert make_dedup(dd) is dd
+    assert isinstance(make_dedup(OrderedDedup), OrderedDedup)
+    with pytest.raises(ValueError):
+        make_dedup("nope")
+
+
+def test_dedup_cache_is_abstract():
+    class NoExpire(DedupCache):  # pylint: disable=abstract-method
+        def add(self, tag):
+            pass
+
+        def __contains__(self, tag):
+            return False
+
+        def __len__(self):
+            return 0
+
+    with pytest.raises(TypeError):
+        NoExpire()  # pylint: disable=abstract-class-instantiated
+    with pytest.raises(TypeError):
+        make_dedup(NoExpire)
+
+
+def test_bloom_dedup(clock):
+    dd = BloomDedup(window=10, fp_rate=0.01, max_bytes=4096, clock=clock)
+    tags = [Tag("sender", time=float(i)) for i in range(500)]
+
+    for tag in tags:
+        assert not dd.seen(tag, update=True)
+    assert all(dd.seen(tag) for tag in tags)
+    assert dd.nbytes <= 4096
+    assert 0 < dd.fill < 1
+    assert dd.estimated_fp_rate < 0.01
+
+    fresh = [Tag("other", time=float(i)) for i in range(1000)]
+    assert sum(tag in dd for tag in fresh) < 50
+
+    clock.t += 10
+    assert all(dd.seen(tag) for tag in tags)  # still inside the window
+    clock.t += 10
+    dd.expire()
+    assert not any(tag in dd for tag in tags)
+    assert dd.expired == 500
+
+
+def test_bloom_dedup_stays_flat(clock):
+    dd = BloomDedup(window=10, fp_rate=0.01, max_bytes=1024, clock=clock)
+    for i in range(20 * dd.capacity):
+        dd.add(Tag("sender", time=float(i)))
+    assert dd.nbytes <= 1024
+    assert dd.evictions > 0
+    assert len(dd) <= 2 * dd.capacity
+    assert dd.stats()["estimated_fp_rate"] < 0.05
+
+
+def test_sequence_dedup(clock):
+    dd = SequenceDedup(window=10, reorder=8, clock=clock)
+    tags = [Tag("sender", time=float(i), seq=i) for i in range(1, 30)]
+
+    assert not dd.seen(tags[0], update=True)
+    assert dd.seen(tags[0])
+    assert not dd.seen(tags[3], update=True)  # 2 and 3 still pending
+    assert not dd.seen(tags[1], update=True)  # late, but not a repeat
+    assert dd.seen(tags[1])
+    assert not dd.seen(tags[20], update=True)  # 3 and 5..13 never made it
+
+    stats = dd.peer_stats("sender")
+    assert stats["hwm"] == 21
+    assert stats["reordered"] == 1
+    assert stats["lost"] == 10
+    assert dd.losses == {"sender": 10}
+    assert dd.seen(tags[0])  # too old to tell, so call it a repeat
+
+    restarted = Tag("sender", time=100.0, seq=1)
+    assert not dd.seen(restarted, update=True)
+    assert dd.seen(restarted)
+    assert dd.peer_stats("sender")["restarts"] == 1
+    assert len(dd.peers) == 1
+
+
+def test_sequence_dedup_channels(clock):
+    # each channel is numbered on its own: a node that only gets the default
+    # channel sees no gaps, and the same number on two channels isn't a repeat
+    dd = SequenceDedup(window=10, reorder=8, clock=clock)
+    tags = dict()
+    for channel in ("", "news"):
+        for i in range(1, 20):
+            tags[channel, i] = Tag("sender", time=float(i), seq=i)
+            tags[channel, i].channel = channel
+    for i in range(1, 20):
+        assert not dd.seen(tags["", i], update=True)
+    assert dd.losses == {"sender": 0}
+    assert not dd.seen(tags["news", 1], update=True)
+    assert dd.seen(tags["news", 1])
+    assert dd.peer_stats("sender", "news")["hwm"] == 1
+    assert len(dd.peers) == 2
+
+
+def test_sequence_dedup_joined_late(clock):
+    # we first hear from sender at 5; 4 was only reordered, not a repeat, and
+    # 1..3 (sent before we joined) don't count as lost when they never come
+    dd = SequenceDedup(window=10, reorder=8, clock=clock)
+    tags = [Tag("sender", time=float(i), seq=i) for i in range(1, 30)]
+
+    assert not dd.seen(tags[4], update=True)
+    assert not dd.seen(tags[3], update=True)
+    assert dd.seen(tags[3])
+    assert not dd.seen(tags[20], update=True)  # 6..13 never made it
+
+    stats = dd.peer_stats("sender")
+    assert stats["reordered"] == 1
+    assert stats["duplicates"] == 1
+    assert stats["lost"] == 8
+
+
+def test_sequence_dedup_fallback(clock):
+    dd = SequenceDedup(window=10, clock=clock)
+    t0, t1 = Tag("a", seq=1), Tag("b")
+    assert not dd.seen(t0, update=True)
+    assert not dd.seen(t1, update=True)
+    assert t0 in dd and t1 in dd
+    assert len(dd.fallback) == 1
+    assert dd.stats()["peers"] == 1
+
+    clock.t += dd.peer_timeout + 1
+    dd.expire()
+    assert not dd.peers
+    assert t0 not in dd
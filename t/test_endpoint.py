@@ -1,5 +1,6 @@
 # coding: utf-8
 
+import zmq
 from jzmq.endpoint import (
     Endpoint,
     DEFAULT_PUBLISH_PORT,
@@ -31,3 +32,21 @@ def test_url():
     assert urlendpoint.pub == 123
     assert urlendpoint.pull == 456
     assert urlendpoint.router == 457
+
+
+def test_named():
+    inproc = Endpoint("inproc://node-a")
+    assert inproc.proto == "inproc" and inproc.host == "node-a"
+    assert inproc.named and not inproc.curve
+    assert inproc.format(zmq.XPUB) == "inproc://node-a-pub"
+    assert inproc.format(zmq.DEALER) == "inproc://node-a-router"
+    assert inproc.format(zmq.REQ) == "inproc://node-a-rep"
+    assert inproc.format(zmq.PUSH) == "inproc://node-a-pull"  # as on tcp
+
+    ipc = Endpoint("ipc:///run/jzmq/node:a")
+    assert ipc.host == "/run/jzmq/node:a" and ipc.named and not ipc.curve
+    assert ipc.format(zmq.SUB) == "ipc:///run/jzmq/node:a-pub"
+    assert repr(ipc) == "ipc:///run/jzmq/node:a"
+
+    assert Endpoint("tcp://host:80").curve
+    assert not Endpoint("host:80").named
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import time
+import shutil
+import zmq.auth
+from jzmq import Node
+from jzmq.keyring import Keyring
+
+
+def mk_key(keyring, name):
+    zmq.auth.create_certificates(str(keyring), name)
+    public_key, _ = zmq.auth.load_certificate(os.path.join(keyring, name + ".key"))
+    return public_key
+
+
+def test_keyring_index(tmp_path, clock):
+    keys = Keyring(str(tmp_path / "keyring"), interval=5, clock=clock)
+    assert not keys.rescan()  # no directory yet is just an empty keyring
+    assert keys.get("a") is None
+
+    os.makedirs(keys.path)
+    ka = mk_key(keys.path, "a")
+    assert not keys.maybe_rescan()  # not due yet
+    clock.t += 5
+    assert keys.maybe_rescan() == {"a": (None, ka)}
+    assert keys.get("a") == ka and "a" in keys and len(keys) == 1
+    assert keys.callback("*", ka) and not keys.callback("*", b"x" * 40)
+
+    rescans = keys.rescans
+    assert not keys.rescan()  # nothing changed, nothing re-parsed
+    assert not keys.callback("*", b"x" * 40)
+    assert keys.rescans == rescans + 1  # unknown key, same directory: no rescan
+
+    # a cert copied in is allowed right away, without waiting for the timer
+    kb = mk_key(keys.path, "b")
+    assert keys.callback("*", kb)
+    assert keys.get("b") == kb
+
+    os.unlink(keys.pathname("a"))
+    ka2 = mk_key(keys.path, "a2")
+    os.replace(keys.pathname("a2"), keys.pathname("a"))
+    os.unlink(keys.pathname("b"))
+    assert keys.rescan() == {"a": (ka, ka2), "b": (kb, None)}
+    assert not keys.callback("*", ka) and not keys.callback("*", kb)
+    assert keys.callback("*", ka2)
+    # changes() has everything rescan() found, including the callback's
+    assert keys.changes() == {"a": (None, ka2)}
+    assert not keys.changes()
+
+    kc = mk_key(str(tmp_path), "c")
+    assert keys.add("some.host:1234", kc) == keys.pathname("some_host_1234")
+    assert keys.get("some.host:1234") == kc
+    assert keys.add("some.host:1234", ka) == keys.pathname("some.host:1234")
+    assert keys.get("some.host:1234") == kc  # the existing key file wins
+    assert not keys.rescan()  # add() already indexed it
+    assert not [x for x in os.listdir(keys.path) if x.endswith(".tmp")]
+
+
+def test_keyring_rescan_without_restart(tmp_path, free_ports):
+    pa, pb = free_ports(2)
+    a = Node(f"*:{pa}", identity="A", keyring=str(tmp_path / "A"))
+    b = Node(f"*:{pb}", identity="B", keyring=str(tmp_path / "B"))
+    try:
+        # A's auth thread is already running and has never heard of B
+        assert a.certs.get("B") is None
+        b.connect_to_endpoint(f"localhost:{pa}")
+        assert b.certs.get("A") == a.pubkey
+
+        shutil.copy(b.key_filename, a.certs.path)
+        deadline = time.time() + 5
+        got = list()
+        while time.time() < deadline and not got:
+            a.publish_message("hi from A")
+            got = [str(m) for m in b.poll(100)]
+        assert got == ["hi from A"]
+        assert a.certs.get("B") == b.pubkey
+    finally:
+        a.closekill()
+        b.closekill()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pytest
+import zmq
+from jzmq.outbound import Outbound
+
+
+class FakeDealer:
+    """takes room messages, then raises zmq.Again like a DEALER at its HWM"""
+
+    def __init__(self, room=0):
+        self.room = room
+        self.sent = list()
+
+    def send_multipart(self, parts, flags=0):
+        assert flags == zmq.NOBLOCK
+        if not self.room:
+            raise zmq.Again()
+        self.room -= 1
+        self.sent.append(parts)
+
+    def poll(self, timeout=None, flags=zmq.POLLIN):  # pylint: disable=unused-argument
+        return zmq.POLLOUT if self.room else 0
+
+
+def fill(out, n):
+    return [out.send((f"m{i}".encode(),)) for i in range(n)]
+
+
+def test_outbound_queue():
+    sock = FakeDealer(room=1)
+    out = Outbound(sock, max_messages=2)
+    assert fill(out, 3) == [True, True, True]
+    assert sock.sent == [(b"m0",)]
+    assert len(out) == 2
+
+    sock.room = 10
+    assert out.flush()
+    assert sock.sent == [(b"m0",), (b"m1",), (b"m2",)]
+    assert out.stats() == dict(depth=0, sent=3, queued=2, dropped=0, slow=False)
+
+
+@pytest.mark.parametrize(
+    "policy, kept, queue",
+    [
+        ("drop-oldest", [True] * 4, [b"m2", b"m3"]),
+        ("drop-newest", [True, True, False, False], [b"m0", b"m1"]),
+        ("block", [True, True, False, False], [b"m0", b"m1"]),
+        ("disconnect", [True, True, False, False], [b"m0", b"m1"]),
+    ],
+)
+def test_outbound_overflow(policy, kept, queue):
+    out = Outbound(FakeDealer(), max_messages=2, policy=policy, timeout=0.01)
+    assert fill(out, 4) == kept
+    assert [parts[0] for parts in out.queue] == queue
+    assert out.dropped == 2
+    assert out.slow == (policy == "disconnect")
+
+
+def test_outbound_evicted():
+    evicted = list()
+    out = Outbound(FakeDealer(), max_messages=2, on_evict=evicted.append)
+    assert fill(out, 4) == [True] * 4
+    assert evicted == [(b"m0",), (b"m1",)]
+
+
+def test_outbound_policy():
+    seen = list()
+    out = Outbound(FakeDealer(), max_messages=1, policy=lambda o, p: seen.append(p))
+    fill(out, 2)
+    assert seen == [(b"m1",)]
+    with pytest.raises(ValueError):
+        Outbound(FakeDealer(), policy="shrug")
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pytest
+from jzmq.msg import RoutedMessage
+from jzmq.route import (
+    RouteTable,
+    RouteQueue,
+    RetryScheduler,
+    DistanceVector,
+    DV_INFINITY,
+)
+
+
+def rmsg(dest, text, name="A"):
+    return RoutedMessage(dest, text, name=name)
+
+
+def test_route_ranking(clock):
+    rt = RouteTable(clock=clock)
+    assert "E" not in rt
+    assert rt.get("E") is None
+
+    rt.learn("E", ("B", "C", "D"))
+    clock.t += 1
+    rt.learn("E", ("X", "D"))
+    assert [r.path for r in rt.candidates("E")] == [("X", "D"), ("B", "C", "D")]
+    assert rt.get("E") == ("X", "D")
+    assert rt.best("E").next_hop == "X"
+    assert rt.best("E").to == ("X", "E")
+    assert rt.best("E").hops == 3
+
+    rt.learn("D")
+    assert rt.best("D").to == ("D",)
+    assert sorted(rt) == ["D", "E"]
+
+
+def test_route_failover(clock):
+    rt = RouteTable(max_failures=2, clock=clock)
+    short = rt.learn("E", ("X",))
+    long = rt.learn("E", ("B", "C"))
+
+    assert not rt.failed(short)
+    assert rt.candidates("E") == [long, short]  # failures rank before hops
+
+    rt.learn("E", ("X",))  # hearing about it again forgives it
+    assert short.failures == 0
+    assert rt.best("E") is short
+
+    rt.failed(short)
+    assert rt.failed(short)
+    assert rt.candidates("E") == [long]
+    assert rt.failed(long) is False and rt.failed(long) is True
+    assert "E" not in rt
+
+
+def test_route_expiry(clock):
+    rt = RouteTable(ttl=10, clock=clock)
+    rt.learn("A", ("B",))
+    clock.t += 6
+    rt.learn("A", ("C",))
+    rt.learn("B")
+    clock.t += 5
+    assert [r.path for r in rt.candidates("A")] == [("C",)]
+    assert len(rt) == 2
+    clock.t += 5
+    assert len(rt) == 0
+
+    rt.learn("A", ("B",))
+    rt.learn("A", ("C",))
+    rt.forget("A", ("B",))
+    assert rt.get("A") == ("C",)
+    rt.forget("A")
+    assert "A" not in rt
+
+
+def test_route_via_dealer(clock):
+    rt = RouteTable(clock=clock)
+    dealer = object()
+    down = rt.learn("E", ("D",))
+    up = rt.learn("E", ("D",), via=dealer)
+    assert up is not down
+    assert down.to == ("D", "E")
+    assert up.to == ("E",)  # the DEALER already knows where D is
+    assert up.next_hop == "D"
+
+    rt.learn("D", via=dealer)
+    rt.forget_via(dealer)
+    assert rt.candidates("E") == [down]
+    assert "D" not in rt
+
+
+def test_route_queue_limits(clock):
+    rq = RouteQueue(max_messages=3, ttl=10, clock=clock)
+    for i in range(5):
+        dropped = rq.put(rmsg("E", f"m{i}"))
+    assert [str(m) for m in dropped] == ["m1"]
+    rq.put(rmsg("D", "other"))
+    assert rq.dests == {"D", "E"}
+    assert len(rq) == 4
+
+    clock.t += 11
+    rq.put(rmsg("E", "late"))
+    assert [str(m) for m in rq.pop("E")] == ["late"]
+    assert "D" not in rq
+    assert rq.stats()["dropped"] == 2
+    assert rq.stats()["expired"] == 4
+
+    small = RouteQueue(max_bytes=1, clock=clock)
+    small.put(rmsg("E", "x" * 100))
+    assert len(small) == 1  # always keep the newest one
+    small.put(rmsg("E", "y"))
+    assert [str(m) for m in small.pop("E")] == ["y"]
+
+
+class CountingQueue(RouteQueue):
+    encoded = list()
+
+    @staticmethod
+    def _encode(msg):
+        CountingQueue.encoded.append(msg)
+        return RouteQueue._encode(msg)
+
+
+def test_route_queue_spill(clock, tmp_path):
+    rq = CountingQueue(max_messages=2, spill=str(tmp_path), clock=clock)
+    for i in range(5):
+        assert not rq.put(rmsg(("B", "E.1"), f"m{i}"))
+    assert len(rq) == 2
+    assert rq.stats()["spilled"] == 3
+    assert len(rq.encoded) == 5  # spooling reuses the frames put() encoded
+
+    # a restarted node finds what the old one spooled, under its real name
+    # (the file name is scrubbed to E_1)
+    rq = RouteQueue(spill=str(tmp_path), clock=clock)
+    assert "E.1" in rq
+    assert rq.dests == {"E.1"}
+    msgs = rq.pop("E.1")
+    assert [str(m) for m in msgs] == ["m0", "m1", "m2"]
+    assert msgs[0].to == ("B", "E.1")
+    assert msgs[0].name == "A"
+    assert "E.1" not in rq
+
+
+def test_retry_backoff(clock):
+    rs = RetryScheduler(base=1, cap=5, jitter=0.5, clock=clock, rand=lambda: 0.5)
+    assert rs.timeout() is None
+    assert rs.failed("E") == clock.t + 0.75
+    assert rs.failed("E") == clock.t + 0.75  # already scheduled
+    assert not rs.due()
+    assert rs.timeout() == 0.75
+
+    delays = list()
+    for _ in range(5):
+        clock.t += 10
+        assert rs.due() == ["E"]
+        delays.append(rs.failed("E") - clock.t)
+    assert delays == [1.5, 3, 3.75, 3.75, 3.75]  # capped at 5, less jitter
+
+    rs.reset("E")
+    assert "E" not in rs
+    clock.t += 10
+    assert not rs.due()  # the stale heap entry is ignored
+    assert rs.stats()["retries"] == 5
+
+
+def test_retry_discovery(clock):
+    rs = RetryScheduler(base=1, cap=4, clock=clock, rand=lambda: 0)
+    rs.failed("E")
+    assert rs.discover("E")
+    assert not any(rs.discover("E") for _ in range(20))
+    clock.t += 1
+    assert rs.due() == ["E"]
+    rs.failed("E")
+    assert rs.discover("E")
+    clock.t += 1
+    assert not rs.discover("E")  # we've backed off to 2s
+    assert rs.stats()["discoveries"] == 2
+    assert rs.stats()["suppressed"] == 21
+
+
+def test_distance_vector(clock):
+    # A - B - C on a line, all adverts going through encode()/decode()
+    tables = {name: RouteTable(clock=clock) for name in "ABC"}
+    dv = {
+        name: DistanceVector(tables[name], name, interval=30, clock=clock)
+        for name in "ABC"
+    }
+    links = {"A": "B", "B": "AC", "C": "B"}
+
+    def exchange():
+        adverts = {name: DistanceVector.encode(dv[name].advert()) for name in dv}
+        for name, parts in adverts.items():
+            for neighbor in links[name] if parts else ():
+                dv[neighbor].receive(name, DistanceVector.decode(parts))
+        return sum(bool(parts) for parts in adverts.values())
+
+    assert exchange() == 0  # nothing to say until somebody asks
+    dv["A"].full()
+    dv["C"].full()
+    assert exchange() == 2
+    assert exchange() == 1  # B passes on what it learned, once
+    assert exchange() == 2  # A and C pass on the other end, once
+    assert exchange() == 0
+    assert tables["A"].best("C").to == ("B", "C")
+    assert tables["A"].best("C").hops == 2
+    assert dv["A"].table()["C"] == (2, "B")
+
+    # A told B about C, but B won't route back through A for it
+    assert dv["A"].advertised["C"] == (2, "B")
+    assert len(tables["B"].candidates("C")) == 1
+
+    # C goes away: B withdraws it, A follows
+    tables["B"].forget("C")
+    assert dv["B"].advert() == [("C", DV_INFINITY, "B")]
+    dv["A"].receive("B", [("C", DV_INFINITY, "B")])
+    assert "C" not in tables["A"]
+    assert dv["A"].advert() == [("C", DV_INFINITY, "A")]
+
+    clock.t += 31
+    assert len(dv["A"].advert()) == 2  # time for a full one
+    assert dv["A"].stats()["full"] == 2
+
+    with pytest.raises(ValueError):
+        DistanceVector.decode(("C", "2"))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import pytest
+import t.arch
+from jzmq import Node, Runtime
+
+
+def test_runtime_tarch(tmp_path):
+    desc = t.arch.read_tarch_description(file="NOTES.txt")
+    with Runtime(io_threads=2) as runtime:
+        nodes = t.arch.generate_nodes(desc.arch, keyring=str(tmp_path), runtime=runtime)
+        assert len(runtime.nodes) == len(nodes)
+        assert all(node.ctx is runtime.ctx for node in nodes)
+        assert all(node.auth is runtime.auth for node in nodes)
+        assert all(node.wai_service is runtime.wai_service for node in nodes)
+
+        A = nodes["A"]
+        others = [node for node in nodes if node is not A]
+        got = set()
+        deadline = time.monotonic() + 5
+        while len(got) < len(others) and time.monotonic() < deadline:
+            A.publish_message("hi")
+            for node in others:
+                if [str(msg) for msg in node.poll(10)]:
+                    got.add(node.identity)
+        assert len(got) == len(others)
+
+        stats = runtime.stats()
+        assert stats["nodes"] == len(nodes) and stats["io_threads"] == 2
+        if stats["threads"] is not None:
+            # on their own, each would have an auth thread and two I/O
+            # and reaper threads; here they split the runtime's
+            assert stats["threads_per_node"] < 2
+
+        nodes["E"].closekill()
+        assert len(runtime.nodes) == len(nodes) - 1
+        assert not runtime.ctx.closed
+        with pytest.raises(RuntimeError):
+            runtime.wai_service.close()  # the others are still registered
+    assert runtime.ctx.closed and not runtime.nodes
+    assert runtime.wai_service.closed
+
+
+def test_runtime_trust_per_node(tmp_path, free_ports):
+    pa, pb = free_ports(2)
+    with Runtime() as runtime:
+        A = Node(
+            f"*:{pa}", identity="trust_A", keyring=str(tmp_path / "a"), runtime=runtime
+        )
+        B = Node(
+            f"*:{pb}", identity="trust_B", keyring=str(tmp_path / "b"), runtime=runtime
+        )
+        assert A.zap_domain != B.zap_domain
+        assert A.pub.zap_domain.decode() == A.zap_domain
+        assert B.router.zap_domain.decode() == B.zap_domain
+
+        # A's keyring only vouches for the connections to A's sockets
+        assert runtime.callback(A.zap_domain, A.pubkey)
+        assert not runtime.callback(B.zap_domain, A.pubkey)
+        assert runtime.callback(B.zap_domain, B.pubkey)
+        assert not runtime.callback("*", A.pubkey)
+
+        domain = B.zap_domain
+        B.closekill()
+        assert not runtime.callback(domain, B.pubkey)
+        assert domain not in runtime.auth.credentials_providers
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import pytest
+import zmq
+from jzmq.sockopts import SocketOptions, make_sockopts, SOCKOPT_PROFILES
+
+
+def test_sockopt_profiles():
+    opts = make_sockopts(["keepalive", "bursty", {"dealer": {"sndhwm": 5}}])
+    assert opts.for_type(zmq.DEALER)["sndhwm"] == 5
+    assert opts.for_type(zmq.DEALER)["tcp_keepalive"] == 1
+    assert opts.for_type(zmq.XPUB)["sndhwm"] == 100000  # "pub" covers XPUB
+    assert opts.for_type(zmq.REP) == SOCKOPT_PROFILES["keepalive"]["*"]
+    assert make_sockopts(opts) is opts
+    assert make_sockopts(None).for_type(zmq.PUB) == {}
+
+    assert SocketOptions.parse("router.rcvhwm=0x10") == {"router": {"rcvhwm": 16}}
+    assert SocketOptions.parse("immediate=1") == {"*": {"immediate": 1}}
+    for bad in ("sndhwm", "dealer.sndhwm=lots"):
+        with pytest.raises(ValueError):
+            SocketOptions.parse(bad)
+    for bad in ("nope", {"dealer": {"nope": 1}}, {"nope": {"sndhwm": 1}}):
+        with pytest.raises(ValueError):
+            make_sockopts(bad)
+    with pytest.raises(ValueError):
+        make_sockopts({"sub": {"conflate": 1}})  # our messages are multipart
+
+
+def test_sockopt_apply():
+    opts = make_sockopts([{"*": {"immediate": 1}, "dealer": {"sndhwm": 7}}])
+    ctx = zmq.Context()
+    try:
+        dealer = opts.apply(ctx.socket(zmq.DEALER))
+        assert dealer.sndhwm == 7
+        assert dealer.immediate == 1
+        sub = opts.apply(ctx.socket(zmq.SUB))
+        assert sub.sndhwm == 1000  # untouched
+    finally:
+        ctx.destroy(0)
@@ -3,7 +3,20 @@
 # pylint: disable=redefined-outer-name
 
 import pytest
-from jzmq.msg import TaggedMessage, Tag, StupidMessage, RoutedMessage
+import zmq
+from jzmq.msg import (
+    TaggedMessage,
+    Tag,
+    StupidMessage,
+    RoutedMessage,
+    WIRE_TEXT,
+    WIRE_BINARY,
+    WIRE_MAGIC,
+    WIRE_FLAG_HOPS,
+    channel_frame,
+    channel_filters,
+    decode_channel,
+)
 
 
 def test_no_prefix():
@@ -20,6 +33,7 @@ def test_tags():
 
     assert t1 != t2
     assert t1 == t3
+    assert t1 != Tag("t1", time=t1.time, seq=1)  # same tick, different message
     assert t1.time > 0
     assert t2.time >= t1.time
 
@@ -71,3 +85,126 @@ def test_rm():
     assert rm0.to == rm1.to
     assert rm0.tag == rm1.tag
     assert tuple(rm0) == tuple(rm1)
+
+
+def test_binary_tag():
+    t0 = Tag("t0", seq=7)
+    packed = t0.encode(wire=WIRE_BINARY)
+    assert packed[0] == WIRE_MAGIC
+
+    t1 = Tag.decode(packed)
+    assert t1 == t0
+    assert t1.time == t0.time  # bit-for-bit, no decimal round trip
+    assert t1.seq == 7
+    assert TaggedMessage(packed, "m").seq == 7
+    assert Tag.decode(memoryview(packed)) == t0
+
+
+def test_binary_tag_flags():
+    # a flagged tag may carry more after the name; today's decoders skip it
+    t0 = Tag("t0", seq=3, flags=WIRE_FLAG_HOPS)
+    packed = t0.pack() + b"\x01\x01B"
+    t1 = Tag.decode(packed)
+    assert t1 == t0 and t1.flags == WIRE_FLAG_HOPS
+    assert Tag.decode(Tag("t0").pack()).flags == 0
+
+
+def test_tag_decode_legacy_and_garbage():
+    t0 = Tag("t0", time=3.5)
+    assert Tag.decode(t0.encode(wire=WIRE_TEXT)) == t0
+    assert Tag.decode(str(t0)) == t0
+    assert Tag.decode(b"not a tag") is None
+    assert Tag.decode("<not a tag") is None
+    with pytest.raises(ValueError):
+        Tag.decode(t0.encode(wire=WIRE_BINARY)[:5])
+
+
+@pytest.mark.parametrize(
+    "frame",
+    (
+        Tag("truncated").pack()[:5],  # cut inside the fixed header
+        Tag("truncated").pack()[:-3],  # cut inside the name
+        Tag("x").pack()[:-1] + b"\xff",  # name isn't utf-8
+    ),
+)
+def test_tag_decode_malformed(frame):
+    with pytest.raises(ValueError):
+        Tag.decode(frame)
+    with pytest.raises(ValueError):
+        TaggedMessage.from_frames((zmq.Frame(frame), zmq.Frame(b"body")))
+    with pytest.raises(ValueError):
+        RoutedMessage.decode((b"dest", frame, b"body"))
+
+
+@pytest.mark.parametrize("wire", (WIRE_TEXT, WIRE_BINARY))
+def test_wire_roundtrip(m1, wire):
+    m1d = TaggedMessage(*m1.encode(wire=wire))
+    assert m1d == m1
+    assert tuple(m1d) == ("m1",)
+
+    rm0 = RoutedMessage(("hop", "dest"), "part0", "part1")
+    rm1 = RoutedMessage.decode(rm0.encode(wire=wire))
+    assert rm1.to == ("hop", "dest")
+    assert rm1.tag == rm0.tag
+    assert tuple(rm1) == ("part0", "part1")
+
+
+def test_from_frames(m1):
+    frames = tuple(zmq.Frame(x) for x in m1.encode())
+    m1f = TaggedMessage.from_frames(frames)
+    assert m1f == m1
+    assert m1f.encode() is frames
+
+    seen = list()
+    assert TaggedMessage.from_frames(frames, accept=seen.append) is None
+    assert seen == [m1.tag]
+
+    rm0 = RoutedMessage("dest", "part0")
+    parts = [zmq.Frame(x) for x in rm0.encode()]
+    rm1 = RoutedMessage.decode(parts, keep_frames=True)
+    assert rm1.to == ("dest",)
+    assert tuple(rm1) == ("part0",)
+    rm1.to = ("hop", "dest")
+    assert rm1.encode() == (b"hop", b"dest") + tuple(parts[1:])
+
+
+def test_from_frames_lazy_payload():
+    # the payload isn't utf-8, but nothing reads it: a relay can look at the
+    # tag and forward the frames without ever decoding them
+    blob = bytes(range(256)) * 4096
+    frames = tuple(zmq.Frame(x) for x in (Tag("A").pack(), b"!BCAST!", blob))
+    msg = TaggedMessage.from_frames(frames)
+    assert len(msg) == 2
+    assert msg.part_is(0, "!BCAST!") and not msg.part_is(1, "!BCAST!")
+    assert not msg.part_is(2, "!BCAST!")
+    assert msg.raw(1) == blob
+    assert msg.encode() is frames
+
+    # reading the payload decodes it (and a bad one raises only then)
+    with pytest.raises(UnicodeDecodeError):
+        tuple(msg)
+    msg = TaggedMessage.from_frames(frames[:2] + (zmq.Frame(b"ok"),))
+    assert msg[1] == "ok" and str(msg) == "!BCAST! ok"
+
+
+def test_channels():
+    msg = TaggedMessage("hi", name="A", channel="news")
+    parts = msg.encode()
+    assert parts[0] == channel_frame("news")
+    assert parts[0].startswith(channel_filters("news")[0])
+
+    msg2 = TaggedMessage(*parts)
+    assert msg2.channel == "news"
+    assert msg2.tag == msg.tag
+    assert tuple(msg2) == ("hi",)
+    assert RoutedMessage.decode(parts) is None
+
+    msg3 = TaggedMessage.from_frames([zmq.Frame(x) for x in parts])
+    assert msg3.channel == "news"
+    assert tuple(msg3) == ("hi",)
+
+    # the default channel has no channel frame, its filters match the tag
+    plain = TaggedMessage("hi", name="A").encode()
+    assert decode_channel(plain[0]) is None
+    assert any(plain[0].startswith(f) for f in channel_filters(""))
+    assert not any(parts[0].startswith(f) for f in channel_filters(""))
@@ -2,9 +2,13 @@
 # coding: utf-8
 
 import os
+import time
 import logging
 import pytest
+import zmq
 from jzmq import Node
+from jzmq.msg import Tag, TaggedMessage, RoutedMessage
+from jzmq.dedup import DEFAULT_REORDER_WINDOW
 
 TEST_REPETITIONS = int(os.environ.get("JZMQ_TARCH_REPEAT", 5))
 MSG_WAIT_MS = int(os.environ.get("JZMQ_TARCH_MSG_WAIT", 10))
@@ -35,6 +39,26 @@ def test_tarch_construction(tarch, tarch_names):
         assert getattr(tarch, k) is tarch[k]
 
 
+def test_dispatch_table(tarch):
+    for node in tarch:
+        assert len(node.dispatch) == 2 + 2 * len(node.endpoints)
+        assert node.dispatch[node.router].kind == "router"
+        assert node.dispatch[node.pub].kind == "pub"
+        assert set(node.outbound) == set(node.dealer)
+        for idx, (sub, deal) in enumerate(zip(node.sub, node.dealer)):
+            assert node.dispatch[sub][:3] == ("sub", idx, node.endpoints[idx])
+            assert node.dispatch[deal][:3] == ("dealer", idx, node.endpoints[idx])
+
+    node = tarch.A
+    first, *rest = node.endpoints
+    assert node.disconnect_from_endpoint(first) is first
+    assert node.endpoints == rest
+    assert len(node.dispatch) == 2 + 2 * len(rest)
+    assert list(node.outbound_stats()) == rest
+    for idx, sub in enumerate(node.sub):
+        assert node.dispatch[sub].idx == idx
+
+
 class PollWrapper:
     def __init__(self, tarch):
         self.tarch = tarch
@@ -82,6 +106,48 @@ def test_publish_from_A(tarch, loop):
             assert node.received_messages == correct
 
 
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+def test_zero_copy_relay(make_tarch, tarch_names, tarch_tests):
+    tarch = make_tarch(zero_copy=True)
+    for test in tarch_tests:
+        with PollWrapper(tarch) as do_poll:
+            if test.mtype == "M":
+                tarch[test.src].publish_message(test.msg)
+                _continue_tarch_test(tarch, tarch_names, test, do_poll)
+
+
+@pytest.mark.parametrize("transport", ["inproc", "ipc"])
+def test_named_relay(make_tarch, tarch_names, tarch_tests, transport):
+    # no ports and no CURVE: inproc nodes share the Runtime's context, ipc
+    # ones a directory only we can get into
+    tarch = make_tarch(transport)
+    assert all(not node.endpoint.curve for node in tarch)
+    min_loops = (len(tarch) - 1) * 2
+    for test in tarch_tests:
+        with PollWrapper(tarch) as do_poll:
+            if test.mtype == "M":
+                tarch[test.src].publish_message(test.msg)
+                _continue_tarch_test(tarch, tarch_names, test, do_poll)
+            else:
+                tarch[test.src].route_message(tarch[test.dst], test.msg)
+                _continue_tarch_test(
+                    tarch, tarch_names, test, do_poll, min_loops=min_loops
+                )
+
+
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+def test_batch_drain(tarch):
+    burst = [f"burst({i})" for i in range(10)]
+    for msg in burst:
+        tarch.B.publish_message(msg)
+    time.sleep(0.1)
+
+    tarch.A.max_batch = 3
+    assert [str(x) for x in tarch.A.poll(MSG_WAIT_MS)] == burst[:3]
+    tarch.A.max_batch = 32
+    assert [str(x) for x in tarch.A.poll(MSG_WAIT_MS)] == burst[3:]
+
+
 def _continue_tarch_test(tarch, tarch_names, test, do_poll, min_loops=1):
     log.info("polling ran for count=%d round(s)", do_poll(min_loops=min_loops))
     log.info("we expect nodes=%s should have heard the message", test.rcpt)
@@ -125,3 +191,223 @@ def test_tarch_routed_msgs(tarch, tarch_names, tarch_tests):
                 _continue_tarch_test(
                     tarch, tarch_names, test, do_poll, min_loops=min_loops
                 )
+
+
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+def test_route_burst_coalesced(tarch):
+    node = tarch.A
+    for i in range(20):
+        node.route_message("nobody", f"lost({i})")
+    # one "where is" for the whole burst, every message waits for a retry
+    assert node.retry.stats()["discoveries"] == 1
+    assert node.retry.stats()["suppressed"] == 19
+    assert len(node.route_queue.pop("nobody")) == 20
+
+
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+def test_route_outbound_full(tarch):
+    # a message the DEALER's outbound queue drops is a failed route, like one
+    # the ROUTER's HWM refuses: we try the next route, then queue for a retry
+    node = tarch.A
+    sock = node.dealer[0]
+    node.routes.learn("faraway", ("hop0",), via=sock)
+    node.routes.learn("faraway", ("hop1", "hop2"), via=sock)
+    first = node.routes.best("faraway")
+    sends = list()
+
+    def send(parts):
+        sends.append(parts)
+        return len(sends) > 1  # drop the first one
+
+    node.outbound[sock].send = send
+    node.route_message("faraway", "hi")
+    assert len(sends) == 2
+    assert first.failures == 1
+    assert "faraway" not in node.route_queue
+
+    node.outbound[sock].send = lambda parts: False
+    node.route_message("faraway", "again")
+    assert len(node.route_queue.pop("faraway")) == 1
+
+
+class StuckDealer:
+    """a DEALER whose peer never reads: nothing goes out, ever"""
+
+    def send_multipart(self, parts, flags=0):
+        raise zmq.Again()
+
+    def poll(self, timeout=None, flags=zmq.POLLIN):  # pylint: disable=unused-argument
+        return 0
+
+
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+def test_route_outbound_evicted(tarch):
+    # drop-oldest makes room in a full outbound queue by pushing out what was
+    # queued first; routed messages it pushes out wait for a retry instead
+    node = tarch.A
+    sock = node.dealer[0]
+    node.routes.learn("faraway", ("hop0",), via=sock)
+    out = node.outbound[sock]
+    out.sock, out.max_messages = StuckDealer(), 2
+    for i in range(5):
+        node.route_message("faraway", f"m{i}")
+    assert [RoutedMessage.decode(p).msg for p in out.queue] == ["m3", "m4"]
+    assert "faraway" not in node.route_queue
+    node.run_timers()
+    assert [m.msg for m in node.route_queue.pop("faraway")] == ["m0", "m1", "m2"]
+
+
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+def test_route_adverts_bounded(tarch, tarch_names):
+    # from cold, each node sends a full advert each time it's asked "where
+    # is", and otherwise only when its table changes, which (once per poll()
+    # at most) happens once per node it learns to reach; no advert carries
+    # more than one entry per node
+    n = len(tarch)
+    src, dst = tarch[tarch_names[-1]], tarch[tarch_names[0]]
+    with PollWrapper(tarch) as do_poll:
+        src.route_message(dst, "cold")
+        do_poll(min_loops=n * 3)  # (n - 1) * 2, with room to spare
+        assert dst.received_messages == ["cold"]
+    for node in tarch:
+        stats = node.dv.stats()
+        assert stats["sent"] <= stats["full"] + n - 1
+        assert stats["entries_sent"] <= stats["sent"] * n
+
+    # once the tables have converged, routing costs no control traffic
+    sent = sum(node.dv.sent for node in tarch)
+    with PollWrapper(tarch) as do_poll:
+        dst.route_message(src, "warm")
+        do_poll(min_loops=2)
+        assert src.received_messages == ["warm"]
+    assert sum(node.dv.sent for node in tarch) == sent
+
+
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+def test_channel_subscriptions(tarch, tarch_names):
+    n = len(tarch)
+    src, dst = tarch[tarch_names[0]], tarch[tarch_names[-1]]
+    dst.subscribe("news")
+    with PollWrapper(tarch) as do_poll:
+        # the subscription travels one hop per poll(), the adverts of who
+        # wants it (see RelayNode.send_interest()) one hop per poll() of all
+        # the nodes; on a stick they go the other way round
+        do_poll(min_loops=2 * n)
+        src.publish_message("extra", channel="news")
+        do_poll(min_loops=n)
+        for node in tarch:
+            assert node.received_messages == (["extra"] if node is dst else [])
+
+    dst.unsubscribe("news")
+    assert not dst.wants("news")
+    with PollWrapper(tarch) as do_poll:
+        src.publish_message("stale", channel="news")
+        do_poll(min_loops=n)
+        assert dst.received_messages == []
+
+
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+@pytest.mark.parametrize("tarch_file", ["t/resource/tarch/stick.txt"], indirect=True)
+def test_channel_stays_on_path(tarch):
+    # on the stick (A → B → C → D → E) news from A only has to get to C; D
+    # and E are off the subscribed path and never see it, not even to relay
+    tarch.C.subscribe("news")
+    msg = TaggedMessage("extra", name=tarch.A.identity, channel="news")
+    with PollWrapper(tarch) as do_poll:
+        do_poll(min_loops=2 * len(tarch))
+        tarch.A.publish_message(msg)
+        do_poll(min_loops=len(tarch))
+        assert [node.received_messages for node in tarch] == [
+            [],
+            [],
+            ["extra"],
+            [],
+            [],
+        ]
+    on_path = (tarch.A, tarch.B, tarch.C)
+    for node in tarch:
+        assert (msg.tag in node.recent) == (node in on_path)
+    assert tarch.D.interest[tarch.D.dealer[0]][1] == set()
+
+
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+@pytest.mark.parametrize("tarch_file", ["t/resource/tarch/stick.txt"], indirect=True)
+def test_channel_gaps_arent_losses(tarch):
+    # news from A goes to B and C only. If A numbered all its messages in one
+    # series, D and E would see every other number and, once the gaps left
+    # the reorder window, count them lost; news is numbered on its own
+    n = 2 * DEFAULT_REORDER_WINDOW
+    tarch.C.subscribe("news")
+    with PollWrapper(tarch) as do_poll:
+        do_poll(min_loops=2 * len(tarch))
+        for i in range(n):
+            tarch.A.publish_message(f"plain({i})")
+            tarch.A.publish_message(f"news({i})", channel="news")
+            do_poll()
+        do_poll(min_loops=len(tarch))
+        assert len(tarch.C.received_messages) == 2 * n
+        assert len(tarch.E.received_messages) == n
+    for node in tarch[1:]:
+        assert node.recent.losses == {tarch.A.identity: 0}
+
+
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+def test_publish_skipped_without_subscribers(tarch, tarch_names, tarch_desc):
+    # nodes nobody connects to (like E in NOTES.txt) have no subscribers, so
+    # their PUB sends are skipped; their DEALERs still carry the message
+    heard = {e for name in tarch_names for e in tarch_desc.arch[name].endpoints}
+    for name in tarch_names:
+        tarch[name].publish_message(f"anyone({name})?")
+        assert tarch[name].publish_skipped == (name not in heard)
+        assert tarch[name].published == (name in heard)
+
+
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+@pytest.mark.parametrize("zero_copy", (False, True))
+def test_malformed_frames_dropped(make_tarch, tarch_names, tarch_desc, zero_copy):
+    # zero_copy nodes only decode the payload when a message comes out of
+    # poll(), but a payload that isn't utf-8 is still dropped, not raised
+    tarch = make_tarch(zero_copy=zero_copy)
+    name = next(name for name in tarch_names if tarch_desc.arch[name].endpoints)
+    src, dst = tarch[name], tarch[tarch_desc.arch[name].endpoints[0]]
+    header = Tag("bad", seq=1).pack()
+    garbage = (
+        [header[:5]],
+        [header[:-1], b"body"],
+        [b"dest", header[:-1], b"x"],
+        [Tag("bad", seq=2).pack(), b"\xff\xfe not utf-8"],
+    )
+    with PollWrapper(tarch) as do_poll:
+        do_poll(min_loops=len(tarch))  # let the subscriptions settle
+        for parts in garbage:
+            src.dealer[0].send_multipart(parts)  # to dst's ROUTER
+            dst.pub.send_multipart(parts)  # to src's SUB
+        do_poll()
+        assert not any(node.received_messages for node in tarch)
+
+        # the bad frames were dropped, not raised; everything still works
+        src.publish_message("after")
+        do_poll(min_loops=len(tarch))
+        for node in tarch:
+            assert node.received_messages == ([] if node is src else ["after"])
+
+
+@pytest.mark.skipif(os.environ.get("JZMQ_SKIP_NETWORK"), reason="network disabled")
+def test_router_hwm_drops(make_tarch, tarch_names, tarch_desc):
+    # queues so short a couple of messages fill them
+    sockopts = {
+        "router": dict(sndhwm=1, sndbuf=4096),
+        "dealer": dict(rcvhwm=1, rcvbuf=4096),
+    }
+    tarch = make_tarch(sockopts=sockopts)
+    # the first node that connects to somebody sends back up its DEALER
+    name = next(name for name in tarch_names if tarch_desc.arch[name].endpoints)
+    src, dst = tarch[name], tarch[tarch_desc.arch[name].endpoints[0]]
+    assert src.router.sndhwm == 1 and src.dealer[0].rcvhwm == 1
+    for i in range(1000):
+        dst.route_message(src, f"flood({i})")
+        if dst.hwm_drops["router"]:
+            break
+    # nothing is lost: the message that hit the HWM waits for a retry
+    assert dst.hwm_drops["router"] == 1
+    assert len(dst.route_queue) == 1
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import time
+import threading
+from jzmq import Node
+from jzmq.wai import (
+    WhoAreYouOptions,
+    WAI_POLL,
+    WAI_SHARED,
+    shared_wai_service,
+    shared_cleartext_context,
+)
+
+
+def wai_threads():
+    return [t for t in threading.enumerate() if t.name == "jzmq-wai"]
+
+
+def test_shared_wai_service(tmp_path, free_ports):
+    keyring = str(tmp_path)
+    service = shared_wai_service()
+    pa, pb, pc = free_ports(3)
+    nodes = list()
+    try:
+        A = Node(f"*:{pa}", identity="wai_A", keyring=keyring)
+        nodes.append(A)
+        B = Node(f"*:{pb}", identity="wai_B", keyring=keyring)
+        nodes.append(B)
+        P = Node(
+            f"*:{pc}",
+            identity="wai_P",
+            keyring=keyring,
+            wai_opts=WhoAreYouOptions(service=WAI_POLL, cleartext_ctx=WAI_SHARED),
+        )
+        nodes.append(P)
+        assert len(wai_threads()) == 1 and service.running
+        assert P.cleartext_ctx is shared_cleartext_context()
+        assert A.wai_service is B.wai_service is service
+        assert P.wai_service is None
+
+        answered = service.answered
+        B.connect_to_endpoints(f"localhost:{pa}")
+        assert [str(e) for e in B.endpoints] == ["wai_A"]
+        assert service.answered == answered + 1
+
+        # nobody answers for P until P polls
+        assert B.who_are_you_request(B._as_endpoint(f"localhost:{pc}"), 0.2) == (
+            None,
+            None,
+        )
+        B.bootstrap(f"localhost:{pc}")
+        deadline = time.monotonic() + 5
+        while len(B.endpoints) < 2 and time.monotonic() < deadline:
+            P.poll(10)
+            B.poll(10)
+        assert [str(e) for e in B.endpoints] == ["wai_A", "wai_P"]
+    finally:
+        for node in nodes:
+            node.closekill()
+    assert not service.running and not wai_threads()
+    assert not service.closed  # the nodes' Runtimes don't own it
+    assert not shared_cleartext_context().closed